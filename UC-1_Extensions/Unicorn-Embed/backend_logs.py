@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Asynchronous log pump for llama-server subprocesses
+Backends are started with stdout/stderr piped; a pipe nobody reads fills
+up and llama-server then blocks mid-request on its next log write. Each
+pipe is drained by an asyncio task that keeps the recent lines in a
+bounded ring buffer (served by /admin/logs), forwards warnings and errors
+to the wrapper's log and turns llama-server's timing lines into metrics.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+import subprocess
+from collections import deque
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from metrics import BACKEND_LOG_LINES, BACKEND_TIMING, BACKEND_TOKENS_PER_SECOND, backend_labels
+
+logger = logging.getLogger(__name__)
+
+# Longest line kept whole; longer ones are cut here
+MAX_LINE_BYTES = 64 * 1024
+LEVELS = ("info", "warning", "error")
+
+# "prompt eval time =      12.34 ms /    45 tokens (    0.27 ms per token,  3645.57 tokens per second)"
+# (also "llama_perf_context_print:        load time =  1234.56 ms" and eval/total lines)
+TIMING_LINE = re.compile(
+    r"\b(?P<phase>load|prompt eval|eval|total) time\s*=\s*(?P<ms>[\d.]+) ms"
+    r"(?:\s*/\s*(?P<tokens>\d+) (?:tokens|runs))?"
+    r"(?:.*?(?P<tps>[\d.]+) tokens per second)?"
+)
+ERROR_LINE = re.compile(r"^E |\b(error|fatal|abort(ed)?|out of memory)\b", re.IGNORECASE)
+WARNING_LINE = re.compile(r"^W |\bwarn(ing)?\b", re.IGNORECASE)
+
+
+def classify(line: str) -> str:
+    if ERROR_LINE.search(line):
+        return "error"
+    if WARNING_LINE.search(line):
+        return "warning"
+    return "info"
+
+
+def parse_timing(line: str) -> Optional[Dict[str, Any]]:
+    """Phase, seconds, tokens and tokens/sec from a llama-server timing line"""
+    match = TIMING_LINE.search(line)
+    if not match:
+        return None
+    timing = {"phase": match["phase"].replace(" ", "_"), "seconds": float(match["ms"]) / 1000}
+    if match["tokens"]:
+        timing["tokens"] = int(match["tokens"])
+    if match["tps"]:
+        timing["tokens_per_second"] = float(match["tps"])
+    return timing
+
+
+class LogPump:
+    """Drains one backend process's pipes into a ring buffer"""
+
+    def __init__(self, base_url: str, process: subprocess.Popen, max_lines: int):
+        self.replica = urlsplit(base_url).netloc
+        self.model = backend_labels(base_url)["model"]
+        self.process = process
+        self.lines: deque = deque(maxlen=max_lines)
+        self.timings: Dict[str, Dict[str, Any]] = {}
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for stream, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            if pipe is not None:
+                self.tasks.append(asyncio.create_task(self._pump(stream, pipe)))
+
+    async def _pump(self, stream: str, pipe):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=MAX_LINE_BYTES)
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        except OSError as e:
+            logger.warning(f"Cannot read {stream} of {self.replica}: {e}")
+            return
+        while True:
+            try:
+                raw = await reader.readline()
+            except ValueError:
+                # Over MAX_LINE_BYTES: asyncio drops the buffered part, keep reading
+                self.handle_line(stream, "[line too long, truncated]")
+                continue
+            if not raw:
+                break
+            line = raw.decode(errors="replace").rstrip()
+            if line:
+                self.handle_line(stream, line)
+
+    def handle_line(self, stream: str, line: str):
+        level = classify(line)
+        entry = {"time": time.time(), "stream": stream, "level": level, "line": line}
+        timing = parse_timing(line)
+        if timing:
+            entry["timing"] = timing
+            self.timings[timing["phase"]] = timing
+            labels = {"model": self.model, "replica": self.replica, "phase": timing["phase"]}
+            BACKEND_TIMING.labels(**labels).observe(timing["seconds"])
+            if "tokens_per_second" in timing:
+                BACKEND_TOKENS_PER_SECOND.labels(**labels).observe(timing["tokens_per_second"])
+        self.lines.append(entry)
+        BACKEND_LOG_LINES.labels(model=self.model, stream=stream, level=level).inc()
+        # Routine lines stay in the ring buffer; only trouble reaches the wrapper log
+        log_level = {"error": logging.ERROR, "warning": logging.WARNING}.get(level, logging.DEBUG)
+        logger.log(log_level, f"[{self.model} {self.replica}] {line}")
+
+    def running(self) -> bool:
+        return self.process.poll() is None
+
+    def tail(self, lines: int, min_level: str = "info") -> Dict[str, Any]:
+        threshold = LEVELS.index(min_level)
+        entries = [entry for entry in self.lines if LEVELS.index(entry["level"]) >= threshold]
+        return {
+            "model": self.model,
+            "pid": self.process.pid,
+            "running": self.running(),
+            "exit_code": self.process.poll(),
+            "last_timings": self.timings,
+            "lines": entries[-lines:] if lines > 0 else [],
+        }
+
+    def last_line(self) -> Optional[str]:
+        return self.lines[-1]["line"] if self.lines else None
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class BackendLogs:
+    """Log pumps by replica, kept after the process exits for post-mortems"""
+
+    def __init__(self, max_lines: int = 500, keep_exited: int = 8):
+        self.max_lines = max_lines
+        self.keep_exited = keep_exited
+        self.pumps: Dict[str, LogPump] = {}
+
+    @classmethod
+    def from_env(cls) -> "BackendLogs":
+        return cls(
+            max_lines=int(os.getenv("BACKEND_LOG_LINES", "500")),
+            keep_exited=int(os.getenv("BACKEND_LOG_KEEP_EXITED", "8")),
+        )
+
+    def attach(self, base_url: str, process: subprocess.Popen) -> LogPump:
+        """Start draining a freshly launched backend (call from the event loop)"""
+        pump = LogPump(base_url, process, self.max_lines)
+        # A restarted replica replaces its predecessor's buffer
+        self.pumps.pop(pump.replica, None)
+        self._prune()
+        self.pumps[pump.replica] = pump
+        pump.start()
+        return pump
+
+    def _prune(self):
+        exited = [replica for replica, pump in self.pumps.items() if not pump.running()]
+        for replica in exited[:max(0, len(exited) - self.keep_exited)]:
+            del self.pumps[replica]
+
+    def last_line(self, base_url: str) -> Optional[str]:
+        pump = self.pumps.get(urlsplit(base_url).netloc)
+        return pump.last_line() if pump else None
+
+    def tail(self, backend: Optional[str] = None, lines: int = 100, min_level: str = "info") -> Dict[str, Any]:
+        """Recent lines per replica; `backend` filters by model name or host:port"""
+        return {
+            replica: pump.tail(lines, min_level)
+            for replica, pump in self.pumps.items()
+            if backend is None or backend in (replica, pump.model)
+        }
+
+    async def close(self):
+        await asyncio.gather(*(pump.close() for pump in self.pumps.values()))
+
+
+# Process-wide registry shared by every backend launcher
+backend_logs = BackendLogs.from_env()
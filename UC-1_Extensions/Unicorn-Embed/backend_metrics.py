@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Re-export llama-server's native Prometheus metrics through the wrapper
+Backends run with --metrics on private ports; their /metrics output is
+scraped (on an interval and/or when the wrapper's /metrics is requested)
+and re-exported as unicorn_backend_* series labelled by model and replica,
+so one scrape target shows both wrapper and model-side bottlenecks.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.parser import text_string_to_metric_families
+
+from upstream import upstream
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "unicorn_backend_"
+
+# (base_url, model name) for every backend that should currently be scraped
+BackendsFn = Callable[[], Iterable[Tuple[str, str]]]
+
+
+def _export_name(name: str) -> str:
+    """llamacpp:kv_cache_usage_ratio -> unicorn_backend_kv_cache_usage_ratio"""
+    return PREFIX + name.split(":", 1)[-1].replace(":", "_")
+
+
+class BackendMetricsCollector:
+    """Custom collector holding the latest scrape of every backend"""
+
+    def __init__(self, backends: BackendsFn, max_age: float = 5.0, timeout: float = 2.0):
+        self.backends = backends
+        self.max_age = max_age
+        self.timeout = timeout
+        # replica (host:port) -> (model, parsed families)
+        self.samples: Dict[str, Tuple[str, list]] = {}
+        self.up: Dict[str, Tuple[str, bool]] = {}
+        self.scraped_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _scrape_one(self, base_url: str, model: str):
+        replica = urlsplit(base_url).netloc
+        try:
+            response = await upstream.get(base_url, "/metrics", timeout=self.timeout)
+            response.raise_for_status()
+            families = list(text_string_to_metric_families(response.text))
+        except Exception as e:
+            logger.debug(f"Backend metrics scrape failed for {replica}: {e}")
+            self.samples.pop(replica, None)
+            self.up[replica] = (model, False)
+            return
+        self.samples[replica] = (model, families)
+        self.up[replica] = (model, True)
+
+    async def refresh(self):
+        """Scrape every current backend concurrently"""
+        async with self._lock:
+            backends = list(self.backends())
+            current = {urlsplit(base_url).netloc for base_url, _ in backends}
+            for replica in list(self.up):
+                if replica not in current:
+                    self.up.pop(replica)
+                    self.samples.pop(replica, None)
+            await asyncio.gather(*(self._scrape_one(base_url, model) for base_url, model in backends))
+            self.scraped_at = time.monotonic()
+
+    async def refresh_if_stale(self):
+        """On-demand scrape, skipped when the last one is younger than max_age"""
+        if time.monotonic() - self.scraped_at >= self.max_age:
+            await self.refresh()
+
+    def start(self, interval: float):
+        """Also scrape in the background every `interval` seconds (0 = on demand only)"""
+        if interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop(interval))
+
+    async def _loop(self, interval: float):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Backend metrics refresh failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def collect(self):
+        up = GaugeMetricFamily(PREFIX + "up", "Whether the last scrape of a backend succeeded", labels=["model", "replica"])
+        for replica, (model, ok) in self.up.items():
+            up.add_metric([model, replica], 1.0 if ok else 0.0)
+        yield up
+
+        exported: Dict[str, object] = {}
+        for replica, (model, families) in self.samples.items():
+            for family in families:
+                if family.type not in ("counter", "gauge"):
+                    continue
+                name = _export_name(family.name)
+                metric = exported.get(name)
+                for sample in family.samples:
+                    if family.type == "counter" and not sample.name.endswith("_total"):
+                        continue  # skip _created samples
+                    label_names = ["model", "replica"] + sorted(sample.labels)
+                    if metric is None:
+                        cls = CounterMetricFamily if family.type == "counter" else GaugeMetricFamily
+                        metric = exported[name] = cls(name, family.documentation, labels=label_names)
+                    metric.add_metric([model, replica] + [sample.labels[k] for k in sorted(sample.labels)], sample.value)
+        yield from exported.values()
+
+
+_collector: Optional[BackendMetricsCollector] = None
+
+
+def register_backends(backends: BackendsFn) -> BackendMetricsCollector:
+    """Create and register the process-wide collector (settings from env)"""
+    global _collector
+    if _collector is None:
+        _collector = BackendMetricsCollector(
+            backends,
+            max_age=float(os.getenv("BACKEND_METRICS_MAX_AGE", "5")),
+            timeout=float(os.getenv("BACKEND_METRICS_TIMEOUT", "2")),
+        )
+        REGISTRY.register(_collector)
+    return _collector
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Multi-input embedding batches for llama-server
+Packs texts into as few upstream calls as the backend's batch/context
+limits allow and reassembles the vectors in the original order
+"""
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from upstream import BackendSlots, upstream
+from tokenization import TokenCounter, estimate_tokens
+from metrics import BATCH_SIZE, QUEUE_WAIT, TOKENS_PER_SECOND, backend_labels
+
+logger = logging.getLogger(__name__)
+
+
+def plan_batches(
+    token_counts: Sequence[int],
+    max_items: int,
+    max_tokens: int,
+) -> List[List[int]]:
+    """Group item indices into batches bounded by item count and total tokens
+
+    An item larger than max_tokens gets a batch of its own rather than
+    being dropped; the backend decides whether it fits.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for index, tokens in enumerate(token_counts):
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _unwrap(embedding: Any) -> List[float]:
+    """Handle the nested [[float, ...]] shape returned by native llama-server"""
+    if isinstance(embedding, list) and embedding and isinstance(embedding[0], list):
+        return embedding[0]
+    if isinstance(embedding, list):
+        return embedding
+    return []
+
+
+def parse_embeddings(data: Any, count: int) -> List[List[float]]:
+    """Map a llama-server /embedding response back to input order
+
+    Accepts both the native list format [{"index": i, "embedding": ...}]
+    and the OpenAI {"data": [...]} format. Missing entries come back empty.
+    """
+    items = data.get("data", []) if isinstance(data, dict) else data
+    vectors: List[List[float]] = [[] for _ in range(count)]
+    if not isinstance(items, list):
+        return vectors
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or "embedding" not in item:
+            continue
+        index = item.get("index", position)
+        if 0 <= index < count:
+            vectors[index] = _unwrap(item["embedding"])
+    return vectors
+
+
+async def embed_batch(base_url: str, texts: List[str], timeout: float = 60) -> Tuple[List[List[float]], Optional[int]]:
+    """Embed a list of texts in one upstream call, with the prompt tokens of the call
+
+    Goes through the OpenAI-compatible endpoint, whose usage block carries
+    the prompt tokens of the whole batch (None if the backend omits it).
+    """
+    data = await upstream.post_json(base_url, "/v1/embeddings", {"input": texts}, timeout=timeout)
+    usage = data.get("usage") if isinstance(data, dict) else None
+    total = usage.get("prompt_tokens") if isinstance(usage, dict) else None
+    return parse_embeddings(data, len(texts)), total
+
+
+async def _embed_one_by_one(base_url: str, texts: List[str], timeout: float) -> Tuple[List[List[float]], List[Optional[int]]]:
+    """Fallback for a failed batch so one bad input does not sink its neighbours"""
+    vectors, counts = [], []
+    for text in texts:
+        try:
+            vector, count = await embed_batch(base_url, [text], timeout=timeout)
+        except Exception as e:
+            logger.error(f"Error getting embedding: {e}")
+            vector, count = [[]], 0
+        vectors.extend(vector)
+        counts.append(count)
+    return vectors, counts
+
+
+async def embed_with_fallback(
+    base_url: str, texts: List[str], timeout: float = 60
+) -> Tuple[List[List[float]], List[Optional[int]]]:
+    """Embed one planned batch, retrying item by item if the batch call fails
+
+    Also returns the backend's prompt tokens per text where they are known:
+    only for a text that went upstream on its own, since llama-server
+    reports one total per call. The rest come back as None.
+    """
+    try:
+        vectors, total = await embed_batch(base_url, texts, timeout=timeout)
+    except Exception as e:
+        if len(texts) == 1:
+            logger.error(f"Error getting embedding: {e}")
+            return [[]], [0]
+        logger.warning(f"Batch of {len(texts)} failed ({e}), retrying individually")
+        return await _embed_one_by_one(base_url, texts, timeout)
+    return vectors, [total] if len(texts) == 1 else [None] * len(texts)
+
+
+async def embed_texts(
+    base_url: str,
+    texts: List[str],
+    max_items: int = 64,
+    max_tokens: int = 2048,
+    concurrency: int = 2,
+    token_counts: Optional[List[int]] = None,
+    timeout: float = 60,
+) -> List[List[float]]:
+    """Embed any number of texts through batched upstream calls
+
+    Returns one vector per input in input order; inputs that could not be
+    embedded come back as empty lists so callers can apply their fallback.
+    """
+    if not texts:
+        return []
+    if token_counts is None:
+        token_counts = [estimate_tokens(text) for text in texts]
+
+    batches = plan_batches(token_counts, max_items, max_tokens)
+    results: List[List[float]] = [[] for _ in texts]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(indices: List[int]):
+        async with semaphore:
+            vectors, _ = await embed_with_fallback(base_url, [texts[i] for i in indices], timeout)
+        for index, vector in zip(indices, vectors):
+            results[index] = vector
+
+    await asyncio.gather(*(run(indices) for indices in batches))
+    logger.debug(f"Embedded {len(texts)} texts in {len(batches)} upstream batches")
+    return results
+
+
+@dataclass
+class _PendingText:
+    text: str
+    tokens: int
+    counted: bool  # tokens is exact, not the character estimate
+    future: asyncio.Future
+    enqueued: float
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests for one backend
+
+    Texts from every caller go into a shared queue. A dispatcher collects a
+    scheduling window of up to window_items texts (or whatever arrived
+    within max_wait_ms of the first), sorts it by token count and packs it
+    into batches bounded by max_batch_items and max_batch_tokens, so similar
+    lengths share a batch and each batch fills the backend's token budget.
+    Each caller's futures resolve in its own input order. Raising
+    max_wait_ms trades latency for larger batches; at most `concurrency`
+    batches are in flight, or as many as `slots` allows when the batcher
+    shares a backend's BackendSlots. Budgets use exact /tokenize counts,
+    memoized per text by `tokenizer` (or counts the caller already has),
+    so dense text (CJK, code, digits) cannot overfill the ubatch. A text
+    /tokenize could not count is sent on its own rather than packed by
+    its estimate. The same counts bill each caller for its own texts; a
+    text sent alone without one is billed from the backend's usage report.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_batch_items: int = 64,
+        max_batch_tokens: int = 2048,
+        max_wait_ms: float = 5.0,
+        concurrency: int = 2,
+        timeout: float = 60,
+        slots: Optional[BackendSlots] = None,
+        window_items: Optional[int] = None,
+        tokenizer: Optional[TokenCounter] = None,
+    ):
+        self.base_url = base_url
+        self.tokenizer = tokenizer or TokenCounter.from_env(base_url)
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.window_items = max(window_items or max_batch_items * 4, max_batch_items)
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        self._shared_slots = slots
+        self._slots: Optional[Union[asyncio.Semaphore, BackendSlots]] = None
+        self.in_flight: Set[asyncio.Task] = set()
+        self._carry: Optional[_PendingText] = None
+        self._window: List[_PendingText] = []
+        self._ready: "deque[List[_PendingText]]" = deque()
+        self.batches_sent = 0
+        self.texts_sent = 0
+
+    def _ensure_running(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.queue = asyncio.Queue()
+            self._slots = self._shared_slots or asyncio.Semaphore(self.concurrency)
+            self.dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def embed(self, texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[float]]:
+        """Queue texts for batching and wait for their vectors (input order)"""
+        vectors, _ = await self.embed_counted(texts, token_counts)
+        return vectors
+
+    async def embed_counted(
+        self, texts: List[str], token_counts: Optional[List[int]] = None
+    ) -> Tuple[List[List[float]], List[int]]:
+        """Like embed, plus the prompt tokens each text cost (0 where it failed)"""
+        if not texts:
+            return [], []
+        if token_counts is None:
+            token_counts = await self.tokenizer.count(texts, fallback=False)
+        self._ensure_running()
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text, tokens in zip(texts, token_counts):
+            future = loop.create_future()
+            counted = tokens is not None
+            pending = _PendingText(text, tokens if counted else estimate_tokens(text), counted, future, loop.time())
+            self.queue.put_nowait(pending)
+            futures.append(future)
+        results = await asyncio.gather(*futures)
+        return [vector for vector, _ in results], [count for _, count in results]
+
+    async def _next(self, timeout: Optional[float]) -> Optional[_PendingText]:
+        if self._carry is not None:
+            item, self._carry = self._carry, None
+            return item
+        if timeout is None:
+            return await self.queue.get()
+        if timeout <= 0:
+            return self.queue.get_nowait() if not self.queue.empty() else None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _collect(self, first: _PendingText) -> List[_PendingText]:
+        """Gather one scheduling window starting at `first`, until full or the deadline
+
+        The window fills on the batcher rather than in a local, so close()
+        can still fail its items if the dispatcher is cancelled mid-window.
+        """
+        self._window = [first]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(self._window) < self.window_items:
+            item = await self._next(deadline - asyncio.get_running_loop().time())
+            if item is None:
+                break
+            self._window.append(item)
+        window, self._window = self._window, []
+        return window
+
+    def _pack(self, window: List[_PendingText]) -> List[List[_PendingText]]:
+        """Sort a window by length and pack it into token-budget batches
+
+        Texts without an exact count go in batches of their own: their
+        estimate could undercount enough to overflow a shared ubatch.
+        """
+        counted = sorted((item for item in window if item.counted), key=lambda item: item.tokens)
+        plan = plan_batches([item.tokens for item in counted], self.max_batch_items, self.max_batch_tokens)
+        return [[counted[i] for i in indices] for indices in plan] + [[item] for item in window if not item.counted]
+
+    async def _dispatch_loop(self):
+        while True:
+            # Block for work before taking a slot, so an idle dispatcher holds none
+            first = None if self._ready else await self._next(None)
+            # Then wait for a free slot so texts keep accumulating while
+            # the backend is busy instead of being sent in tiny batches
+            try:
+                await self._slots.acquire()
+            except BaseException:
+                if first is not None:
+                    self._carry = first
+                raise
+            try:
+                if first is None:
+                    # Batches already packed from the previous window go first
+                    batch = self._ready.popleft()
+                else:
+                    batch, *rest = self._pack(await self._collect(first))
+                    self._ready.extend(rest)
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._send(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, batch: List[_PendingText]):
+        model = backend_labels(self.base_url)["model"]
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        for item in batch:
+            QUEUE_WAIT.labels(model=model).observe(sent - item.enqueued)
+        BATCH_SIZE.labels(model=model).observe(len(batch))
+        try:
+            vectors, reported = await embed_with_fallback(self.base_url, [item.text for item in batch], self.timeout)
+            counts = [
+                0 if not len(vector) else item.tokens if item.counted or count is None else count
+                for item, vector, count in zip(batch, vectors, reported)
+            ]
+            elapsed = loop.time() - sent
+            if elapsed > 0:
+                TOKENS_PER_SECOND.labels(model=model).observe(sum(counts) / elapsed)
+            self.batches_sent += 1
+            self.texts_sent += len(batch)
+            for item, vector, count in zip(batch, vectors, counts):
+                if not item.future.done():
+                    item.future.set_result((vector, count))
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": (self.queue.qsize() if self.queue else 0) + len(self._window) + sum(map(len, self._ready)),
+            "in_flight_batches": len(self.in_flight),
+            "batches_sent": self.batches_sent,
+            "texts_sent": self.texts_sent,
+            "avg_batch_size": round(self.texts_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+        }
+
+    async def close(self):
+        """Stop dispatching and fail anything still waiting"""
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+            self.dispatcher = None
+        pending = ([self._carry] if self._carry else []) + self._window
+        self._carry, self._window = None, []
+        while self._ready:
+            pending.extend(self._ready.popleft())
+        while self.queue and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for item in pending:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("Embedding batcher stopped"))
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Stand-in llama-server for benchmarking the wrappers without a GPU
+Accepts llama-server's command line (so a wrapper can launch it through
+LLAMA_SERVER_BIN) and serves /health, /embedding, /v1/embeddings, /rerank,
+/tokenize, /detokenize and /metrics. Compute is simulated by a cost model:
+one device processes requests in turn, each costing a fixed per-batch
+overhead plus a per-token and per-item time, so batching and slot settings
+change throughput the way they do on real hardware. Latency, cost and failures
+are configured with FAKE_LLAMA_* env vars or the matching flags.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("fake_llama_server")
+
+BOS, EOS = 1, 2
+
+
+def _env(name: str, default: str) -> str:
+    return os.getenv(f"FAKE_LLAMA_{name}", default)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    # llama-server flags the wrappers pass; the rest are accepted and ignored
+    parser.add_argument("--model", "-m", default="fake.gguf")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--embeddings", "--embedding", action="store_true")
+    parser.add_argument("--reranking", "--rerank", action="store_true")
+    parser.add_argument("--ctx-size", "-c", type=int, default=2048)
+    parser.add_argument("--parallel", "-np", type=int, default=1)
+    parser.add_argument("--batch-size", "-b", type=int, default=2048)
+    parser.add_argument("--ubatch-size", "-ub", type=int, default=512)
+
+    # Cost model and fault injection
+    parser.add_argument("--dim", type=int, default=int(_env("DIM", "768")))
+    parser.add_argument("--startup-s", type=float, default=float(_env("STARTUP_S", "0")),
+                        help="Seconds /health answers 503 'Loading model' after launch")
+    parser.add_argument("--batch-ms", type=float, default=float(_env("BATCH_MS", "4")),
+                        help="Fixed device time per request (kernel launch, pooling)")
+    parser.add_argument("--token-ms", type=float, default=float(_env("TOKEN_MS", "0.02")),
+                        help="Device time per prompt token")
+    parser.add_argument("--item-ms", type=float, default=float(_env("ITEM_MS", "0.2")),
+                        help="Device time per input (embedding) or pair (rerank)")
+    parser.add_argument("--jitter-ms", type=float, default=float(_env("JITTER_MS", "0")),
+                        help="Uniform random extra time per request")
+    parser.add_argument("--failure-rate", type=float, default=float(_env("FAILURE_RATE", "0")),
+                        help="Fraction of requests answered with --failure-status")
+    parser.add_argument("--failure-status", type=int, default=int(_env("FAILURE_STATUS", "500")))
+    parser.add_argument("--stall-rate", type=float, default=float(_env("STALL_RATE", "0")),
+                        help="Fraction of requests that also sleep --stall-ms (tail latency)")
+    parser.add_argument("--stall-ms", type=float, default=float(_env("STALL_MS", "1000")))
+    parser.add_argument("--seed", type=int, default=int(_env("SEED", "0")))
+    parser.add_argument("--log-timings", type=int, default=int(_env("LOG_TIMINGS", "1")),
+                        help="Write llama-server's per-task timing lines to stderr (blocks if nobody reads it)")
+    args, unknown = parser.parse_known_args(argv)
+    if unknown:
+        logger.debug(f"Ignoring llama-server flags: {unknown}")
+    return args
+
+
+class FakeFailure(Exception):
+    """Injected backend error, answered with --failure-status"""
+
+
+class FakeBackend:
+    """Deterministic vectors, scores and tokens behind a simulated device"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.started = time.monotonic()
+        self.random = random.Random(args.seed)
+        self.slots = asyncio.Semaphore(max(1, args.parallel))
+        self.device = asyncio.Lock()
+        self.vocab: Dict[str, int] = {}
+        self.words: List[str] = ["<unk>", "<s>", "</s>"]
+        self.counters = {"prompt_tokens_total": 0, "requests_total": 0, "failures_total": 0}
+        self.processing = 0
+        self.deferred = 0
+        self.tasks = 0
+
+    def loading(self) -> bool:
+        return time.monotonic() - self.started < self.args.startup_s
+
+    def tokenize(self, text: str, add_special: bool = True) -> List[int]:
+        ids = []
+        for word in text.split():
+            if word not in self.vocab:
+                self.vocab[word] = len(self.words)
+                self.words.append(word)
+            ids.append(self.vocab[word])
+        return [BOS] + ids + [EOS] if add_special else ids
+
+    def detokenize(self, tokens: List[int]) -> str:
+        return " ".join(self.words[t] for t in tokens if 2 < t < len(self.words))
+
+    @lru_cache(maxsize=65536)
+    def vector_json(self, text: str) -> str:
+        """Unit vector seeded by the text, pre-rendered so the fake adds little time of its own"""
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(self.args.dim).astype(np.float32)
+        return json.dumps((vector / np.linalg.norm(vector)).tolist())
+
+    @staticmethod
+    def score(query: str, document: str) -> float:
+        """Word-overlap relevance, so rankings are stable and not arbitrary"""
+        query_words, document_words = set(query.lower().split()), set(document.lower().split())
+        if not query_words or not document_words:
+            return -10.0
+        return 10.0 * len(query_words & document_words) / len(query_words) - 5.0
+
+    async def run(self, tokens: int, items: int):
+        """Hold a slot and the device for the modelled time; may inject faults"""
+        self.counters["requests_total"] += 1
+        if self.random.random() < self.args.failure_rate:
+            self.counters["failures_total"] += 1
+            raise FakeFailure()
+        self.deferred += 1
+        async with self.slots:
+            self.deferred -= 1
+            self.processing += 1
+            try:
+                cost_ms = self.args.batch_ms + self.args.token_ms * tokens + self.args.item_ms * items
+                cost_ms += self.random.uniform(0, self.args.jitter_ms)
+                async with self.device:
+                    await asyncio.sleep(cost_ms / 1000)
+                if self.random.random() < self.args.stall_rate:
+                    await asyncio.sleep(self.args.stall_ms / 1000)
+                self.counters["prompt_tokens_total"] += tokens
+                if self.args.log_timings:
+                    self.print_timing(tokens, cost_ms)
+            finally:
+                self.processing -= 1
+
+    def print_timing(self, tokens: int, cost_ms: float):
+        """llama-server's slot timing lines, written synchronously like its logger"""
+        self.tasks += 1
+        per_token = cost_ms / max(tokens, 1)
+        print(
+            f"slot print_timing: id  0 | task {self.tasks} | \n"
+            f"prompt eval time = {cost_ms:10.2f} ms / {tokens:5d} tokens ({per_token:8.2f} ms per token, "
+            f"{1000 / per_token:8.2f} tokens per second)\n"
+            f"       total time = {cost_ms:10.2f} ms / {tokens:5d} tokens",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"code": status, "message": message}})
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Fake llama-server")
+    backend = FakeBackend(args)
+    app.state.backend = backend
+
+    @app.middleware("http")
+    async def loading_gate(request: Request, call_next):
+        if backend.loading():
+            return _error(503, "Loading model")
+        return await call_next(request)
+
+    @app.exception_handler(FakeFailure)
+    async def injected_failure(request: Request, exc: FakeFailure):
+        return _error(args.failure_status, "Injected failure")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/tokenize")
+    async def tokenize(request: Request):
+        body = await request.json()
+        return {"tokens": backend.tokenize(body.get("content", ""), body.get("add_special", True))}
+
+    @app.post("/detokenize")
+    async def detokenize(request: Request):
+        body = await request.json()
+        return {"content": backend.detokenize(body.get("tokens", []))}
+
+    @app.post("/embedding")
+    @app.post("/embeddings")
+    @app.post("/v1/embeddings")
+    async def embedding(request: Request):
+        if not args.embeddings:
+            return _error(501, "This server does not support embeddings. Start it with `--embeddings`")
+        body = await request.json()
+        # OpenAI-compatible when called with "input": that format reports usage
+        oaicompat = "input" in body
+        content = body.get("input" if oaicompat else "content", "")
+        texts = content if isinstance(content, list) else [content]
+        lengths = [len(backend.tokenize(text)) for text in texts]
+        too_long = [n for n in lengths if n > args.ubatch_size]
+        if too_long:
+            return _error(500, f"input ({too_long[0]} tokens) is too large to process. increase the physical batch size")
+        await backend.run(sum(lengths), len(texts))
+        if oaicompat:
+            items = ",".join(
+                f'{{"object":"embedding","index":{i},"embedding":{backend.vector_json(text)}}}'
+                for i, text in enumerate(texts)
+            )
+            usage = f'{{"prompt_tokens":{sum(lengths)},"total_tokens":{sum(lengths)}}}'
+            return Response(
+                content=f'{{"object":"list","data":[{items}],"usage":{usage}}}', media_type="application/json"
+            )
+        items = ",".join(f'{{"index":{i},"embedding":[{backend.vector_json(text)}]}}' for i, text in enumerate(texts))
+        return Response(content=f"[{items}]", media_type="application/json")
+
+    @app.post("/rerank")
+    @app.post("/reranking")
+    @app.post("/v1/rerank")
+    async def rerank(request: Request):
+        if not args.reranking:
+            return _error(501, "This server does not support reranking. Start it with `--reranking`")
+        body = await request.json()
+        query, documents = body.get("query", ""), body.get("documents", [])
+        query_tokens = len(backend.tokenize(query))
+        lengths = [query_tokens + len(backend.tokenize(d)) for d in documents]
+        too_long = [n for n in lengths if n > args.ubatch_size]
+        if too_long:
+            return _error(500, f"input ({too_long[0]} tokens) is too large to process. increase the physical batch size")
+        await backend.run(sum(lengths), len(documents))
+        results = [{"index": i, "relevance_score": backend.score(query, d)} for i, d in enumerate(documents)]
+        results.sort(key=lambda r: r["relevance_score"], reverse=True)
+        return {"results": results[: body.get("top_n") or len(results)]}
+
+    @app.get("/metrics")
+    async def metrics():
+        lines = []
+        for name, value in backend.counters.items():
+            lines += [f"# TYPE llamacpp:{name} counter", f"llamacpp:{name} {value}"]
+        for name, value in (("requests_processing", backend.processing), ("requests_deferred", backend.deferred)):
+            lines += [f"# TYPE llamacpp:{name} gauge", f"llamacpp:{name} {value}"]
+        return PlainTextResponse("\n".join(lines) + "\n")
+
+    return app
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logger.info(
+        f"Fake llama-server on {args.host}:{args.port} "
+        f"({'embeddings' if args.embeddings else 'reranking' if args.reranking else 'completion'}, "
+        f"{args.parallel} slots, batch {args.batch_ms}ms + {args.token_ms}ms/token + {args.item_ms}ms/item)"
+    )
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
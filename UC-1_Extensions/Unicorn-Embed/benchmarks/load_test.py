@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Load generator for the Unicorn-Embed wrappers
+Drives /v1/embeddings, /embeddings and /v1/rerank at a target request rate
+(open loop) or a fixed concurrency (closed loop), reports p50/p95/p99
+latency and throughput per endpoint, and writes a JSON results file.
+
+    # Wrapper launched here on fake llama-servers (no GPU needed)
+    python benchmarks/load_test.py run --launch wrapper --concurrency 16 --duration 30 -o base.json
+    # Any running wrapper
+    python benchmarks/load_test.py run --url http://localhost:8000 --rps 50 --duration 60 -o gpu.json
+    # Compare two runs
+    python benchmarks/load_test.py compare base.json new.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+WRAPPERS = {
+    "wrapper": HERE.parent / "llama_server_wrapper.py",
+    "fixed": HERE.parent / "llama_server_wrapper_fixed.py",
+}
+# Model names each wrapper serves for the dummy files written by --launch
+MODEL_NAMES = {
+    "wrapper": ("nomic-embed-text-v1.5", "bge-reranker-v2-m3"),
+    "fixed": ("embedding_nomic-embed-text-v1.5.Q8_0", "reranker_bge-reranker-v2-m3-Q8_0"),
+}
+ENDPOINTS = ("v1-embeddings", "embeddings", "rerank")
+
+# Fixed vocabulary so generated texts tokenize the same run to run
+VOCAB = [
+    "memory", "vector", "search", "index", "query", "document", "cluster", "embedding", "server", "batch",
+    "latency", "token", "model", "rank", "cache", "graph", "shard", "replica", "signal", "stream",
+    "kernel", "tensor", "layer", "weight", "prompt", "context", "window", "buffer", "queue", "thread",
+    "unicorn", "vulkan", "gpu", "cpu", "disk", "network", "packet", "socket", "route", "proxy",
+]
+
+
+class TextSource:
+    """Reproducible inputs; hot_ratio of them repeat from a small hot set (cache hits)"""
+
+    def __init__(self, seed: int, words: int, hot_ratio: float, hot_set: int):
+        self.random = random.Random(seed)
+        self.words = words
+        self.hot_ratio = hot_ratio
+        self.hot = [self._fresh() for _ in range(max(1, hot_set))]
+
+    def _fresh(self) -> str:
+        length = max(1, int(self.random.gauss(self.words, self.words / 4)))
+        return " ".join(self.random.choice(VOCAB) for _ in range(length))
+
+    def text(self) -> str:
+        if self.random.random() < self.hot_ratio:
+            return self.random.choice(self.hot)
+        return self._fresh()
+
+
+def build_request(endpoint: str, source: TextSource, args: argparse.Namespace):
+    """(path, payload, inputs) for one request"""
+    if endpoint == "rerank":
+        documents = [source.text() for _ in range(args.documents)]
+        return "/v1/rerank", {"model": args.rerank_model, "query": source.text(), "documents": documents}, len(documents)
+    texts = [source.text() for _ in range(args.batch)]
+    if endpoint == "embeddings":
+        return "/embeddings", {"input": texts}, len(texts)
+    return "/v1/embeddings", {"model": args.embedding_model, "input": texts}, len(texts)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.inputs: Dict[str, int] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: str, seconds: float, inputs: int, error: Optional[str]):
+        if error:
+            bucket = self.errors.setdefault(endpoint, {})
+            bucket[error] = bucket.get(error, 0) + 1
+            return
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.inputs[endpoint] = self.inputs.get(endpoint, 0) + inputs
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        results = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = np.asarray(self.latencies.get(endpoint, []), dtype=np.float64) * 1000
+            errors = sum(self.errors.get(endpoint, {}).values())
+            ok = len(latencies)
+            results[endpoint] = {
+                "requests": ok + errors,
+                "errors": errors,
+                "error_rate": errors / (ok + errors) if ok + errors else 0.0,
+                "error_kinds": self.errors.get(endpoint, {}),
+                "throughput_rps": ok / elapsed if elapsed else 0.0,
+                "inputs_per_s": self.inputs.get(endpoint, 0) / elapsed if elapsed else 0.0,
+                "latency_ms": {
+                    "mean": float(latencies.mean()) if ok else None,
+                    "p50": float(np.percentile(latencies, 50)) if ok else None,
+                    "p95": float(np.percentile(latencies, 95)) if ok else None,
+                    "p99": float(np.percentile(latencies, 99)) if ok else None,
+                    "max": float(latencies.max()) if ok else None,
+                },
+            }
+        return results
+
+
+async def send(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, source: TextSource, args):
+    path, payload, inputs = build_request(endpoint, source, args)
+    start = time.perf_counter()
+    error = None
+    try:
+        response = await client.post(path, json=payload)
+        if response.status_code != 200:
+            error = f"http_{response.status_code}"
+    except httpx.TimeoutException:
+        error = "timeout"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    recorder.record(endpoint, time.perf_counter() - start, inputs, error)
+
+
+async def run_load(args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    source = TextSource(args.seed, args.words, args.hot_ratio, args.hot_set)
+    picker = random.Random(args.seed + 1)
+    weights = [args.mix.get(endpoint, 0) for endpoint in ENDPOINTS]
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=max(args.concurrency, 64), max_keepalive_connections=max(args.concurrency, 64))
+
+    def next_endpoint() -> str:
+        return picker.choices(ENDPOINTS, weights)[0]
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        # Warmup requests are not recorded
+        warm = Recorder()
+        await asyncio.gather(*(send(client, warm, next_endpoint(), source, args) for _ in range(args.warmup)))
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        sent = 0
+
+        def more() -> bool:
+            return time.perf_counter() < deadline and (not args.requests or sent < args.requests)
+
+        if args.rps:
+            # Open loop: arrivals on schedule whether or not earlier requests finished
+            tasks = []
+            next_at = start
+            while more():
+                tasks.append(asyncio.ensure_future(send(client, recorder, next_endpoint(), source, args)))
+                sent += 1
+                # Scheduled from the start time, so slow sends do not lower the rate
+                next_at += picker.expovariate(args.rps) if args.poisson else 1.0 / args.rps
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            await asyncio.gather(*tasks)
+        else:
+            # Closed loop: each worker sends its next request when the last returns
+            async def worker():
+                nonlocal sent
+                while more():
+                    sent += 1
+                    await send(client, recorder, next_endpoint(), source, args)
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"elapsed_s": elapsed, "endpoints": recorder.summary(elapsed)}
+
+
+def launch_wrapper(args: argparse.Namespace, workdir: Path) -> subprocess.Popen:
+    """Start a wrapper whose llama-server is the fake backend, with dummy model files"""
+    models = workdir / "models"
+    (models / "embeddings").mkdir(parents=True, exist_ok=True)
+    (models / "rerankers").mkdir(parents=True, exist_ok=True)
+    (models / "embeddings" / "nomic-embed-text-v1.5.Q8_0.gguf").write_bytes(b"GGUF")
+    (models / "rerankers" / "bge-reranker-v2-m3-Q8_0.gguf").write_bytes(b"GGUF")
+    env = os.environ.copy()
+    env.update({
+        "LLAMA_SERVER_BIN": str(HERE / "fake_llama_server.py"),
+        "MODELS_DIR": str(models),
+        "EMBED_STORE_DIR": "",
+    })
+    cmd = [sys.executable, "-m", "uvicorn", f"{WRAPPERS[args.launch].stem}:app", "--port", str(args.port), "--log-level", "warning"]
+    log = open(workdir / "wrapper.log", "wb")
+    return subprocess.Popen(cmd, cwd=WRAPPERS[args.launch].parent, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(base_url: str, timeout: float):
+    """Wait until no model is still loading (/ready), or /health answers where there is no /ready"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=5) as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get("/ready")
+                if response.status_code == 404:
+                    response = await client.get("/health")
+                    if response.status_code == 200:
+                        return
+                elif all(m["state"] != "loading" for m in response.json().get("models", {}).values()):
+                    return
+            except (httpx.HTTPError, ValueError):
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{base_url} not ready after {timeout}s")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'v1-embeddings=3,rerank=1' -> request weights per endpoint"""
+    mix = {}
+    for entry in spec.split(","):
+        name, _, weight = entry.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    process = None
+    base_url = args.url
+    workdir = tempfile.TemporaryDirectory(prefix="unicorn-bench-")
+    try:
+        if args.launch:
+            base_url = f"http://127.0.0.1:{args.port}"
+            process = launch_wrapper(args, Path(workdir.name))
+        asyncio.run(wait_ready(base_url, args.ready_timeout))
+        result = asyncio.run(run_load(args, base_url))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        workdir.cleanup()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("func", "output")}
+    report = {
+        "label": args.label or (args.launch or base_url),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": config,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        **result,
+    }
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"Results written to {args.output}")
+    return 0
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n{report['label']}  ({report['elapsed_s']:.1f}s)")
+    print(f"{'endpoint':<15}{'reqs':>7}{'err%':>7}{'req/s':>9}{'in/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for endpoint, stats in report["endpoints"].items():
+        latency = stats["latency_ms"]
+        def fmt(v):
+            return f"{v:9.1f}" if v is not None else f"{'-':>9}"
+        print(
+            f"{endpoint:<15}{stats['requests']:>7}{stats['error_rate'] * 100:>6.1f}%"
+            f"{stats['throughput_rps']:>9.1f}{stats['inputs_per_s']:>9.1f}"
+            f"{fmt(latency['p50'])}{fmt(latency['p95'])}{fmt(latency['p99'])}"
+        )
+
+
+def _number(value: Optional[float]) -> str:
+    return f"{value:11.4g}" if value is not None else f"{'-':>11}"
+
+
+def cmd_compare(args: argparse.Namespace) -> int:
+    """Print per-endpoint deltas of the second run against the first"""
+    base, new = (json.loads(Path(p).read_text()) for p in (args.baseline, args.candidate))
+    print(f"{base['label']} -> {new['label']}")
+    print(f"{'endpoint':<15}{'metric':<16}{'baseline':>11}{'candidate':>11}{'change':>9}")
+    for endpoint in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        a, b = base["endpoints"].get(endpoint), new["endpoints"].get(endpoint)
+        if not a or not b:
+            print(f"{endpoint:<15}only in {'candidate' if b else 'baseline'}")
+            continue
+        rows = [("throughput_rps", a["throughput_rps"], b["throughput_rps"]),
+                ("error_rate", a["error_rate"], b["error_rate"])]
+        rows += [(f"{q} ms", a["latency_ms"][q], b["latency_ms"][q]) for q in ("p50", "p95", "p99")]
+        for metric, x, y in rows:
+            change = f"{(y - x) / x * 100:+8.1f}%" if x and y is not None else f"{'-':>9}"
+            print(f"{endpoint:<15}{metric:<16}{_number(x)}{_number(y)}{change}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Drive load at a wrapper and report latency/throughput")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running wrapper")
+    target.add_argument("--launch", choices=sorted(WRAPPERS), help="Start this wrapper on fake llama-servers")
+    run.add_argument("--port", type=int, default=8765, help="Port for --launch")
+    rate = run.add_mutually_exclusive_group()
+    rate.add_argument("--rps", type=float, help="Open-loop target requests per second")
+    rate.add_argument("--concurrency", type=int, default=8, help="Closed-loop workers (default)")
+    run.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times with --rps")
+    run.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    run.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = duration only)")
+    run.add_argument("--warmup", type=int, default=10, help="Unrecorded requests before measuring")
+    run.add_argument("--mix", type=parse_mix, default=parse_mix("v1-embeddings"),
+                     help="Endpoint weights, e.g. 'v1-embeddings=3,embeddings=1,rerank=1'")
+    run.add_argument("--batch", type=int, default=8, help="Inputs per embeddings request")
+    run.add_argument("--documents", type=int, default=20, help="Documents per rerank request")
+    run.add_argument("--words", type=int, default=48, help="Mean words per input")
+    run.add_argument("--hot-ratio", type=float, default=0.0, help="Fraction of inputs repeated from the hot set")
+    run.add_argument("--hot-set", type=int, default=100)
+    run.add_argument("--embedding-model", help="Model name sent to the wrapper (default: per --launch wrapper)")
+    run.add_argument("--rerank-model")
+    run.add_argument("--timeout", type=float, default=60)
+    run.add_argument("--ready-timeout", type=float, default=180)
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--label", help="Name of this run in the results file")
+    run.add_argument("--output", "-o", help="Write the JSON results here")
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="Compare two JSON results files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        embedding_model, rerank_model = MODEL_NAMES[args.launch or "wrapper"]
+        args.embedding_model = args.embedding_model or embedding_model
+        args.rerank_model = args.rerank_model or rerank_model
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the wrapper's per-request CPU costs
+Times the hot paths between the socket and llama-server at 1, 32 and 512
+inputs x 768 dims: request validation, parsing llama-server's
+/v1/embeddings responses, rendering float/base64/binary/NDJSON responses,
+cache keys and cosine rerank scoring. Results are compared against a
+baseline recorded beforehand with the same dependencies; a case slower
+than the threshold fails the check. No baseline ships with the repo.
+
+    python benchmarks/microbench.py --save-baseline      # first: record this machine's numbers
+    python benchmarks/microbench.py                      # run and compare with the baseline
+    python benchmarks/microbench.py --filter render --sizes 32
+
+A baseline recorded on another machine is compared after scaling by a
+fixed pure-Python/NumPy calibration workload, so it stays roughly usable;
+same-machine comparisons use raw timings (calibration adds its own noise).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+# Keep the wrapper import from opening an on-disk embedding store
+os.environ.setdefault("EMBED_STORE_DIR", "")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from batching import parse_embeddings  # noqa: E402
+from embedding_cache import text_digest  # noqa: E402
+from streaming import _encode  # noqa: E402
+from vectors import cosine_scores, format_embedding, pack_matrix, rank_results, stack_rows, to_float32  # noqa: E402
+from llama_server_wrapper import EmbeddingRequest, RerankRequest  # noqa: E402
+
+DEFAULT_BASELINE = HERE / "baselines" / "microbench.json"
+SIZES = (1, 32, 512)
+DIM = 768
+WORDS = ["memory", "vector", "search", "index", "query", "document", "cluster", "embedding", "latency", "token"]
+
+# name -> setup(n) returning the zero-argument callable to time
+Case = Callable[[int], Callable[[], object]]
+CASES: Dict[str, Case] = {}
+
+
+def case(name: str):
+    def register(setup: Case) -> Case:
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def _texts(n: int, words: int = 48) -> List[str]:
+    rng = random.Random(n)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(n)]
+
+
+def _vectors(n: int) -> List[np.ndarray]:
+    matrix = np.random.default_rng(n).standard_normal((n, DIM)).astype(np.float32)
+    return list(matrix / np.linalg.norm(matrix, axis=1, keepdims=True))
+
+
+def _embedding_response(vectors: List[np.ndarray], encoding_format: str) -> bytes:
+    """The /v1/embeddings JSON body, built as create_embeddings builds it"""
+    data = [
+        {"object": "embedding", "embedding": format_embedding(vector, encoding_format), "index": i}
+        for i, vector in enumerate(vectors)
+    ]
+    usage = {"prompt_tokens": 50 * len(vectors), "total_tokens": 50 * len(vectors)}
+    return JSONResponse(content={"object": "list", "data": data, "model": "nomic-embed-text-v1.5", "usage": usage}).body
+
+
+@case("validate_embedding_request")
+def _validate_embedding_request(n: int):
+    body = json.dumps({"input": _texts(n), "model": "nomic-embed-text-v1.5"}).encode()
+    # FastAPI decodes the body, then validates the dict
+    return lambda: EmbeddingRequest.model_validate(json.loads(body))
+
+
+@case("validate_rerank_request")
+def _validate_rerank_request(n: int):
+    body = json.dumps({"query": _texts(1)[0], "documents": _texts(n), "model": "bge-reranker-v2-m3"}).encode()
+    return lambda: RerankRequest.model_validate(json.loads(body))
+
+
+@case("parse_upstream_embeddings")
+def _parse_upstream_embeddings(n: int):
+    # embed_batch calls llama-server's /v1/embeddings, which answers in the OpenAI format
+    body = json.dumps({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(_vectors(n))],
+        "model": "nomic-embed-text-v1.5",
+        "usage": {"prompt_tokens": 50 * n, "total_tokens": 50 * n},
+    }).encode()
+    return lambda: [to_float32(v) for v in parse_embeddings(json.loads(body), n)]
+
+
+@case("render_float")
+def _render_float(n: int):
+    vectors = _vectors(n)
+    return lambda: _embedding_response(vectors, "float")
+
+
+@case("render_base64")
+def _render_base64(n: int):
+    vectors = _vectors(n)
+    return lambda: _embedding_response(vectors, "base64")
+
+
+@case("render_binary")
+def _render_binary(n: int):
+    vectors = _vectors(n)
+    return lambda: pack_matrix(vectors)
+
+
+@case("render_ndjson")
+def _render_ndjson(n: int):
+    vectors = _vectors(n)
+    return lambda: b"".join(_encode({"id": i, "embedding": format_embedding(v)}) for i, v in enumerate(vectors))
+
+
+@case("cache_keys")
+def _cache_keys(n: int):
+    texts = _texts(n)
+    return lambda: [text_digest(text) for text in texts]
+
+
+@case("rerank_cosine")
+def _rerank_cosine(n: int):
+    # score_cosine + rank_results + response rendering for n documents
+    query, *documents = _vectors(n + 1)
+    texts = _texts(n)
+
+    def run():
+        scores = cosine_scores(query, stack_rows(documents, DIM))
+        return JSONResponse(content={"results": rank_results(scores, texts)}).body
+    return run
+
+
+def calibrate() -> float:
+    """Microseconds for a fixed mixed workload (JSON, list building, small NumPy ops)"""
+    payload = json.dumps([[float(i) / 7 for i in range(DIM)] for _ in range(8)])
+    matrix = np.ones((64, DIM), dtype=np.float32)
+
+    def workload():
+        json.loads(payload)
+        sum(i * i for i in range(2000))
+        matrix @ matrix[0]
+    return measure(workload, repeat=7)[0]
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> Tuple[float, float]:
+    """(best, median) microseconds per call over `repeat` timed rounds"""
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time / 5 or number >= 1 << 20:
+            break
+        number *= 2
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    rounds.sort()
+    return rounds[0], rounds[len(rounds) // 2]
+
+
+def measure_case(key: str, repeat: int) -> Tuple[float, float]:
+    """Time one "name[n]" case"""
+    name, _, size = key[:-1].partition("[")
+    return measure(CASES[name](int(size)), repeat=repeat)
+
+
+def run_cases(names: List[str], sizes: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for key in (f"{name}[{n}]" for name in names for n in sizes):
+        best, median = measure_case(key, repeat)
+        results[key] = {"best_us": best, "median_us": median}
+        print(f"  {key:<36}{best:>12.1f}{median:>12.1f}", flush=True)
+    return results
+
+
+def check(
+    results: Dict[str, Dict[str, float]],
+    calibration: float,
+    baseline: dict,
+    threshold: float,
+    normalize: bool,
+    repeat: int = 5,
+    confirm: int = 2,
+) -> List[str]:
+    """Print the comparison and return the cases slower than baseline by more than threshold
+
+    A case over the threshold is re-measured up to `confirm` times and keeps
+    its best time, so one noisy round does not fail the check.
+    """
+    scale = calibration / baseline["calibration_us"] if normalize and baseline.get("calibration_us") else 1.0
+    print(f"\nvs baseline ({baseline.get('machine', '?')}), machine speed factor {scale:.2f}, threshold +{threshold:.0%}")
+    print(f"  {'case':<36}{'baseline':>12}{'now':>12}{'change':>9}")
+    regressions = []
+    for key, result in results.items():
+        reference = baseline["results"].get(key)
+        if not reference:
+            print(f"  {key:<36}{'-':>12}{result['best_us']:>12.1f}{'new':>9}")
+            continue
+        expected = reference["best_us"] * scale
+        for _ in range(confirm):
+            if result["best_us"] / expected - 1 <= threshold:
+                break
+            result["best_us"] = min(result["best_us"], measure_case(key, repeat)[0])
+        change = result["best_us"] / expected - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"  {key:<36}{expected:>12.1f}{result['best_us']:>12.1f}{change:>+8.0%}{flag}")
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def machine() -> str:
+    return f"{platform.node()} {platform.machine()} {os.cpu_count()} cpus / Python {platform.python_version()}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="Only cases whose name contains this")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma-separated input counts")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed rounds per case (best is compared)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("MICROBENCH_THRESHOLD", "0.25")),
+                        help="Allowed slowdown vs baseline before failing (0.25 = 25%%)")
+    parser.add_argument("--normalize", action="store_true",
+                        help="Scale the baseline by the calibration ratio (default only across machines)")
+    parser.add_argument("--output", "-o", type=Path, help="Also write this run's results as JSON")
+    args = parser.parse_args(argv)
+
+    names = [name for name in CASES if args.filter in name]
+    sizes = [int(size) for size in args.sizes.split(",")]
+    calibration = calibrate()
+    print(f"  {'case':<36}{'best us':>12}{'median us':>12}")
+    results = run_cases(names, sizes, args.repeat)
+    # Calibrated on both sides of the run: the faster reading is the least disturbed
+    calibration = min(calibration, calibrate())
+    print(f"calibration {calibration:.1f}us")
+    report = {
+        "machine": machine(),
+        "numpy": np.__version__,
+        "calibration_us": calibration,
+        "results": results,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        if args.baseline.exists():
+            # Keep cases this run skipped (--filter / --sizes)
+            report["results"] = {**json.loads(args.baseline.read_text())["results"], **results}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("numpy") != report["numpy"]:
+        print(f"\nWarning: baseline was recorded with numpy {baseline.get('numpy')}, this run uses {report['numpy']}")
+    normalize = args.normalize or baseline.get("machine") != report["machine"]
+    regressions = check(results, calibration, baseline, args.threshold, normalize, args.repeat)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Calibrate llama-server launch parameters per model
+Launches each model under candidate n_gpu_layers / n_batch / n_threads
+settings, drives a fixed seeded workload through the wrapper's own batching
+(embeddings) or cross-encoding (rerankers) path and keeps the setting with
+the highest embeddings/sec, ties broken by p95 latency. The winner is saved
+as the model's profile (profiles.py), which both wrappers load at startup.
+
+    python calibrate.py                                     # every model, full grid
+    python calibrate.py --models embedding_nomic-embed-text-v1.5 --search halving
+    python calibrate.py --gpu-layers 0,20,99 --threads 4,8 --max-p95-ms 250 --dry-run
+
+n_batch is also the ubatch, and pooling needs each whole input inside one
+ubatch, so batch sizes below the model's n_ctx are never tried.
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import itertools
+from dataclasses import replace
+from typing import Dict, List, Optional
+
+# Calibration must not read or fill the on-disk embedding store
+os.environ.setdefault("EMBED_STORE_DIR", "")
+
+from upstream import upstream  # noqa: E402
+from profiles import PROFILE_PARAMS, profile_path, save_profile  # noqa: E402
+from llama_server_wrapper_fixed import LlamaServerProcess, ModelConfig, NativeServerManager  # noqa: E402
+
+logger = logging.getLogger("calibrate")
+
+WORDS = ["memory", "vector", "search", "index", "query", "document", "cluster", "embedding", "latency", "token",
+         "server", "model", "batch", "context", "thread", "layer", "device", "kernel", "cache", "response"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def candidates(config: ModelConfig, gpu_layers: List[int], batch_sizes: List[int], threads: List[int]) -> List[Dict[str, int]]:
+    """Grid of launch parameters, always including the model's current settings"""
+    batches = [size for size in batch_sizes if size >= config.n_ctx] or [config.n_ctx]
+    grid = [
+        dict(zip(PROFILE_PARAMS, values))
+        for values in itertools.product(gpu_layers, batches, threads)
+    ]
+    current = {key: getattr(config, key) for key in PROFILE_PARAMS}
+    if current not in grid:
+        grid.insert(0, current)
+    return grid
+
+
+def workload(config: ModelConfig, requests: int, batch: int, seed: int) -> List[dict]:
+    """Seeded requests: mostly short texts with a long tail up to half the context"""
+    rng = random.Random(seed)
+    max_words = max(8, config.n_ctx // 2)
+
+    def text() -> str:
+        words = min(max_words, int(rng.paretovariate(1.2) * 24))
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    if config.type == "embedding":
+        return [{"texts": [text() for _ in range(batch)]} for _ in range(requests)]
+    return [{"query": text(), "documents": [text() for _ in range(batch)]} for _ in range(requests)]
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _send(backend: LlamaServerProcess, request: dict):
+    if "texts" in request:
+        # Straight to the batcher: the embedding cache would short-circuit repeats
+        vectors = await backend.batcher.embed(request["texts"])
+        # Texts that failed even item by item come back as empty vectors
+        failed = sum(1 for vector in vectors if len(vector) == 0)
+        if failed:
+            raise RuntimeError(f"backend returned no embedding for {failed} of {len(vectors)} texts")
+    else:
+        await backend.rerank(request["query"], request["documents"])
+
+
+async def measure(config: ModelConfig, params: Dict[str, int], requests: List[dict], concurrency: int) -> Dict[str, float]:
+    """Launch one candidate, run the workload against it and stop it"""
+    backend = LlamaServerProcess(replace(config, port=free_port(), **params))
+    started = time.perf_counter()
+    if not await backend.start():
+        return {"failed": "did not start"}
+    load_s = time.perf_counter() - started
+    try:
+        # Warm up: first requests pay for tokenizer round trips and kernel setup
+        await asyncio.gather(*(_send(backend, request) for request in requests[:concurrency]))
+        latencies, errors = [], 0
+        gate = asyncio.Semaphore(concurrency)
+
+        async def timed(request: dict):
+            nonlocal errors
+            async with gate:
+                start = time.perf_counter()
+                try:
+                    await _send(backend, request)
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors += 1
+                    logger.debug(f"Request failed: {e}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(request) for request in requests))
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        return {"failed": f"warmup failed: {e}"}
+    finally:
+        await backend.stop()
+    if errors or not latencies:
+        return {"failed": f"{errors} of {len(requests)} requests failed"}
+    items = sum(len(request.get("texts") or request["documents"]) for request in requests)
+    return {
+        "embeddings_per_s": round(items / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "load_s": round(load_s, 2),
+    }
+
+
+def rank_key(metrics: Dict[str, float], max_p95_ms: Optional[float]):
+    """Sort key: usable candidates first, then highest throughput, then lowest p95"""
+    if "failed" in metrics:
+        return (2, 0, 0)
+    over_slo = max_p95_ms is not None and metrics["p95_ms"] > max_p95_ms
+    return (int(over_slo), -metrics["embeddings_per_s"], metrics["p95_ms"])
+
+
+async def search(config: ModelConfig, grid: List[Dict[str, int]], args) -> List[tuple]:
+    """Evaluate the grid; returns (params, metrics) best first
+
+    "halving" runs every candidate on a 1/eta^k slice of the workload and
+    keeps the best 1/eta for a longer run, so only the finalists pay for the
+    full request count.
+    """
+    concurrency = args.concurrency or config.n_parallel
+    requests = workload(config, args.requests, args.batch, args.seed)
+    rounds = math.ceil(math.log(len(grid), args.eta)) if args.search == "halving" and len(grid) > 1 else 0
+    survivors, results = grid, []
+    for round_index in range(rounds + 1):
+        budget = max(2 * concurrency, args.requests // args.eta ** (rounds - round_index))
+        if rounds:
+            print(f"  round {round_index + 1}/{rounds + 1}: {len(survivors)} candidates x {budget} requests")
+        results = []
+        for params in survivors:
+            metrics = await measure(config, params, requests[:budget], concurrency)
+            results.append((params, metrics))
+            print(f"    {format_params(params):<40}{format_metrics(metrics)}", flush=True)
+        results.sort(key=lambda result: rank_key(result[1], args.max_p95_ms))
+        survivors = [params for params, _ in results[:math.ceil(len(results) / args.eta)]]
+    return results
+
+
+def format_params(params: Dict[str, int]) -> str:
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def format_metrics(metrics: Dict[str, float]) -> str:
+    if "failed" in metrics:
+        return f"failed: {metrics['failed']}"
+    return f"{metrics['embeddings_per_s']:>9.1f} emb/s  p95 {metrics['p95_ms']:>8.1f} ms  load {metrics['load_s']:.1f}s"
+
+
+def parse_ints(spec: str) -> List[int]:
+    return [int(value) for value in spec.split(",") if value.strip()]
+
+
+async def calibrate(args) -> int:
+    manager = NativeServerManager(args.models_dir)
+    names = args.models or sorted(manager.model_configs)
+    missing = [name for name in names if name not in manager.model_configs]
+    if missing:
+        print(f"Unknown models: {', '.join(missing)} (available: {', '.join(sorted(manager.model_configs))})")
+        return 2
+
+    failures = 0
+    try:
+        for name in names:
+            config = manager.model_configs[name]
+            grid = candidates(config, parse_ints(args.gpu_layers), parse_ints(args.batch_sizes), parse_ints(args.threads))
+            print(f"\n{name}: {len(grid)} candidates ({args.search} search)")
+            results = await search(config, grid, args)
+            params, metrics = results[0]
+            if "failed" in metrics:
+                print(f"  No candidate completed the workload; {name} keeps its defaults")
+                failures += 1
+                continue
+            if args.max_p95_ms is not None and metrics["p95_ms"] > args.max_p95_ms:
+                print(f"  No candidate met p95 <= {args.max_p95_ms} ms; keeping the fastest anyway")
+            print(f"  Best: {format_params(params)}  {format_metrics(metrics)}")
+            if args.dry_run:
+                continue
+            path = save_profile(
+                config.path,
+                params,
+                metrics,
+                search=args.search,
+                candidates=len(grid),
+                workload={"requests": args.requests, "batch": args.batch, "seed": args.seed,
+                          "concurrency": args.concurrency or config.n_parallel},
+            )
+            print(f"  Profile written to {path}")
+    finally:
+        await upstream.aclose()
+    return 1 if failures else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "./models"))
+    parser.add_argument("--models", nargs="*", help="Model names to calibrate (default: all)")
+    parser.add_argument("--gpu-layers", default="0,10,20,99", help="Comma-separated n_gpu_layers candidates")
+    parser.add_argument("--batch-sizes", default="1024,2048,4096,8192", help="Comma-separated n_batch candidates")
+    parser.add_argument("--threads", default="2,4,8", help="Comma-separated n_threads candidates")
+    parser.add_argument("--search", choices=("grid", "halving"), default="grid")
+    parser.add_argument("--eta", type=int, default=2, help="Halving: keep the best 1/eta each round")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per candidate (final round)")
+    parser.add_argument("--batch", type=int, default=16, help="Texts (or documents) per request")
+    parser.add_argument("--concurrency", type=int, help="Requests in flight (default: the model's n_parallel)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95-ms", type=float, help="Prefer candidates whose p95 stays under this")
+    parser.add_argument("--dry-run", action="store_true", help="Report the winner without writing a profile")
+    args = parser.parse_args(argv)
+    if args.eta < 2:
+        parser.error("--eta must be at least 2")
+    if not args.dry_run and profile_path("model.gguf") is None:
+        parser.error("LLAMA_PROFILE_DIR is empty; set it or use --dry-run")
+
+    # The wrapper logs every backend start and stop at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    return asyncio.run(calibrate(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Chunk-and-pool embeddings for inputs longer than the model context
+Over-length inputs are split into overlapping token windows, every window
+is embedded alongside the short inputs (through the cache and batcher),
+and the window vectors are pooled back into one vector per input.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tokenization import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+POOLING_MODES = ("mean", "weighted")
+
+# Room left in each window for the BOS/EOS tokens the backend adds
+SPECIAL_TOKENS = 2
+
+EmbedFn = Callable[[List[str]], Awaitable[Sequence[Optional[np.ndarray]]]]
+
+
+def token_windows(tokens: List[int], size: int, overlap: int) -> List[List[int]]:
+    """Split token ids into windows of at most `size`, consecutive windows sharing `overlap`"""
+    size = max(1, size)
+    stride = max(1, size - max(0, overlap))
+    windows = []
+    for start in range(0, len(tokens), stride):
+        windows.append(tokens[start:start + size])
+        if start + size >= len(tokens):
+            break
+    return windows
+
+
+def pool_vectors(vectors: Sequence[np.ndarray], weights: Sequence[int], pooling: str = "mean") -> np.ndarray:
+    """Pool window vectors into one L2-normalized vector
+
+    "weighted" weights each window by its token count, so a short tail
+    window counts for less than a full one.
+    """
+    matrix = np.stack([np.asarray(v, dtype=np.float32) for v in vectors])
+    w = np.asarray(weights, dtype=np.float32) if pooling == "weighted" else np.ones(len(matrix), dtype=np.float32)
+    pooled = (w[:, None] * matrix).sum(axis=0) / w.sum()
+    norm = np.linalg.norm(pooled)
+    return pooled / norm if norm > 0 else pooled
+
+
+async def _split(counter: TokenCounter, text: str, size: int, overlap: int) -> Tuple[List[str], List[int]]:
+    tokens = await counter.tokenize(text, add_special=False)
+    windows = token_windows(tokens, size, overlap)
+    chunks = await asyncio.gather(*(counter.detokenize(window) for window in windows))
+    return list(chunks), [len(window) for window in windows]
+
+
+async def embed_chunked(
+    texts: List[str],
+    embed: EmbedFn,
+    counter: TokenCounter,
+    max_tokens: int,
+    overlap: int = 64,
+    pooling: str = "mean",
+) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+    """Embed texts, chunking any longer than max_tokens (special tokens included)
+
+    Returns (vectors, chunk counts) in input order. An input whose windows
+    did not all embed comes back as None rather than a partial pool.
+    """
+    counts = await counter.count(texts)
+    long_inputs = [i for i, tokens in enumerate(counts) if tokens > max_tokens]
+    splits = await asyncio.gather(
+        *(_split(counter, texts[i], max_tokens - SPECIAL_TOKENS, overlap) for i in long_inputs)
+    )
+
+    # One flat embed call: short inputs as-is, long inputs as their windows
+    pieces: List[List[str]] = [[text] for text in texts]
+    weights: List[List[int]] = [[tokens] for tokens in counts]
+    for i, (chunks, lengths) in zip(long_inputs, splits):
+        pieces[i], weights[i] = chunks, lengths
+    flat = [piece for group in pieces for piece in group]
+    flat_vectors = await embed(flat) if flat else []
+
+    vectors: List[Optional[np.ndarray]] = []
+    position = 0
+    for group, group_weights in zip(pieces, weights):
+        group_vectors = flat_vectors[position:position + len(group)]
+        position += len(group)
+        if not group_vectors or any(v is None for v in group_vectors):
+            vectors.append(None)
+        elif len(group_vectors) == 1:
+            vectors.append(group_vectors[0])
+        else:
+            vectors.append(pool_vectors(group_vectors, group_weights, pooling))
+    if long_inputs:
+        logger.info(f"Chunked {len(long_inputs)} long inputs into {sum(len(c) for c, _ in splits)} windows")
+    return vectors, [len(group) for group in pieces]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Content-addressed in-memory embedding cache
+Vectors are keyed by (model, hash of normalized text), stored as compact
+float32 arrays and evicted least-recently-used under a byte budget
+"""
+
+import os
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_store import PersistentEmbeddingStore
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Approximate per-entry bookkeeping (key tuple, digest, dict slot, ndarray header)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """LRU cache of float32 embedding vectors bounded by a memory budget
+
+    Each vector is kept with the prompt tokens it cost, so repeated texts
+    are billed without asking the backend again. An optional
+    PersistentEmbeddingStore acts as a second tier: memory misses are
+    looked up on disk (and promoted), and freshly computed vectors are
+    written through to it.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, store: Optional[PersistentEmbeddingStore] = None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.entries: "OrderedDict[Tuple[str, bytes], Tuple[np.ndarray, int]]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "EmbeddingCache":
+        return cls(
+            max_bytes=int(os.getenv("EMBED_CACHE_MAX_MB", "256")) * 1024 * 1024,
+            store=PersistentEmbeddingStore.from_env(),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _lookup(self, key: Tuple[str, bytes]) -> Optional[Tuple[np.ndarray, int]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, key: Tuple[str, bytes], vector: Any, tokens: int = 0) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        if array.size == 0:
+            return None
+        size = array.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return array
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.bytes_used -= previous[0].nbytes + ENTRY_OVERHEAD_BYTES
+        array.setflags(write=False)
+        self.entries[key] = (array, tokens)
+        self.bytes_used += size
+        while self.bytes_used > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.bytes_used -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+            self.evictions += 1
+        return array
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        if not self.enabled:
+            return None
+        entry = self._lookup((model, text_digest(text)))
+        return entry[0] if entry is not None else None
+
+    def put(self, model: str, text: str, vector: Any, tokens: int = 0):
+        if not self.enabled:
+            return
+        key = (model, text_digest(text))
+        array = self._store(key, vector, tokens)
+        if array is not None and self.store is not None:
+            self.store.put_many(model, [(key[1], array, tokens)])
+
+    def attach_model(self, model: str, model_path: str):
+        """Enable the persistent tier for a model backed by the given GGUF file"""
+        if self.enabled and self.store is not None:
+            self.store.open_model(model, model_path)
+
+    async def resolve(
+        self,
+        model: str,
+        texts: List[str],
+        fetch: Callable[[List[str]], Awaitable[Tuple[List[List[float]], List[int]]]],
+    ) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Return vectors and prompt token counts for texts, fetching only cache misses (deduplicated)
+
+        `fetch` returns vectors and counts for the texts it is given. Every
+        input is counted, cached or not; texts that could not be embedded
+        come back as None with 0 tokens.
+        """
+        if not self.enabled:
+            fetched, counts = await fetch(texts)
+            return [np.asarray(vector, dtype=np.float32) if len(vector) else None for vector in fetched], list(counts)
+
+        keys = [(model, text_digest(text)) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        counts: List[int] = [0] * len(texts)
+        missing: Dict[Tuple[str, bytes], List[int]] = {}
+        for i, key in enumerate(keys):
+            entry = self._lookup(key)
+            if entry is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                vectors[i], counts[i] = entry
+        CACHE_LOOKUPS.labels(model=model, result="memory_hit").inc(len(texts) - sum(map(len, missing.values())))
+        if missing and self.store is not None:
+            disk_hits = 0
+            for key in list(missing):
+                stored = self.store.get(model, key[1])
+                if stored is not None:
+                    array = self._store(key, *stored)
+                    for i in missing.pop(key):
+                        vectors[i], counts[i] = array, stored[1]
+                        disk_hits += 1
+            CACHE_LOOKUPS.labels(model=model, result="disk_hit").inc(disk_hits)
+        CACHE_LOOKUPS.labels(model=model, result="miss").inc(sum(map(len, missing.values())))
+        if not missing:
+            return vectors, counts
+
+        fetched, fetched_counts = await fetch([texts[positions[0]] for positions in missing.values()])
+        persisted = []
+        for (key, positions), vector, tokens in zip(missing.items(), fetched, fetched_counts):
+            if len(vector) == 0:
+                continue
+            array = self._store(key, vector, tokens)
+            persisted.append((key[1], array, tokens))
+            for i in positions:
+                vectors[i], counts[i] = array, tokens
+        if self.store is not None:
+            self.store.put_many(model, persisted)
+        return vectors, counts
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes_used = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": self.store.stats() if self.store is not None else None,
+        }
+
+    async def close(self):
+        if self.store is not None:
+            await self.store.close()
+
+
+# Process-wide cache shared by every endpoint
+embedding_cache = EmbeddingCache.from_env()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Persistent memory-mapped embedding store
+Second cache tier that survives container restarts. Each model gets an
+append-only float32 arena (memory-mapped, so lookups are zero-copy views)
+plus an append-only hash index that also records each vector's prompt
+token count. A fingerprint of the GGUF file guards against serving vectors
+computed by a different model. Writes are queued and applied in batches by
+a background writer thread, off the event loop.
+"""
+
+import os
+import json
+import struct
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Index record: 16-byte text digest + uint32 row number + uint32 prompt tokens
+INDEX_RECORD = struct.Struct("<16sII")
+# Bumped whenever INDEX_RECORD changes; stores in another format are discarded
+STORE_FORMAT = 2
+INITIAL_CAPACITY = 1024
+FINGERPRINT_HEAD_BYTES = 4 * 1024 * 1024
+FINGERPRINT_TAIL_BYTES = 1024 * 1024
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Identify a GGUF file by size and a hash of its head and tail
+
+    The head covers the GGUF header and metadata, the tail the last tensors;
+    hashing the whole multi-GB file on every start would be too slow.
+    """
+    path = Path(model_path)
+    size = path.stat().st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_HEAD_BYTES))
+        if size > FINGERPRINT_HEAD_BYTES:
+            f.seek(max(FINGERPRINT_HEAD_BYTES, size - FINGERPRINT_TAIL_BYTES))
+            digest.update(f.read(FINGERPRINT_TAIL_BYTES))
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """On-disk vectors for a single model
+
+    One writer thread appends and compacts; readers on the event loop only
+    take `_lock` long enough to pick up a consistent (index, arena) pair.
+    New rows become visible once their vectors and index records are on
+    disk.
+    """
+
+    def __init__(self, directory: Path, fingerprint: str, max_bytes: int):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self.index: Dict[bytes, Tuple[int, int]] = {}  # digest -> (row, tokens)
+        self.rows = 0
+        self.capacity = 0
+        self.vectors: Optional[np.memmap] = None
+        self.index_file = None
+        self.compactions = 0
+        self._lock = threading.Lock()
+
+    # File layout -----------------------------------------------------------
+
+    def _vectors_path(self, generation: int) -> Path:
+        return self.directory / f"vectors-{generation}.f32"
+
+    def _index_path(self, generation: int) -> Path:
+        return self.directory / f"index-{generation}.bin"
+
+    def _write_meta(self):
+        meta = {"fingerprint": self.fingerprint, "format": STORE_FORMAT, "dim": self.dim, "generation": self.generation}
+        tmp = self.directory / "meta.json.tmp"
+        tmp.write_text(json.dumps(meta))
+        _fsync(tmp)
+        os.replace(tmp, self.directory / "meta.json")
+
+    def _row_bytes(self) -> int:
+        return self.dim * 4
+
+    def _max_rows(self) -> int:
+        return max(INITIAL_CAPACITY, self.max_bytes // self._row_bytes())
+
+    # Open / reset ------------------------------------------------------------
+
+    def open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_path = self.directory / "meta.json"
+        meta: Dict[str, Any] = {}
+        if meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text())
+            except ValueError:
+                logger.warning(f"Corrupt embedding store metadata in {self.directory}, resetting")
+
+        if meta.get("fingerprint") != self.fingerprint:
+            if meta:
+                logger.warning(f"Model changed for embedding store {self.directory.name}, discarding stored vectors")
+            self._reset()
+            return
+        if meta.get("format") != STORE_FORMAT:
+            logger.warning(f"Embedding store {self.directory.name} has an older format, discarding stored vectors")
+            self._reset()
+            return
+
+        self.dim = meta.get("dim")
+        self.generation = int(meta.get("generation", 0))
+        if self.dim:
+            try:
+                self._load()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable embedding store {self.directory.name} ({e}), resetting")
+                self._reset()
+                return
+            if self.rows > INITIAL_CAPACITY and len(self.index) < self.rows // 2:
+                self.compact()
+        logger.info(f"Opened embedding store {self.directory.name}: {len(self.index)} vectors")
+
+    def _reset(self):
+        self.close()
+        for path in self.directory.glob("vectors-*.f32"):
+            path.unlink()
+        for path in self.directory.glob("index-*.bin"):
+            path.unlink()
+        self.dim = None
+        self.generation = 0
+        self.index = {}
+        self.rows = 0
+        self.capacity = 0
+        self._write_meta()
+
+    def _load(self):
+        index_path = self._index_path(self.generation)
+        vectors_path = self._vectors_path(self.generation)
+        raw = index_path.read_bytes() if index_path.exists() else b""
+        whole = len(raw) - len(raw) % INDEX_RECORD.size  # drop a torn trailing record
+        if whole != len(raw):
+            with open(index_path, "r+b") as f:
+                f.truncate(whole)
+        self.index = {}
+        for digest, row, tokens in INDEX_RECORD.iter_unpack(raw[:whole]):
+            self.index[digest] = (row, tokens)
+        self.rows = whole // INDEX_RECORD.size
+
+        self.capacity = vectors_path.stat().st_size // self._row_bytes() if vectors_path.exists() else 0
+        if self.rows > self.capacity:
+            raise ValueError(f"index references {self.rows} rows but arena holds {self.capacity}")
+        self._map(max(self.capacity, INITIAL_CAPACITY))
+        self.index_file = open(index_path, "ab")
+
+    def _map(self, capacity: int):
+        """(Re)map the vector arena, growing the backing file to `capacity` rows"""
+        path = self._vectors_path(self.generation)
+        if self.vectors is not None:
+            self.vectors.flush()
+        with open(path, "ab") as f:
+            if f.tell() < capacity * self._row_bytes():
+                f.truncate(capacity * self._row_bytes())
+        vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        # Views handed out from the old mapping stay valid
+        with self._lock:
+            self.vectors = vectors
+            self.capacity = capacity
+
+    # Lookups and appends -------------------------------------------------------
+
+    def get(self, digest: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        """The stored vector and its prompt token count"""
+        with self._lock:
+            entry = self.index.get(digest)
+            vectors = self.vectors
+        if entry is None or vectors is None:
+            return None
+        row, tokens = entry
+        return vectors[row], tokens
+
+    def put_many(self, entries: List[Tuple[bytes, np.ndarray, int]]):
+        """Append vectors (blocking: call from the writer thread)"""
+        if not entries:
+            return
+        if self.dim is None:
+            self.dim = int(entries[0][1].shape[-1])
+            self._write_meta()
+            self._map(INITIAL_CAPACITY)
+            self.index_file = open(self._index_path(self.generation), "ab")
+
+        entries = [entry for entry in entries if entry[1].shape[-1] == self.dim]
+        entries = entries[-self._max_rows():]
+        if self.rows + len(entries) > self._max_rows():
+            self.compact(keep=max(0, self._max_rows() * 3 // 4 - len(entries)))
+        if self.rows + len(entries) > self.capacity:
+            capacity = self.capacity
+            while capacity < self.rows + len(entries):
+                capacity *= 2
+            self._map(min(capacity, self._max_rows()))
+
+        # Rows past self.rows are not indexed yet, so readers never see them half-written
+        records = bytearray()
+        for row, (digest, vector, tokens) in enumerate(entries, start=self.rows):
+            self.vectors[row] = vector
+            records += INDEX_RECORD.pack(digest, row, tokens)
+        # Vectors land in the arena before the index points at them
+        self.vectors.flush()
+        self.index_file.write(records)
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        with self._lock:
+            for row, (digest, _, tokens) in enumerate(entries, start=self.rows):
+                self.index[digest] = (row, tokens)
+            self.rows += len(entries)
+
+    def compact(self, keep: Optional[int] = None):
+        """Rewrite live vectors into a new generation, optionally keeping only the newest `keep`"""
+        if self.dim is None or self.vectors is None:
+            return
+        live = sorted(self.index.items(), key=lambda item: item[1][0])
+        if keep is not None:
+            live = live[len(live) - keep:] if keep else []
+
+        old_generation = self.generation
+        old_vectors = self.vectors
+        self.generation += 1
+        capacity = max(len(live), min(self._max_rows(), max(INITIAL_CAPACITY, len(live) * 2)))
+        new_vectors = np.memmap(
+            self._vectors_path(self.generation), dtype=np.float32, mode="w+", shape=(capacity, self.dim)
+        )
+        records = bytearray()
+        new_index: Dict[bytes, Tuple[int, int]] = {}
+        for new_row, (digest, (old_row, tokens)) in enumerate(live):
+            new_vectors[new_row] = old_vectors[old_row]
+            records += INDEX_RECORD.pack(digest, new_row, tokens)
+            new_index[digest] = (new_row, tokens)
+        new_vectors.flush()
+        self._index_path(self.generation).write_bytes(bytes(records))
+        _fsync(self._index_path(self.generation))
+
+        # Switching generations in meta.json is the atomic commit point
+        self._write_meta()
+        if self.index_file:
+            self.index_file.close()
+        with self._lock:
+            self.vectors = new_vectors
+            self.capacity = capacity
+            self.index = new_index
+            self.rows = len(live)
+        self.index_file = open(self._index_path(self.generation), "ab")
+        self._vectors_path(old_generation).unlink(missing_ok=True)
+        self._index_path(old_generation).unlink(missing_ok=True)
+        self.compactions += 1
+        logger.info(f"Compacted embedding store {self.directory.name}: {self.rows} live vectors")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vectors": len(self.index),
+            "rows": self.rows,
+            "dim": self.dim,
+            "bytes_on_disk": self.capacity * self._row_bytes() if self.dim else 0,
+            "compactions": self.compactions,
+        }
+
+    def close(self):
+        with self._lock:
+            vectors, self.vectors = self.vectors, None
+        if vectors is not None:
+            vectors.flush()
+        if self.index_file:
+            self.index_file.close()
+            self.index_file = None
+
+
+class PersistentEmbeddingStore:
+    """Per-model ModelStores under one root directory
+
+    put_many only queues; a writer task hands everything queued during
+    `flush_interval` to a worker thread, so each model pays one msync and
+    one index fsync per interval instead of per request.
+    """
+
+    def __init__(self, root: str, max_bytes_per_model: int = 2048 * 1024 * 1024, flush_interval: float = 0.5):
+        self.root = Path(root)
+        self.max_bytes_per_model = max_bytes_per_model
+        self.flush_interval = flush_interval
+        self.models: Dict[str, ModelStore] = {}
+        self.pending: Dict[str, List[Tuple[bytes, np.ndarray, int]]] = {}
+        self.writer: Optional[asyncio.Task] = None
+        self._writing: Optional[asyncio.Lock] = None
+        self.hits = 0
+        self.writes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["PersistentEmbeddingStore"]:
+        default_root = os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".embedding-store")
+        root = os.getenv("EMBED_STORE_DIR", default_root)
+        if not root:
+            return None
+        return cls(
+            root,
+            max_bytes_per_model=int(os.getenv("EMBED_STORE_MAX_MB", "2048")) * 1024 * 1024,
+            flush_interval=float(os.getenv("EMBED_STORE_FLUSH_MS", "500")) / 1000,
+        )
+
+    def open_model(self, model: str, model_path: str):
+        """Attach a model's on-disk store, discarding it if the GGUF file changed"""
+        if model in self.models:
+            return
+        try:
+            fingerprint = model_fingerprint(model_path)
+            store = ModelStore(self.root / model, fingerprint, self.max_bytes_per_model)
+            store.open()
+            self.models[model] = store
+        except OSError as e:
+            logger.warning(f"Persistent embedding store disabled for {model}: {e}")
+
+    def get(self, model: str, digest: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        store = self.models.get(model)
+        if store is None:
+            return None
+        entry = store.get(digest)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put_many(self, model: str, entries: List[Tuple[bytes, np.ndarray, int]]):
+        """Queue vectors for the background writer (written in place outside an event loop)"""
+        if model not in self.models or not entries:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(model, entries)
+            return
+        self.pending.setdefault(model, []).extend(entries)
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while self.pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far"""
+        if self._writing is None:
+            self._writing = asyncio.Lock()
+        # One writer thread at a time: ModelStore appends are not reentrant
+        async with self._writing:
+            while self.pending:
+                model, entries = self.pending.popitem()
+                await asyncio.to_thread(self._write, model, entries)
+
+    def _write(self, model: str, entries: List[Tuple[bytes, np.ndarray, int]]):
+        try:
+            self.models[model].put_many(entries)
+            self.writes += 1
+        except OSError as e:
+            logger.error(f"Failed to persist embeddings for {model}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": str(self.root),
+            "hits": self.hits,
+            "writes": self.writes,
+            "queued": sum(map(len, self.pending.values())),
+            "models": {model: store.stats() for model, store in self.models.items()},
+        }
+
+    async def close(self):
+        """Write what is still queued, then close every model's files"""
+        await self.flush()
+        if self.writer is not None:
+            await asyncio.gather(self.writer, return_exceptions=True)
+        for store in self.models.values():
+            store.close()
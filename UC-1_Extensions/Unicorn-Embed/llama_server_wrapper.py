@@ -7,53 +7,195 @@ Optimized for Vulkan acceleration
 import os
 import time
 import subprocess
-import requests
+import httpx
 import json
 import asyncio
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Literal, Optional, Tuple, Union
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import numpy as np
 
+from upstream import BackendSlots, upstream
+from tokenization import TokenCounter
+from chunking import embed_chunked
+from metrics import (
+    ERRORS, METRICS_CONTENT_TYPE, MODEL_EVENTS, SERIALIZATION_TIME, ZERO_VECTOR_FALLBACKS,
+    label_backend, render_latest, timed,
+)
+from backend_metrics import register_backends
+from backend_logs import LEVELS, backend_logs
+from batching import EmbeddingBatcher
+from embedding_cache import embedding_cache
+from profiles import load_profile
+from matryoshka import ModelDimensions, model_dimensions, truncate
+from vectors import BINARY_MEDIA_TYPE, cosine_scores, format_embedding, pack_matrix, rank_results, stack_rows
+from rerank import RERANK_MODES, cascade, cross_encode
+from streaming import NDJSON_MEDIA_TYPE, DuplexStreamingResponse, iter_ndjson, stream_embeddings
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global server process
+# Global server process (set once the backend is healthy)
 embedding_server = None
 reranker_server = None
+# Native and Matryoshka output sizes of the embedding model (read at startup)
+embedding_dims = ModelDimensions(None)
+
+# llama-server binary and GGUF directory (benchmarks/fake_llama_server.py stands in for benchmarking)
+LLAMA_SERVER_BIN = os.getenv("LLAMA_SERVER_BIN", "/app/llama-server")
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+
+# llama-server launch settings per model type (also used to size request batches)
+# ctx_size is per slot; "parallel" sequences are batched continuously by the backend.
+# batch_size is the token budget of one upstream request and also the physical
+# batch: embedding/rank pooling needs each whole input inside one ubatch.
+# A calibrated profile (calibrate.py) overrides batch_size, n_gpu_layers and threads.
+LLAMA_THREADS = int(os.getenv("LLAMA_THREADS", "4"))
+SERVER_SETTINGS = {
+    "embedding": {"ctx_size": 2048, "batch_size": 2048, "n_gpu_layers": 20, "threads": LLAMA_THREADS,
+                  "parallel": int(os.getenv("EMBED_PARALLEL", "4"))},
+    "reranker": {"ctx_size": 1024, "batch_size": 1024, "n_gpu_layers": 15, "threads": LLAMA_THREADS,
+                 "parallel": int(os.getenv("RERANK_PARALLEL", "4"))},
+}
+# Profile parameter -> SERVER_SETTINGS key
+PROFILE_SETTINGS = {"n_batch": "batch_size", "n_gpu_layers": "n_gpu_layers", "n_threads": "threads"}
+EMBED_MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", "64"))
+# Texts sorted by length together before packing into token-budget batches
+EMBED_BATCH_WINDOW = int(os.getenv("EMBED_BATCH_WINDOW", "256"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_STREAM_CHUNK = int(os.getenv("EMBED_STREAM_CHUNK", "256"))
+# Over-length inputs: "" leaves them to the backend, "mean"/"weighted" chunks
+# them into overlapping windows and pools (per request via "chunking")
+EMBED_CHUNKING = os.getenv("EMBED_CHUNKING", "")
+EMBED_CHUNK_TOKENS = int(os.getenv("EMBED_CHUNK_TOKENS", str(SERVER_SETTINGS["embedding"]["ctx_size"])))
+EMBED_CHUNK_OVERLAP = int(os.getenv("EMBED_CHUNK_OVERLAP", "64"))
+
+# Rerank engine: "cross_encoder" scores pairs with the reranker (port 9992,
+# launched with --reranking); "cosine" ranks by nomic embedding similarity;
+# "cascade" ranks everything by cosine, then cross-encodes the top N
+RERANK_MODE = os.getenv("RERANK_MODE", "cross_encoder")
+RERANK_PAIR_BATCH = int(os.getenv("RERANK_PAIR_BATCH", "16"))
+RERANK_MAX_PAIR_TOKENS = int(os.getenv("RERANK_MAX_PAIR_TOKENS", str(SERVER_SETTINGS["reranker"]["ctx_size"])))
+RERANK_CASCADE_TOP_N = int(os.getenv("RERANK_CASCADE_TOP_N", "32"))
+RERANK_CASCADE_MIN_N = int(os.getenv("RERANK_CASCADE_MIN_N", "8"))
+# Adaptive cut: keep candidates within this cosine margin of the best (unset = fixed top N)
+RERANK_CASCADE_GAP = float(os.getenv("RERANK_CASCADE_GAP")) if os.getenv("RERANK_CASCADE_GAP") else None
+
+# Background scrape of the backends' own /metrics (0 = only when /metrics is scraped)
+BACKEND_METRICS_INTERVAL = float(os.getenv("BACKEND_METRICS_INTERVAL", "15"))
+
+# Model served on each backend port (also the embedding cache namespace)
+BACKEND_MODELS = {9991: "nomic-embed-text-v1.5", 9992: "bge-reranker-v2-m3"}
+for port, model_name in BACKEND_MODELS.items():
+    label_backend(f"http://localhost:{port}", model_name)
+
+# Backend launch: both load concurrently; health is polled without blocking the loop
+LLAMA_STARTUP_TIMEOUT = float(os.getenv("LLAMA_STARTUP_TIMEOUT", "120"))
+LLAMA_HEALTH_INTERVAL = float(os.getenv("LLAMA_HEALTH_INTERVAL", "0.5"))
+
+# Per-backend startup state for /ready: stopped -> loading -> ready | failed
+backend_status = {
+    port: {"model": model_name, "state": "stopped", "load_time_s": None, "error": None}
+    for port, model_name in BACKEND_MODELS.items()
+}
+startup_tasks: List[asyncio.Task] = []
+
+def running_backends():
+    """(base_url, model) of every live llama-server, for backend metrics"""
+    processes = {9991: embedding_server, 9992: reranker_server}
+    return [
+        (f"http://localhost:{port}", BACKEND_MODELS[port])
+        for port, process in processes.items()
+        if process and process.poll() is None
+    ]
+
+backend_metrics = register_backends(running_backends)
+
+# In-flight request limits matching each backend's --parallel slots
+slots = {
+    9991: BackendSlots(SERVER_SETTINGS["embedding"]["parallel"]),
+    9992: BackendSlots(SERVER_SETTINGS["reranker"]["parallel"]),
+}
+
+# Memoized backend token counts for batch packing, chunking and rerank usage
+tokenizers = {port: TokenCounter.from_env(f"http://localhost:{port}") for port in (9991, 9992)}
+
+# Cross-request batching schedulers, one per embedding backend port
+batchers = {
+    port: EmbeddingBatcher(
+        f"http://localhost:{port}",
+        max_batch_items=EMBED_MAX_BATCH_ITEMS,
+        max_batch_tokens=SERVER_SETTINGS[model_type]["batch_size"],
+        max_wait_ms=EMBED_BATCH_WAIT_MS,
+        slots=slots[port],
+        window_items=EMBED_BATCH_WINDOW,
+        tokenizer=tokenizers[port],
+    )
+    for port, model_type in ((9991, "embedding"),)
+}
 
 class EmbeddingRequest(BaseModel):
     input: Union[str, List[str]]
     model: str
-    encoding_format: str = "float"
+    # "binary" returns application/octet-stream (see vectors.pack_matrix)
+    encoding_format: Literal["float", "base64", "binary"] = "float"
+    # Chunk inputs longer than the context and pool the windows (default: EMBED_CHUNKING)
+    chunking: Optional[Literal["mean", "weighted"]] = None
+    # Matryoshka size to truncate to and renormalize (default: the model's native size)
+    dimensions: Optional[int] = None
 
 class RerankRequest(BaseModel):
     model: str
     query: str
     documents: List[str]
     top_k: Optional[int] = None
+    return_documents: bool = True
+    mode: Optional[Literal["cross_encoder", "cosine", "cascade"]] = None  # default: RERANK_MODE
+    cascade_top_n: Optional[int] = None  # default: RERANK_CASCADE_TOP_N
+    cascade_gap: Optional[float] = None  # default: RERANK_CASCADE_GAP
+
+def _startup_failed(port: int, started: float, error: str) -> None:
+    logger.error(f"Server for {BACKEND_MODELS[port]} on port {port}: {error}")
+    backend_status[port].update(state="failed", load_time_s=round(time.monotonic() - started, 2), error=error)
+    MODEL_EVENTS.labels(model=BACKEND_MODELS[port], event="start_failed").inc()
+    return None
 
-def start_llama_server(model_path: str, port: int, model_type: str = "embedding"):
-    """Start a llama-server process for the given model"""
+async def start_llama_server(model_path: str, port: int, model_type: str = "embedding"):
+    """Start a llama-server process and wait (asynchronously) until it is healthy"""
     logger.info(f"Starting llama-server for {model_type} on port {port}")
+    started = time.monotonic()
+    backend_status[port].update(state="loading", load_time_s=None, error=None)
     
-    # Conservative settings for 780M iGPU
+    # Conservative settings for 780M iGPU, unless the model has been calibrated;
+    # a copy per launch, so SERVER_SETTINGS keeps the defaults
+    profile = {PROFILE_SETTINGS[key]: value for key, value in load_profile(model_path).items()}
+    settings = {**SERVER_SETTINGS[model_type], **profile}
+    # Slots and batch budgets follow what this backend is launched with
+    await slots[port].resize(settings["parallel"])
+    if port in batchers:
+        batchers[port].max_batch_tokens = settings["batch_size"]
     cmd = [
-        "/app/llama-server",
+        LLAMA_SERVER_BIN,
         "--model", model_path,
         "--port", str(port),
         "--host", "0.0.0.0",  # Bind to all interfaces for external access
-        "--embeddings",
-        "--ctx-size", "2048" if model_type == "embedding" else "1024",
-        "--batch-size", "256",
-        "--threads", "4",
-        "--n-gpu-layers", "20" if model_type == "embedding" else "15"
+        "--embeddings" if model_type == "embedding" else "--reranking",
+        # llama-server splits the context across slots
+        "--ctx-size", str(settings["ctx_size"] * settings["parallel"]),
+        "--parallel", str(settings["parallel"]),
+        "--cont-batching",
+        "--batch-size", str(settings["batch_size"]),
+        "--ubatch-size", str(settings["batch_size"]),
+        "--threads", str(settings["threads"]),
+        "--n-gpu-layers", str(settings["n_gpu_layers"]),
+        "--metrics",  # native Prometheus endpoint, re-exported by /metrics
     ]
     
     # Set Vulkan environment
@@ -67,59 +209,60 @@ def start_llama_server(model_path: str, port: int, model_type: str = "embedding"
     
     try:
         process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
+    except Exception as e:
+        return _startup_failed(port, started, f"failed to launch: {e}")
+    
+    base_url = f"http://localhost:{port}"
+    # Drain stdout/stderr: a full pipe would block llama-server mid-request
+    backend_logs.attach(base_url, process)
+    attempt = 0
+    try:
         # Wait for server to be ready (longer timeout for model loading)
-        for i in range(120):  # 120 second timeout
+        while time.monotonic() - started < LLAMA_STARTUP_TIMEOUT:
             # Check if process is still alive
             if process.poll() is not None:
-                logger.error(f"Server process for {model_type} died unexpectedly")
-                return None
-                
+                await asyncio.sleep(0.1)  # let the pump read the last lines
+                last_line = backend_logs.last_line(base_url)
+                error = f"process exited with code {process.returncode}" + (f": {last_line}" if last_line else "")
+                return _startup_failed(port, started, error)
+            
             try:
-                response = requests.get(f"http://localhost:{port}/health", timeout=5)
+                response = await upstream.get(base_url, "/health", timeout=5)
                 if response.status_code == 200:
-                    logger.info(f"Server for {model_type} is ready on port {port}")
+                    load_time = time.monotonic() - started
+                    logger.info(f"Server for {model_type} is ready on port {port} ({load_time:.1f}s)")
+                    backend_status[port].update(state="ready", load_time_s=round(load_time, 2))
+                    MODEL_EVENTS.labels(model=BACKEND_MODELS[port], event="start").inc()
                     return process
-            except requests.RequestException as e:
-                if i % 10 == 0:  # Log every 10 seconds
-                    logger.info(f"Waiting for {model_type} server (attempt {i+1}/120): {e}")
-                pass
-            time.sleep(1)
-        
-        logger.error(f"Server for {model_type} failed to start within timeout")
+            except httpx.HTTPError as e:
+                if attempt % 20 == 0:  # Log every ~10 seconds
+                    logger.info(f"Waiting for {model_type} server ({time.monotonic() - started:.0f}s): {e!r}")
+            attempt += 1
+            await asyncio.sleep(LLAMA_HEALTH_INTERVAL)
+    except asyncio.CancelledError:
+        # Shutdown while still loading
         process.terminate()
-        return None
-        
-    except Exception as e:
-        logger.error(f"Failed to start server for {model_type}: {e}")
-        return None
+        raise
+    
+    process.terminate()
+    return _startup_failed(port, started, f"not healthy within {LLAMA_STARTUP_TIMEOUT:.0f}s")
 
-def get_embedding(text: str, port: int) -> List[float]:
+async def get_embedding(text: str, port: int) -> List[float]:
     """Get embedding from llama-server"""
-    try:
-        response = requests.post(
-            f"http://localhost:{port}/embedding",
-            json={"content": text},
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
-        
-        # Handle response format: [{"embedding": [float, ...], "index": 0}]
-        if isinstance(data, list) and len(data) > 0 and "embedding" in data[0]:
-            embedding = data[0]["embedding"]
-            
-            # Handle nested array case from native server
-            if isinstance(embedding, list) and len(embedding) > 0 and isinstance(embedding[0], list):
-                return embedding[0]
-            elif isinstance(embedding, list) and len(embedding) > 0:
-                return embedding
-        
-        logger.error(f"Unexpected response format from llama-server: {data}")
-        return []
-    except Exception as e:
-        logger.error(f"Error getting embedding: {e}")
-        return []
+    return (await get_embeddings([text], port))[0]
+
+async def get_embeddings(texts: List[str], port: int) -> List[List[float]]:
+    """Get embeddings for many texts, from cache or via the port's batching scheduler"""
+    vectors = await get_embedding_arrays(texts, port)
+    return [vector.tolist() if vector is not None else [] for vector in vectors]
+
+async def get_embedding_arrays(texts: List[str], port: int) -> List[Optional[np.ndarray]]:
+    """Like get_embeddings but returns float32 arrays (None where embedding failed)"""
+    return (await get_embeddings_counted(texts, port))[0]
+
+async def get_embeddings_counted(texts: List[str], port: int) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+    """Float32 arrays plus the prompt tokens each text cost (cached along with the vector)"""
+    return await embedding_cache.resolve(BACKEND_MODELS[port], texts, batchers[port].embed_counted)
 
 app = FastAPI(title="Unicorn Embedding Server", version="1.0.0")
 
@@ -131,32 +274,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def launch_embedding_server(model_path: str):
+    global embedding_server
+    embedding_server = await start_llama_server(model_path, 9991, "embedding")
+
+async def launch_reranker_server(model_path: str):
+    global reranker_server
+    reranker_server = await start_llama_server(model_path, 9992, "reranker")
+
 @app.on_event("startup")
 async def startup():
-    """Start the llama-server processes"""
-    global embedding_server, reranker_server
-    
-    models_dir = Path("/app/models")
+    """Launch the llama-server processes in the background (progress on /ready)"""
+    global embedding_dims
+    models_dir = Path(MODELS_DIR)
     
     # Start embedding server
     embedding_model = models_dir / "embeddings" / "nomic-embed-text-v1.5.Q8_0.gguf"
     if embedding_model.exists():
-        embedding_server = start_llama_server(str(embedding_model), 9991, "embedding")
+        embedding_cache.attach_model(BACKEND_MODELS[9991], str(embedding_model))
+        embedding_dims = model_dimensions(str(embedding_model))
+        logger.info(f"Embedding dimensions: {embedding_dims.native} native, allowed {embedding_dims.allowed}")
+        startup_tasks.append(asyncio.create_task(launch_embedding_server(str(embedding_model))))
     
     # Start reranker server  
     reranker_model = models_dir / "rerankers" / "bge-reranker-v2-m3-Q8_0.gguf"
     if reranker_model.exists():
-        reranker_server = start_llama_server(str(reranker_model), 9992, "reranker")
+        startup_tasks.append(asyncio.create_task(launch_reranker_server(str(reranker_model))))
+
+    backend_metrics.start(BACKEND_METRICS_INTERVAL)
 
 @app.on_event("shutdown")
 async def shutdown():
     """Stop the llama-server processes"""
     global embedding_server, reranker_server
     
+    # Backends still loading are terminated by their cancelled startup task
+    for task in startup_tasks:
+        task.cancel()
+    await asyncio.gather(*startup_tasks, return_exceptions=True)
+    
     if embedding_server:
         embedding_server.terminate()
+        MODEL_EVENTS.labels(model=BACKEND_MODELS[9991], event="stop").inc()
     if reranker_server:
         reranker_server.terminate()
+        MODEL_EVENTS.labels(model=BACKEND_MODELS[9992], event="stop").inc()
+    
+    await backend_metrics.stop()
+    for batcher in batchers.values():
+        await batcher.close()
+    await backend_logs.close()
+    await upstream.aclose()
+    await embedding_cache.close()
 
 @app.get("/")
 async def root():
@@ -166,8 +335,8 @@ async def root():
 async def health():
     """Health check endpoint"""
     models = {
-        "embedding": "healthy" if embedding_server and embedding_server.poll() is None else "stopped",
-        "reranker": "healthy" if reranker_server and reranker_server.poll() is None else "stopped"
+        "embedding": "healthy" if embedding_server and embedding_server.poll() is None else backend_status[9991]["state"],
+        "reranker": "healthy" if reranker_server and reranker_server.poll() is None else backend_status[9992]["state"]
     }
     
     return {
@@ -175,9 +344,51 @@ async def health():
         "models": models,
         "backend": "source-built-llama-cpp",
         "gpu_backend": "Vulkan (Pure/Forced)",
-        "hardware": "AMD 8945HS + 780M iGPU"
+        "hardware": "AMD 8945HS + 780M iGPU",
+        "rerank_mode": RERANK_MODE,
+        "batching": {
+            "embedding": batchers[9991].stats()
+        },
+        "slots": {
+            "embedding": slots[9991].stats(),
+            "reranker": slots[9992].stats()
+        },
+        "cache": embedding_cache.stats()
     }
 
+@app.get("/live")
+async def live():
+    """Liveness: the wrapper process and its event loop are responsive"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once any backend is ready, with per-model state and load time"""
+    processes = {9991: embedding_server, 9992: reranker_server}
+    models = {}
+    for port, status in backend_status.items():
+        models[status["model"]] = {key: value for key, value in status.items() if key != "model"}
+        if status["state"] == "ready" and (processes[port] is None or processes[port].poll() is not None):
+            models[status["model"]].update(state="failed", error="process exited")
+    is_ready = any(status["state"] == "ready" for status in models.values())
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "not_ready", "models": models},
+    )
+
+@app.get("/admin/logs")
+async def backend_log_tail(backend: Optional[str] = None, lines: int = 100, level: str = "info"):
+    """Recent llama-server output per backend (model name or host:port), with parsed timings"""
+    if level not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {', '.join(LEVELS)}")
+    return {"backends": backend_logs.tail(backend, lines, level)}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (wrapper series plus re-exported unicorn_backend_*)"""
+    await backend_metrics.refresh_if_stale()
+    return Response(content=render_latest(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/v1/models")
 async def list_models():
     """List available models (OpenAI compatible)"""
@@ -191,7 +402,8 @@ async def list_models():
             "owned_by": "unicorn-embed",
             "permission": [],
             "root": "nomic-embed-text-v1.5",
-            "parent": None
+            "parent": None,
+            "dimensions": list(embedding_dims.allowed)
         })
     
     if reranker_server and reranker_server.poll() is None:
@@ -210,6 +422,17 @@ async def list_models():
         "data": models
     }
 
+def _output_size(dimensions: Optional[int]) -> Optional[int]:
+    """Validated Matryoshka size for a request (None = native)"""
+    try:
+        return embedding_dims.check(dimensions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _fallback_dim(vectors: List[Optional[np.ndarray]], size: Optional[int]) -> int:
+    """Length of the zero vector returned in place of a failed embedding"""
+    return size or embedding_dims.native or next((len(v) for v in vectors if v is not None), 768)
+
 @app.post("/v1/embeddings")
 async def create_embeddings(request: EmbeddingRequest):
     """Create embeddings (OpenAI compatible)"""
@@ -217,38 +440,75 @@ async def create_embeddings(request: EmbeddingRequest):
     
     if not embedding_server or embedding_server.poll() is not None:
         raise HTTPException(status_code=503, detail="Embedding server not available")
+    size = _output_size(request.dimensions)
     
     try:
         texts = request.input if isinstance(request.input, list) else [request.input]
         
-        embeddings_data = []
-        for i, text in enumerate(texts):
-            embedding = get_embedding(text, 9991)
-            if not embedding:  # Check if embedding is empty
+        chunking = request.chunking or EMBED_CHUNKING
+        chunk_counts = None
+        if chunking:
+            embeddings, chunk_counts = await embed_chunked(
+                texts,
+                lambda pieces: get_embedding_arrays(pieces, 9991),
+                tokenizers[9991],
+                max_tokens=EMBED_CHUNK_TOKENS,
+                overlap=EMBED_CHUNK_OVERLAP,
+                pooling=chunking,
+            )
+            prompt_tokens = sum(await tokenizers[9991].count(texts))
+        else:
+            embeddings, counts = await get_embeddings_counted(texts, 9991)
+            prompt_tokens = sum(counts)
+        embeddings = truncate(embeddings, embedding_dims, size)
+        for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+            if embedding is None:
                 # Return zero vector instead of failing completely
                 logger.warning(f"Failed to generate embedding for text, returning zeros: {text[:50]}...")
-                embedding = [0.0] * 768  # Nomic v1.5 has 768 dimensions
-            embeddings_data.append({
-                "object": "embedding",
-                "embedding": embedding,
-                "index": i
-            })
+                embeddings[i] = np.zeros(_fallback_dim(embeddings, size), dtype=np.float32)
+                ZERO_VECTOR_FALLBACKS.labels(model=BACKEND_MODELS[9991], endpoint="/v1/embeddings").inc()
         
-        response = {
-            "object": "list",
-            "data": embeddings_data,
-            "model": request.model,
-            "usage": {
-                "prompt_tokens": sum(len(text.split()) for text in texts),
-                "total_tokens": sum(len(text.split()) for text in texts)
+        if request.encoding_format == "binary":
+            headers = {"X-Model": request.model, "X-Prompt-Tokens": str(prompt_tokens)}
+            if chunk_counts is not None:
+                headers["X-Chunks"] = str(sum(chunk_counts))
+            with timed(SERIALIZATION_TIME, endpoint="/v1/embeddings", format="binary"):
+                return Response(
+                    content=pack_matrix(embeddings),
+                    media_type=BINARY_MEDIA_TYPE,
+                    headers=headers
+                )
+        
+        # Rendered here (not by FastAPI) so serialization time is measured
+        with timed(SERIALIZATION_TIME, endpoint="/v1/embeddings", format=request.encoding_format):
+            embeddings_data = [
+                {
+                    "object": "embedding",
+                    "embedding": format_embedding(embedding, request.encoding_format),
+                    "index": i
+                }
+                for i, embedding in enumerate(embeddings)
+            ]
+            
+            response = {
+                "object": "list",
+                "data": embeddings_data,
+                "model": request.model,
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "total_tokens": prompt_tokens
+                }
             }
-        }
+            if chunk_counts is not None:
+                response["usage"]["chunks"] = sum(chunk_counts)
+            rendered = JSONResponse(content=response)
         
         logger.info(f"Returning {len(embeddings_data)} embeddings")
-        return response
+        return rendered
         
     except Exception as e:
         logger.error(f"Error creating embeddings: {e}")
+        ERRORS.labels(model=BACKEND_MODELS[9991], endpoint="/v1/embeddings").inc()
         # Return empty response instead of raising exception
         return {
             "object": "list",
@@ -257,6 +517,29 @@ async def create_embeddings(request: EmbeddingRequest):
             "usage": {"prompt_tokens": 0, "total_tokens": 0}
         }
 
+@app.post("/v1/embeddings/stream")
+async def create_embeddings_stream(request: Request, encoding_format: str = "float", dimensions: Optional[int] = None):
+    """Bulk embeddings: NDJSON {"id", "text"} lines in, NDJSON results out as each chunk completes"""
+    if not embedding_server or embedding_server.poll() is not None:
+        raise HTTPException(status_code=503, detail="Embedding server not available")
+    if encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+    size = _output_size(dimensions)
+    
+    async def embed(texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        vectors, counts = await get_embeddings_counted(texts, 9991)
+        return truncate(vectors, embedding_dims, size), counts
+    
+    return DuplexStreamingResponse(
+        stream_embeddings(
+            iter_ndjson(request.stream()),
+            embed,
+            chunk_size=EMBED_STREAM_CHUNK,
+            encoding_format=encoding_format
+        ),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
 # Alternative endpoint that returns just embeddings as list (for compatibility)
 @app.post("/embeddings") 
 async def simple_embeddings(request: dict):
@@ -264,65 +547,97 @@ async def simple_embeddings(request: dict):
     texts = request.get("input", [])
     if isinstance(texts, str):
         texts = [texts]
+    size = _output_size(request.get("dimensions"))
     
     logger.info(f"Simple embeddings request for {len(texts)} texts")
     
+    vectors = truncate(await get_embedding_arrays(texts, 9991), embedding_dims, size)
     result = []
-    for text in texts:
-        embedding = get_embedding(text, 9991)
-        if not embedding:
+    for text, vector in zip(texts, vectors):
+        if vector is None:
             logger.warning(f"Failed embedding, using zeros: {text[:50]}...")
-            embedding = [0.0] * 768
-        result.append(embedding)
+            vector = np.zeros(_fallback_dim(vectors, size), dtype=np.float32)
+            ZERO_VECTOR_FALLBACKS.labels(model=BACKEND_MODELS[9991], endpoint="/embeddings").inc()
+        result.append(vector.tolist())
     
     logger.info(f"Returning {len(result)} embeddings as list")
     return result
 
+async def score_cosine(query: str, documents: List[str]) -> np.ndarray:
+    """Cheap relevance: cosine similarity of nomic embeddings (cached, batched)"""
+    vectors = await get_embedding_arrays([query] + documents, 9991)
+    if vectors[0] is None:
+        raise ValueError("Failed to embed query")
+    
+    # One normalized matrix-vector product instead of a per-document loop
+    return cosine_scores(vectors[0], stack_rows(vectors[1:], len(vectors[0])))
+
+async def score_cross_encoder(query: str, documents: List[str]) -> np.ndarray:
+    """Accurate relevance: the reranker's ranking head on each (query, document) pair"""
+    return await cross_encode(
+        "http://localhost:9992",
+        query,
+        documents,
+        pair_batch=RERANK_PAIR_BATCH,
+        max_pair_tokens=RERANK_MAX_PAIR_TOKENS,
+        slots=slots[9992],
+    )
+
 @app.post("/v1/rerank")
 async def rerank_documents(request: RerankRequest):
-    """Rerank documents using similarity"""
-    if not reranker_server or reranker_server.poll() is not None:
+    """Rerank documents with the cross-encoder, or by embedding similarity in cosine mode"""
+    mode = request.mode or RERANK_MODE
+    if mode not in RERANK_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown rerank mode: {mode}")
+    
+    if mode != "cosine" and (not reranker_server or reranker_server.poll() is not None):
         raise HTTPException(status_code=503, detail="Reranker server not available")
+    if mode != "cross_encoder" and (not embedding_server or embedding_server.poll() is not None):
+        raise HTTPException(status_code=503, detail="Embedding server not available")
     
+    counting = None
     try:
-        # Get query embedding
-        query_embedding = np.array(get_embedding(request.query, 9992))
-        
-        # Get document embeddings and calculate similarities
-        results = []
-        for i, doc in enumerate(request.documents):
-            doc_embedding = np.array(get_embedding(doc, 9992))
-            
-            # Calculate cosine similarity
-            similarity = np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
+        # Usage from the tokenizer of the model that saw every document, counted alongside scoring
+        tokenizer = tokenizers[9992 if mode == "cross_encoder" else 9991]
+        counting = asyncio.create_task(tokenizer.count([request.query] + request.documents))
+        extra = {}
+        order = None
+        if mode == "cascade":
+            order, scores, extra["cascade"] = await cascade(
+                request.query,
+                request.documents,
+                score_cosine,
+                score_cross_encoder,
+                top_n=request.cascade_top_n or RERANK_CASCADE_TOP_N,
+                min_n=RERANK_CASCADE_MIN_N,
+                gap=request.cascade_gap if request.cascade_gap is not None else RERANK_CASCADE_GAP,
             )
-            
-            results.append({
-                "index": i,
-                "document": doc,
-                "relevance_score": float(similarity)
-            })
-        
-        # Sort by relevance score
-        results.sort(key=lambda x: x["relevance_score"], reverse=True)
-        
-        # Apply top_k if specified
-        if request.top_k:
-            results = results[:request.top_k]
+        elif mode == "cross_encoder":
+            scores = await score_cross_encoder(request.query, request.documents)
+        else:
+            scores = await score_cosine(request.query, request.documents)
+        results = rank_results(scores, request.documents, request.top_k, request.return_documents, order=order)
+        prompt_tokens = sum(await counting)
         
         return {
             "model": request.model,
+            "mode": mode,
+            **extra,
             "results": results,
             "usage": {
-                "prompt_tokens": len(request.query.split()) + sum(len(doc.split()) for doc in request.documents),
-                "total_tokens": len(request.query.split()) + sum(len(doc.split()) for doc in request.documents)
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens
             }
         }
         
     except Exception as e:
         logger.error(f"Error reranking documents: {e}")
+        ERRORS.labels(model=BACKEND_MODELS[9992 if mode == "cross_encoder" else 9991], endpoint="/v1/rerank").inc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Scoring failed or the client went away: nobody will read the count
+        if counting is not None and not counting.done():
+            counting.cancel()
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -13,23 +13,102 @@ import asyncio
 import logging
 import subprocess
 import signal
-import requests
 import shutil
 from pathlib import Path
-from typing import Dict, List, Optional, Union, Any
+from typing import Dict, List, Literal, Optional, Tuple, Union, Any
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 import numpy as np
+import httpx
+
+from upstream import BackendSlots, upstream
+from tokenization import TokenCounter
+from chunking import embed_chunked
+from metrics import ERRORS, METRICS_CONTENT_TYPE, MODEL_EVENTS, SERIALIZATION_TIME, label_backend, render_latest, timed
+from backend_metrics import register_backends
+from backend_logs import LEVELS, backend_logs
+from batching import EmbeddingBatcher
+from prewarm import UsageHistory
+from profiles import load_profile
+from matryoshka import ModelDimensions, model_dimensions, truncate
+from residency import OverBudgetError, ResidencyManager, process_rss_mb
+from embedding_cache import embedding_cache
+from vectors import BINARY_MEDIA_TYPE, cosine_scores, format_embedding, pack_matrix, rank_results, stack_rows
+from rerank import RERANK_MODES, cascade, cross_encode
+from streaming import NDJSON_MEDIA_TYPE, DuplexStreamingResponse, iter_ndjson, stream_embeddings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cross-request batching settings (see batching.EmbeddingBatcher)
+EMBED_MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", "64"))
+EMBED_BATCH_WINDOW = int(os.getenv("EMBED_BATCH_WINDOW", "256"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+# llama-server binary (benchmarks/fake_llama_server.py stands in for benchmarking)
+LLAMA_SERVER_BIN = os.getenv("LLAMA_SERVER_BIN", "/app/llama-server")
+# Default llama-server --parallel slots per process (see ModelConfig.n_parallel)
+LLAMA_PARALLEL = int(os.getenv("LLAMA_PARALLEL", "4"))
+# Default llama-server --threads per process (a calibrated profile overrides it)
+LLAMA_THREADS = int(os.getenv("LLAMA_THREADS", "4"))
+EMBED_STREAM_CHUNK = int(os.getenv("EMBED_STREAM_CHUNK", "256"))
+# Over-length inputs: "" leaves them to the backend, "mean"/"weighted" chunks
+# them into overlapping n_ctx windows and pools (per request via "chunking")
+EMBED_CHUNKING = os.getenv("EMBED_CHUNKING", "")
+EMBED_CHUNK_OVERLAP = int(os.getenv("EMBED_CHUNK_OVERLAP", "64"))
+
+# Rerank engine: "cross_encoder" uses a reranking model's ranking head,
+# "cosine" ranks by similarity from an embedding model (always the case
+# for embedding models unless a request asks otherwise)
+RERANK_MODE = os.getenv("RERANK_MODE", "cross_encoder")
+RERANK_PAIR_BATCH = int(os.getenv("RERANK_PAIR_BATCH", "16"))
+RERANK_CASCADE_TOP_N = int(os.getenv("RERANK_CASCADE_TOP_N", "32"))
+RERANK_CASCADE_MIN_N = int(os.getenv("RERANK_CASCADE_MIN_N", "8"))
+RERANK_CASCADE_GAP = float(os.getenv("RERANK_CASCADE_GAP")) if os.getenv("RERANK_CASCADE_GAP") else None
+RERANK_EMBEDDING_MODEL = os.getenv("RERANK_EMBEDDING_MODEL", "")
+
+# llama-server replicas per model: DEFAULT_REPLICAS for all, MODEL_REPLICAS
+# overrides per model, e.g. "embedding_nomic-embed-text-v1.5=3,reranker_bge=1"
+DEFAULT_REPLICAS = int(os.getenv("DEFAULT_REPLICAS", "1"))
+MAX_REPLICAS = int(os.getenv("MAX_REPLICAS", "8"))
+REPLICA_DRAIN_TIMEOUT = float(os.getenv("REPLICA_DRAIN_TIMEOUT", "60"))
+# A replica that fails to start waits this long before the next attempt,
+# doubling per consecutive failure up to REPLICA_RESTART_BACKOFF_MAX
+REPLICA_RESTART_BACKOFF = float(os.getenv("REPLICA_RESTART_BACKOFF", "5"))
+REPLICA_RESTART_BACKOFF_MAX = float(os.getenv("REPLICA_RESTART_BACKOFF_MAX", "300"))
+# Models started at launch and never auto-unloaded ("all" for every model)
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+# How often usage history is checked for models to prewarm (0 = no prewarming)
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "60"))
+
+# Residency checks (RSS sampling, budget enforcement, idle unloads) every N seconds
+RESIDENCY_INTERVAL = float(os.getenv("RESIDENCY_INTERVAL", "30"))
+
+# Background scrape of the replicas' own /metrics (0 = only when /metrics is scraped)
+BACKEND_METRICS_INTERVAL = float(os.getenv("BACKEND_METRICS_INTERVAL", "15"))
+
+def _parse_replica_counts(spec: str) -> Dict[str, int]:
+    """Parse MODEL_REPLICAS into {model name: replica count}"""
+    counts: Dict[str, int] = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry or "=" not in entry:
+            continue
+        name, value = entry.rsplit("=", 1)
+        try:
+            counts[name.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid replica count: {entry}")
+    return counts
+
+MODEL_REPLICAS = _parse_replica_counts(os.getenv("MODEL_REPLICAS", ""))
+
 @dataclass
 class ModelConfig:
     """Configuration for a model server instance"""
@@ -39,42 +118,102 @@ class ModelConfig:
     port: int
     n_gpu_layers: int = 20  # Reduced for 780M iGPU
     n_ctx: int = 2048  # Use model defaults
-    n_batch: int = 256  # Reduced batch size
+    n_batch: int = 2048  # Token budget per upstream request; also the ubatch (whole inputs)
+    n_parallel: int = LLAMA_PARALLEL  # Sequences llama-server batches concurrently
+    n_threads: int = LLAMA_THREADS
     embedding: bool = True
+    dimensions: Optional[ModelDimensions] = None  # Native and Matryoshka output sizes (embedding models)
 
 class LlamaServerProcess:
     """Manages a single llama-server process"""
     
-    def __init__(self, config: ModelConfig):
+    def __init__(self, config: ModelConfig, port: Optional[int] = None, tokenizer: Optional[TokenCounter] = None):
         self.config = config
+        self.port = port or config.port
         self.process: Optional[subprocess.Popen] = None
         self.last_used = time.time()
         self.is_healthy = False
+        self.in_flight = 0
+        # The launch in progress, shared by every caller that needs this replica
+        self._starting: Optional[asyncio.Future] = None
+        # Consecutive failed launches and when the next one may be tried
+        self.failures = 0
+        self.retry_at = 0.0
+        label_backend(self.base_url, config.name)
+        # Exactly as many upstream requests in flight as the backend has slots
+        self.slots = BackendSlots(config.n_parallel)
+        self.batcher = EmbeddingBatcher(
+            self.base_url,
+            max_batch_items=EMBED_MAX_BATCH_ITEMS,
+            max_batch_tokens=config.n_batch,
+            max_wait_ms=EMBED_BATCH_WAIT_MS,
+            slots=self.slots,
+            window_items=EMBED_BATCH_WINDOW,
+            tokenizer=tokenizer,
+        )
+        
+    @property
+    def base_url(self) -> str:
+        return f"http://localhost:{self.port}"
         
     async def start(self) -> bool:
-        """Start the llama-server process"""
-        if self.process and self.process.poll() is None:
+        """Start the llama-server process; True once it passes the health check
+        
+        Single flight: a caller arriving mid-launch awaits that launch rather
+        than taking the live but still loading process for a started one.
+        After a failed launch, returns False without trying until the backoff
+        has passed.
+        """
+        if self.is_running():
             return True
-            
-        logger.info(f"Starting llama-server for {self.config.name} on port {self.config.port}")
+        if self._starting is None:
+            if not self.can_restart():
+                return False
+            self._starting = asyncio.ensure_future(self._launch())
+            self._starting.add_done_callback(self._launch_done)
+        # Shielded so a cancelled request does not abort the launch for the others
+        return await asyncio.shield(self._starting)
+    
+    def _launch_done(self, future: asyncio.Future):
+        self._starting = None
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.failures, self.retry_at = 0, 0.0
+        else:
+            self.failures += 1
+            backoff = min(REPLICA_RESTART_BACKOFF * 2 ** (self.failures - 1), REPLICA_RESTART_BACKOFF_MAX)
+            self.retry_at = time.monotonic() + backoff
+            logger.warning(f"{self.config.name} replica on port {self.port} failed to start "
+                           f"({self.failures} in a row), next attempt in {backoff:.0f}s")
+    
+    def can_restart(self) -> bool:
+        return time.monotonic() >= self.retry_at
+    
+    async def _launch(self) -> bool:
+        logger.info(f"Starting llama-server for {self.config.name} on port {self.port}")
         
         # Find llama-server binary
-        llama_server_path = "/app/llama-server"
+        llama_server_path = LLAMA_SERVER_BIN
         if not os.path.exists(llama_server_path):
-            raise RuntimeError("llama-server binary not found at /app/llama-server")
+            raise RuntimeError(f"llama-server binary not found at {llama_server_path}")
         
         # Build command arguments
         cmd = [
             llama_server_path,
             "--model", self.config.path,
-            "--port", str(self.config.port),
+            "--port", str(self.port),
             "--host", "0.0.0.0",
-            "--embeddings",  # Enable embeddings endpoint
-            "--ctx-size", str(self.config.n_ctx),
+            # Embeddings endpoint, or rank pooling + /rerank for reranking models
+            "--embeddings" if self.config.type == "embedding" else "--reranking",
+            # n_ctx is per slot; llama-server splits --ctx-size across --parallel slots
+            "--ctx-size", str(self.config.n_ctx * self.config.n_parallel),
+            "--parallel", str(self.config.n_parallel),
+            "--cont-batching",
             "--batch-size", str(self.config.n_batch),
-            "--threads", "4",  # Conservative thread count
+            "--ubatch-size", str(self.config.n_batch),
+            "--threads", str(self.config.n_threads),
             "--mmap",  # Use mmap for efficiency
             "--n-gpu-layers", str(self.config.n_gpu_layers),
+            "--metrics",  # native Prometheus endpoint, re-exported by /metrics
         ]
         
         # AMD GPU optimizations (Vulkan-only)
@@ -94,13 +233,17 @@ class LlamaServerProcess:
                 env=env,
                 preexec_fn=os.setsid  # Create new process group
             )
+            # Drain stdout/stderr: a full pipe would block llama-server mid-request
+            backend_logs.attach(self.base_url, self.process)
             
             # Wait for server to be ready
             await self._wait_for_health()
+            MODEL_EVENTS.labels(model=self.config.name, event="start").inc()
             return True
             
         except Exception as e:
             logger.error(f"Failed to start llama-server for {self.config.name}: {e}")
+            MODEL_EVENTS.labels(model=self.config.name, event="start_failed").inc()
             if self.process:
                 self.process.terminate()
                 self.process = None
@@ -110,13 +253,20 @@ class LlamaServerProcess:
         """Wait for the server to become healthy"""
         start_time = time.time()
         while time.time() - start_time < timeout:
+            if self.process.poll() is not None:
+                await asyncio.sleep(0.1)  # let the pump read the last lines
+                last_line = backend_logs.last_line(self.base_url)
+                raise RuntimeError(
+                    f"Server {self.config.name} exited with code {self.process.returncode}"
+                    + (f": {last_line}" if last_line else "")
+                )
             try:
-                response = requests.get(f"http://localhost:{self.config.port}/health", timeout=5)
+                response = await upstream.get(self.base_url, "/health", timeout=5)
                 if response.status_code == 200:
                     self.is_healthy = True
-                    logger.info(f"Server {self.config.name} is healthy on port {self.config.port}")
+                    logger.info(f"Server {self.config.name} is healthy on port {self.port}")
                     return
-            except requests.RequestException:
+            except httpx.HTTPError:
                 pass
             await asyncio.sleep(2)
         
@@ -125,7 +275,8 @@ class LlamaServerProcess:
     async def stop(self):
         """Stop the llama-server process"""
         if self.process and self.process.poll() is None:
-            logger.info(f"Stopping llama-server for {self.config.name}")
+            logger.info(f"Stopping llama-server for {self.config.name} on port {self.port}")
+            MODEL_EVENTS.labels(model=self.config.name, event="stop").inc()
             try:
                 # Send SIGTERM to process group
                 os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
@@ -145,6 +296,7 @@ class LlamaServerProcess:
             finally:
                 self.process = None
                 self.is_healthy = False
+        await self.batcher.close()
     
     async def _wait_for_exit(self):
         """Wait for process to exit"""
@@ -158,6 +310,19 @@ class LlamaServerProcess:
             return False
         return self.is_healthy
     
+    def load(self) -> int:
+        """Requests in flight plus texts waiting in the batcher queue"""
+        return self.in_flight + (self.batcher.queue.qsize() if self.batcher.queue else 0)
+    
+    @asynccontextmanager
+    async def _busy(self):
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.last_used = time.time()
+    
     async def proxy_request(self, endpoint: str, data: dict) -> dict:
         """Proxy a request to the llama-server"""
         if not self.is_running():
@@ -166,24 +331,265 @@ class LlamaServerProcess:
         self.last_used = time.time()
         
         try:
-            url = f"http://localhost:{self.config.port}{endpoint}"
-            response = requests.post(url, json=data, timeout=60)
-            response.raise_for_status()
-            return response.json()
+            async with self._busy(), self.slots:
+                return await upstream.post_json(self.base_url, endpoint, data, timeout=60)
         except Exception as e:
             logger.error(f"Proxy request failed for {self.config.name}: {e}")
             raise
 
+    async def embed(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embed texts from cache, sending misses through the batching scheduler
+
+        Returns float32 arrays in input order, None where embedding failed.
+        """
+        return (await self.embed_counted(texts))[0]
+    
+    async def embed_counted(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Like embed, plus the prompt tokens each text cost"""
+        self.last_used = time.time()
+        return await embedding_cache.resolve(self.config.name, texts, self._embed_uncached)
+    
+    async def _embed_uncached(self, texts: List[str]) -> Tuple[List[List[float]], List[int]]:
+        if not self.is_running():
+            await self.start()
+        async with self._busy():
+            return await self.batcher.embed_counted(texts)
+
+    async def rerank(self, query: str, documents: List[str]) -> np.ndarray:
+        """Score (query, document) pairs with the model's ranking head"""
+        if not self.is_running():
+            await self.start()
+        
+        self.last_used = time.time()
+        async with self._busy():
+            return await cross_encode(
+                self.base_url,
+                query,
+                documents,
+                pair_batch=RERANK_PAIR_BATCH,
+                max_pair_tokens=self.config.n_ctx,
+                slots=self.slots,
+            )
+
+class ReplicaPool:
+    """N llama-server replicas of one model behind least-loaded routing
+    
+    Exposes the same request interface as LlamaServerProcess. Replicas
+    removed by scale() stop taking new work and are stopped once drained.
+    """
+    
+    def __init__(self, config: ModelConfig, allocate_port, release_port, replicas: int = 1, make_room=None, ensure=None):
+        self.config = config
+        self._allocate_port = allocate_port
+        self._release_port = release_port
+        # Set once stopped (evicted, unloaded): the pool never starts again, and
+        # callers still holding it are sent to the model's current pool via ensure()
+        self.closed = False
+        # The manager's budgeted start: cold starts go through it so they make
+        # room in the memory budget first (or raise OverBudgetError)
+        self._ensure = ensure
+        # Budget check before relaunching crashed replicas: make_room(replicas)
+        self._make_room = make_room
+        self._restarting: Optional[asyncio.Task] = None
+        self.target = max(1, replicas)
+        self.replicas: List[LlamaServerProcess] = []
+        self.draining: List[LlamaServerProcess] = []
+        self.last_used = time.time()
+        self._lock = asyncio.Lock()
+        # Shared by every caller while a start is in progress (single flight)
+        self._starting: Optional[asyncio.Future] = None
+        # Token counts (batch packing, chunking, rerank usage) are model-level,
+        # so replicas share one cache; the replica on the configured port is
+        # always part of a running pool
+        self.tokenizer = TokenCounter.from_env(f"http://localhost:{config.port}")
+    
+    def _new_replica(self) -> LlamaServerProcess:
+        # The first replica keeps the model's configured port
+        ports_in_use = {replica.port for replica in self.replicas + self.draining}
+        port = self.config.port if self.config.port not in ports_in_use else self._allocate_port()
+        return LlamaServerProcess(self.config, port, tokenizer=self.tokenizer)
+    
+    async def start(self) -> bool:
+        """Bring the pool up to its target size; True if any replica is serving
+        
+        Concurrent callers await one shared attempt instead of each launching
+        processes on the same ports and waiting out their own health timeout.
+        """
+        if self.closed:
+            return False
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+            self._starting.add_done_callback(self._start_done)
+        # Shielded so a cancelled request does not abort the start for the others
+        return await asyncio.shield(self._starting)
+    
+    def _start_done(self, future: asyncio.Future):
+        self._starting = None
+        if not future.cancelled() and future.exception():
+            logger.error(f"Starting {self.config.name} failed: {future.exception()}")
+    
+    def is_starting(self) -> bool:
+        return self._starting is not None
+    
+    async def _start(self) -> bool:
+        async with self._lock:
+            while len(self.replicas) < self.target:
+                self.replicas.append(self._new_replica())
+            stopped = [replica for replica in self.replicas if not replica.is_running()]
+            if stopped:
+                await asyncio.gather(*(replica.start() for replica in stopped))
+        return self.is_running()
+    
+    def is_running(self) -> bool:
+        return any(replica.is_running() for replica in self.replicas)
+    
+    async def _pick(self) -> LlamaServerProcess:
+        """Least-loaded running replica (in flight + queued), starting the pool if needed"""
+        if self.closed:
+            # Evicted while a caller held on to it: relaunching here would
+            # start an orphan the manager no longer tracks or budgets
+            if self._ensure is None:
+                raise RuntimeError(f"{self.config.name} has been unloaded")
+            return await (await self._ensure())._pick()
+        self.last_used = time.time()
+        running = [replica for replica in self.replicas if replica.is_running()]
+        if not running:
+            if self._ensure is not None:
+                pool = await self._ensure()
+                if pool is not self:
+                    return await pool._pick()
+            else:
+                await self.start()
+            running = [replica for replica in self.replicas if replica.is_running()]
+            if not running:
+                raise RuntimeError(f"No replica of {self.config.name} is running")
+        elif len(running) < len(self.replicas):
+            # Replace crashed replicas without holding up this request
+            self._schedule_restart()
+        return min(running, key=lambda replica: replica.load())
+    
+    def _schedule_restart(self):
+        """Relaunch crashed replicas in the background: one attempt at a time, each after its backoff"""
+        if self.closed or self.is_starting() or (self._restarting is not None and not self._restarting.done()):
+            return
+        if any(not replica.is_running() and replica.can_restart() for replica in self.replicas):
+            self._restarting = asyncio.create_task(self._restart())
+    
+    async def _restart(self):
+        crashed = [replica for replica in self.replicas if not replica.is_running() and replica.can_restart()]
+        try:
+            if self._make_room is not None:
+                await self._make_room(len(crashed))
+            await self.start()
+        except Exception as e:
+            logger.error(f"Restarting {self.config.name} replicas failed: {e}")
+    
+    def resident_replicas(self) -> int:
+        """Replicas holding (or about to hold) memory: all while starting, else the running ones"""
+        if self.is_starting():
+            return len(self.replicas) or self.target
+        return sum(1 for replica in self.replicas if replica.is_running())
+    
+    async def scale(self, replicas: int):
+        """Change the replica count; new replicas start now, removed ones drain first"""
+        replicas = max(1, min(replicas, MAX_REPLICAS))
+        async with self._lock:
+            self.target = replicas
+            removed = self.replicas[replicas:]
+            self.replicas = self.replicas[:replicas]
+            self.draining.extend(removed)
+        for replica in removed:
+            asyncio.create_task(self._drain(replica))
+        if len(self.replicas) < replicas:
+            await self.start()
+        logger.info(f"Scaled {self.config.name} to {replicas} replicas ({len(removed)} draining)")
+    
+    async def _drain(self, replica: LlamaServerProcess):
+        deadline = time.time() + REPLICA_DRAIN_TIMEOUT
+        while replica.load() > 0 and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        if replica.load() > 0:
+            logger.warning(f"Stopping {self.config.name} replica on port {replica.port} with {replica.load()} requests pending")
+        await replica.stop()
+        self.draining.remove(replica)
+        if replica.port != self.config.port:
+            self._release_port(replica.port)
+    
+    async def embed(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embed texts from cache; misses go to the least-loaded replica"""
+        return (await self.embed_counted(texts))[0]
+    
+    async def embed_counted(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Like embed, plus the prompt tokens each text cost"""
+        self.last_used = time.time()
+        return await embedding_cache.resolve(self.config.name, texts, self._embed_uncached)
+    
+    async def _embed_uncached(self, texts: List[str]) -> Tuple[List[List[float]], List[int]]:
+        replica = await self._pick()
+        return await replica._embed_uncached(texts)
+    
+    async def rerank(self, query: str, documents: List[str]) -> np.ndarray:
+        replica = await self._pick()
+        return await replica.rerank(query, documents)
+    
+    async def proxy_request(self, endpoint: str, data: dict) -> dict:
+        replica = await self._pick()
+        return await replica.proxy_request(endpoint, data)
+    
+    async def stop(self):
+        """Stop every replica immediately, including draining ones"""
+        self.closed = True
+        if self._restarting is not None and self._restarting is not asyncio.current_task():
+            self._restarting.cancel()
+        async with self._lock:
+            replicas = self.replicas + self.draining
+            self.replicas = []
+            self.draining = []
+        await asyncio.gather(*(replica.stop() for replica in replicas), return_exceptions=True)
+        for replica in replicas:
+            if replica.port != self.config.port:
+                self._release_port(replica.port)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "target": self.target,
+            "replicas": [
+                {
+                    "port": replica.port,
+                    "running": replica.is_running(),
+                    "in_flight": replica.in_flight,
+                    "load": replica.load(),
+                    "failed_starts": replica.failures,
+                    "slots": replica.slots.stats(),
+                }
+                for replica in self.replicas
+            ],
+            "draining": [replica.port for replica in self.draining],
+        }
+    
+    def batching_stats(self) -> Dict[str, Any]:
+        return {str(replica.port): replica.batcher.stats() for replica in self.replicas}
+
 class NativeServerManager:
     """Manages multiple native llama-server processes"""
     
-    def __init__(self, models_dir: str, unload_timeout: int = 300):
+    def __init__(self, models_dir: str, unload_timeout: int = 0):
         self.models_dir = Path(models_dir)
         self.unload_timeout = unload_timeout
-        self.servers: Dict[str, LlamaServerProcess] = {}
+        self.servers: Dict[str, ReplicaPool] = {}
         self.model_configs: Dict[str, ModelConfig] = {}
+        self.replica_counts: Dict[str, int] = dict(MODEL_REPLICAS)
         self.cleanup_task = None
+        self.prewarm_task = None
+        # Preloaded models stay loaded; usage history predicts the rest
+        self.pinned: set = set()
+        self.usage = UsageHistory.from_env()
+        # Memory budget and eviction choice; unload_timeout (0 = off) only
+        # unloads models idle that long whose recent request rate is below one
+        self.residency = ResidencyManager.from_env()
+        self._residency_lock = asyncio.Lock()
         self.port_counter = 8001  # Start from 8001
+        self.free_ports: List[int] = []
         
         # Scan for available models
         self._scan_models()
@@ -205,9 +611,12 @@ class NativeServerManager:
                     port=self.port_counter,
                     n_gpu_layers=20,  # Conservative for 780M iGPU
                     n_ctx=2048,  # Nomic v1.5 default
-                    n_batch=256,
-                    embedding=True
+                    n_batch=2048,  # Any input up to n_ctx fits one ubatch
+                    embedding=True,
+                    dimensions=model_dimensions(str(model_file))
                 )
+                self._apply_profile(self.model_configs[model_name])
+                embedding_cache.attach_model(model_name, str(model_file))
                 self.port_counter += 1
                 logger.info(f"Found embedding model: {model_name} -> port {self.model_configs[model_name].port}")
         
@@ -224,20 +633,55 @@ class NativeServerManager:
                     port=self.port_counter,
                     n_gpu_layers=15,  # Smaller for rerankers
                     n_ctx=1024,  # BGE reranker optimal
-                    n_batch=256,
+                    n_batch=1024,
                     embedding=True
                 )
+                self._apply_profile(self.model_configs[model_name])
+                embedding_cache.attach_model(model_name, str(model_file))
                 self.port_counter += 1
                 logger.info(f"Found reranking model: {model_name} -> port {self.model_configs[model_name].port}")
     
-    async def get_server(self, model_name: str) -> LlamaServerProcess:
-        """Get or create a server for the specified model"""
+    def _apply_profile(self, config: ModelConfig):
+        """Override the scan defaults with the model's calibrated profile (see calibrate.py)"""
+        for key, value in load_profile(config.path).items():
+            setattr(config, key, value)
+
+    def _allocate_port(self) -> int:
+        """Port for an extra replica, after the ports assigned while scanning"""
+        if self.free_ports:
+            return self.free_ports.pop()
+        port = self.port_counter
+        self.port_counter += 1
+        return port
+    
+    def _release_port(self, port: int):
+        self.free_ports.append(port)
+    
+    async def get_server(self, model_name: str) -> ReplicaPool:
+        """Get or create the replica pool for the specified model (counts as usage)"""
         if model_name not in self.model_configs:
             raise ValueError(f"Model {model_name} not found")
+        self.usage.record(model_name)
+        self.residency.touch(model_name)
+        return await self._ensure_server(model_name)
+    
+    async def _ensure_server(self, model_name: str, evict: bool = True) -> ReplicaPool:
+        """Pool for a model, started if needed (prewarming uses this without recording usage)
         
-        if model_name not in self.servers:
+        Memory for a cold model is made first; with evict=False the model is
+        only started if it fits the budget as things are (else the pool is
+        returned unstarted). Raises OverBudgetError if it cannot fit at all.
+        """
+        if model_name not in self.servers or self.servers[model_name].closed:
             config = self.model_configs[model_name]
-            self.servers[model_name] = LlamaServerProcess(config)
+            self.servers[model_name] = ReplicaPool(
+                config,
+                self._allocate_port,
+                self._release_port,
+                replicas=self.replica_counts.get(model_name, DEFAULT_REPLICAS),
+                make_room=lambda replicas: self._restart_room(model_name, replicas),
+                ensure=lambda: self._ensure_server(model_name),
+            )
             
             # Start cleanup task if not already running
             if self.cleanup_task is None:
@@ -245,18 +689,153 @@ class NativeServerManager:
         
         server = self.servers[model_name]
         if not server.is_running():
-            await server.start()
+            async with self._residency_lock:
+                if not server.is_running() and not server.is_starting():
+                    if not await self._make_room(model_name, evict):
+                        return server
+            started = time.monotonic()
+            if await server.start():
+                self.residency.observe_load(model_name, time.monotonic() - started)
+                self._observe_rss()
         
         return server
     
+    def _resident(self) -> Dict[str, tuple]:
+        """model -> (GGUF path, footprint MB) for every loaded or loading pool"""
+        return {
+            name: (pool.config.path, self.residency.footprint_mb(name, pool.config.path, pool.resident_replicas()))
+            for name, pool in self.servers.items()
+            if pool.is_running() or pool.is_starting()
+        }
+    
+    def _observe_rss(self):
+        for name, pool in self.servers.items():
+            pids = [replica.process.pid for replica in pool.replicas if replica.process and replica.process.poll() is None]
+            rss = [process_rss_mb(pid) for pid in pids]
+            self.residency.observe_rss(name, sum(mb for mb in rss if mb) or None)
+    
+    def _hot(self) -> List[str]:
+        return self.usage.predicted(self.model_configs) if PREWARM_INTERVAL > 0 else []
+    
+    def _protected(self, *also: str) -> set:
+        """Never evicted: pinned, starting, or serving requests right now"""
+        busy = {
+            name for name, pool in self.servers.items()
+            if pool.is_starting() or any(replica.load() > 0 for replica in pool.replicas + pool.draining)
+        }
+        return self.pinned | busy | set(also)
+    
+    async def _make_room(self, model_name: str, evict: bool = True, replicas: Optional[int] = None) -> bool:
+        """Evict cheapest-to-lose models until model_name fits the memory budget
+        
+        `replicas` sizes a start of that many more replicas of a loaded
+        model; by default the whole model is being loaded. Returns False,
+        evicting nothing, if evict=False and the model only fits by evicting.
+        Raises OverBudgetError if evicting everything allowed is not enough.
+        """
+        config = self.model_configs[model_name]
+        if replicas is None:
+            needed = self.residency.footprint_mb(model_name, config.path, self.replica_counts.get(model_name, DEFAULT_REPLICAS))
+        else:
+            needed = self.residency.estimate_mb(config.path, replicas)
+        victims, fits = self.residency.choose_victims(self._resident(), needed, self._protected(model_name), self._hot())
+        if not fits:
+            self.residency.log("over_budget", model_name, "nothing evictable frees enough memory; not loading",
+                               needed_mb=round(needed, 1), budget_mb=self.residency.budget_mb)
+            raise OverBudgetError(
+                f"{model_name} needs {needed:.0f} MB, more than evicting idle models frees "
+                f"within the {self.residency.budget_mb:.0f} MB memory budget"
+            )
+        if victims and not evict:
+            logger.debug(f"Not loading {model_name}: it only fits the memory budget by evicting {', '.join(victims)}")
+            return False
+        for victim in victims:
+            self.residency.log("evict", victim, f"make room for {model_name}", needed_mb=round(needed, 1))
+            await self.stop_server(victim)
+        if victims or self.residency.budget_mb:
+            self.residency.log("load", model_name, "fits budget", needed_mb=round(needed, 1))
+        return True
+    
+    async def _restart_room(self, model_name: str, replicas: int):
+        """make_room callback of a pool about to relaunch crashed replicas (raises OverBudgetError)"""
+        async with self._residency_lock:
+            await self._make_room(model_name, replicas=replicas)
+    
+    def residency_stats(self) -> Dict[str, Any]:
+        self._observe_rss()
+        return self.residency.stats(self._resident(), self.pinned)
+    
+    async def set_replicas(self, model_name: str, replicas: int) -> Dict[str, Any]:
+        """Set a model's replica count; applied now if the model is loaded, else on next start"""
+        if model_name not in self.model_configs:
+            raise ValueError(f"Model {model_name} not found")
+        replicas = max(1, min(replicas, MAX_REPLICAS))
+        pool = self.servers.get(model_name)
+        if pool is not None and len(pool.replicas) < replicas:
+            # Scaling up starts replicas now, so they need room in the budget
+            async with self._residency_lock:
+                await self._make_room(model_name, replicas=replicas - pool.resident_replicas())
+        self.replica_counts[model_name] = replicas
+        if pool is None:
+            return {"target": replicas, "replicas": [], "draining": []}
+        await pool.scale(replicas)
+        return pool.stats()
+    
     async def stop_server(self, model_name: str):
         """Stop a specific server"""
-        if model_name in self.servers:
-            await self.servers[model_name].stop()
-            del self.servers[model_name]
+        # Unlisted first, so a caller re-resolving the closed pool gets a new one
+        pool = self.servers.pop(model_name, None)
+        if pool is not None:
+            await pool.stop()
+    
+    async def start_prewarming(self):
+        """Start PRELOAD_MODELS in the background and begin usage-based prewarming"""
+        names = list(self.model_configs) if "all" in PRELOAD_MODELS else PRELOAD_MODELS
+        for model_name in names:
+            if model_name not in self.model_configs:
+                logger.warning(f"PRELOAD_MODELS: unknown model {model_name}")
+                continue
+            self.pinned.add(model_name)
+        if self.pinned or PREWARM_INTERVAL > 0:
+            self.prewarm_task = asyncio.create_task(self._prewarm_loop())
+    
+    async def _warm(self, model_name: str, reason: str):
+        pool = self.servers.get(model_name)
+        if pool and (pool.is_running() or pool.is_starting()):
+            return
+        logger.debug(f"Prewarming {model_name} ({reason})")
+        try:
+            # Usage-predicted models never push out models already loaded
+            pool = await self._ensure_server(model_name, evict=reason == "preload")
+        except OverBudgetError as e:
+            # Already in the residency log; tried again next round
+            logger.debug(f"Not prewarming {model_name}: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Prewarming {model_name} failed: {e}")
+            return
+        if pool.is_running():
+            logger.info(f"Prewarmed {model_name} ({reason})")
+    
+    async def _prewarm_loop(self):
+        """Keep pinned models up and start models predicted from usage history"""
+        while True:
+            try:
+                warm = [(name, "preload") for name in self.pinned]
+                if PREWARM_INTERVAL > 0:
+                    warm += [(name, "usage history") for name in self.usage.predicted(self.model_configs) if name not in self.pinned]
+                await asyncio.gather(*(self._warm(name, reason) for name, reason in warm))
+                self.usage.save()
+            except Exception as e:
+                logger.error(f"Error in prewarm loop: {e}")
+            await asyncio.sleep(PREWARM_INTERVAL if PREWARM_INTERVAL > 0 else 60)
     
     async def stop_all_servers(self):
         """Stop all running servers"""
+        if self.prewarm_task:
+            self.prewarm_task.cancel()
+            self.prewarm_task = None
+        self.usage.save()
         tasks = []
         for server in self.servers.values():
             tasks.append(server.stop())
@@ -271,26 +850,51 @@ class NativeServerManager:
             self.cleanup_task = None
     
     async def _cleanup_loop(self):
-        """Background task to stop unused servers"""
+        """Background task: sample RSS, keep within the memory budget, unload cold idle models"""
         while True:
             try:
                 current_time = time.time()
-                servers_to_stop = []
+                self._observe_rss()
                 
-                for model_name, server in self.servers.items():
-                    if current_time - server.last_used > self.unload_timeout:
-                        servers_to_stop.append(model_name)
+                # Observed RSS can outgrow the estimates a model was admitted with
+                async with self._residency_lock:
+                    victims, _ = self.residency.choose_victims(self._resident(), 0, self._protected(), self._hot())
+                    for model_name in victims:
+                        self.residency.log("evict", model_name, "over memory budget")
+                        await self.stop_server(model_name)
+                
+                servers_to_stop = []
+                if self.unload_timeout > 0:
+                    hot = set(self._hot())
+                    for model_name, server in self.servers.items():
+                        # Pinned, predicted-hot and recently busy models stay loaded while idle
+                        if model_name in self.pinned or model_name in hot or self.residency.rate(model_name) >= 1:
+                            continue
+                        if current_time - server.last_used > self.unload_timeout:
+                            servers_to_stop.append(model_name)
                 
                 for model_name in servers_to_stop:
-                    logger.info(f"Auto-stopping unused server: {model_name}")
+                    self.residency.log("unload", model_name, f"idle over {self.unload_timeout}s with a low request rate")
                     await self.stop_server(model_name)
                 
-                await asyncio.sleep(30)  # Check every 30 seconds
+                await asyncio.sleep(RESIDENCY_INTERVAL)
                 
             except Exception as e:
                 logger.error(f"Error in cleanup loop: {e}")
                 await asyncio.sleep(60)
     
+    def embedding_model_for(self, model_name: str) -> str:
+        """Embedding model used for cosine reranking requested against model_name"""
+        config = self.model_configs.get(model_name)
+        if config and config.type == "embedding":
+            return model_name
+        if RERANK_EMBEDDING_MODEL:
+            return RERANK_EMBEDDING_MODEL
+        for name, config in self.model_configs.items():
+            if config.type == "embedding":
+                return name
+        raise ValueError("No embedding model available for cosine reranking")
+    
     def list_models(self) -> Dict[str, List[str]]:
         """List available models by type"""
         embeddings = [name for name, config in self.model_configs.items() 
@@ -312,13 +916,22 @@ server_manager: Optional[NativeServerManager] = None
 class EmbeddingRequest(BaseModel):
     input: Union[str, List[str]]
     model: str
-    encoding_format: str = "float"
+    # "binary" returns application/octet-stream (see vectors.pack_matrix)
+    encoding_format: Literal["float", "base64", "binary"] = "float"
+    # Chunk inputs longer than the context and pool the windows (default: EMBED_CHUNKING)
+    chunking: Optional[Literal["mean", "weighted"]] = None
+    # Matryoshka size to truncate to and renormalize (default: the model's native size)
+    dimensions: Optional[int] = None
 
 class RerankRequest(BaseModel):
     model: str
     query: str
     documents: List[str]
     top_k: Optional[int] = None
+    return_documents: bool = True
+    mode: Optional[Literal["cross_encoder", "cosine", "cascade"]] = None  # default: RERANK_MODE
+    cascade_top_n: Optional[int] = None  # default: RERANK_CASCADE_TOP_N
+    cascade_gap: Optional[float] = None  # default: RERANK_CASCADE_GAP
 
 class EmbeddingResponse(BaseModel):
     object: str = "list"
@@ -326,11 +939,29 @@ class EmbeddingResponse(BaseModel):
     model: str
     usage: Dict
 
+class ReplicaRequest(BaseModel):
+    replicas: int
+
 class RerankResponse(BaseModel):
     model: str
+    mode: Optional[str] = None
+    cascade: Optional[Dict] = None
     results: List[Dict]
     usage: Dict
 
+def running_backends():
+    """(base_url, model) of every live replica, draining ones included"""
+    if not server_manager:
+        return []
+    return [
+        (replica.base_url, pool.config.name)
+        for pool in list(server_manager.servers.values())
+        for replica in pool.replicas + pool.draining
+        if replica.is_running()
+    ]
+
+backend_metrics = register_backends(running_backends)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
@@ -338,18 +969,28 @@ async def lifespan(app: FastAPI):
     
     # Startup
     models_dir = os.getenv("MODELS_DIR", "./models")
-    unload_timeout = int(os.getenv("UNLOAD_TIMEOUT", "300"))
+    unload_timeout = int(os.getenv("UNLOAD_TIMEOUT", "0"))
     
     server_manager = NativeServerManager(models_dir, unload_timeout)
     logger.info("Native server manager initialized")
+    await server_manager.start_prewarming()
+    backend_metrics.start(BACKEND_METRICS_INTERVAL)
     
     yield
     
     # Shutdown
+    await backend_metrics.stop()
     if server_manager:
         await server_manager.stop_all_servers()
+    await backend_logs.close()
+    await upstream.aclose()
+    await embedding_cache.close()
     logger.info("All servers stopped")
 
+def _metric_model(model_name: str) -> str:
+    """Model label for metrics; unknown names collapse so clients cannot inflate cardinality"""
+    return model_name if server_manager and model_name in server_manager.model_configs else "unknown"
+
 # FastAPI app
 app = FastAPI(
     title="Native LLaMA-Server Manager",
@@ -382,6 +1023,7 @@ async def list_models():
     models = []
     for model_type in ["embeddings", "rerankers"]:
         for model_name in models_info[model_type]:
+            dimensions = server_manager.model_configs[model_name].dimensions
             models.append({
                 "id": model_name,
                 "object": "model",
@@ -389,16 +1031,28 @@ async def list_models():
                 "owned_by": "native-llama-server",
                 "permission": [],
                 "root": model_name,
-                "parent": None
+                "parent": None,
+                "dimensions": list(dimensions.allowed) if dimensions else []
             })
     
     return {"object": "list", "data": models}
 
+def _output_size(model_name: str, dimensions: Optional[int]) -> Optional[int]:
+    """Validated Matryoshka size for a request (None = native)"""
+    config = server_manager.model_configs.get(model_name)
+    if dimensions is None or config is None:  # unknown models are rejected by get_server
+        return None
+    try:
+        return (config.dimensions or ModelDimensions(None)).check(dimensions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/v1/embeddings")
 async def create_embeddings(request: EmbeddingRequest):
     """Create embeddings via native llama-server (OpenAI compatible)"""
     if not server_manager:
         raise HTTPException(status_code=500, detail="Server manager not initialized")
+    size = _output_size(request.model, request.dimensions)
     
     try:
         # Get the appropriate server
@@ -407,90 +1061,167 @@ async def create_embeddings(request: EmbeddingRequest):
         # Handle single string or list of strings
         texts = request.input if isinstance(request.input, list) else [request.input]
         
-        # Proxy request to native server
-        proxy_request = {
-            "content": texts[0] if len(texts) == 1 else texts,
-            "encoding_format": request.encoding_format
-        }
-        
-        response_data = await server.proxy_request("/embedding", proxy_request)
-        
-        # Convert to OpenAI format
-        embeddings_data = []
-        
-        # The native server returns: [{"index": 0, "embedding": [[float, ...]]}]
-        if isinstance(response_data, list) and len(response_data) > 0:
-            for item in response_data:
-                if "embedding" in item and isinstance(item["embedding"], list):
-                    # Extract the actual embedding vector (nested array)
-                    embedding_vector = item["embedding"][0] if isinstance(item["embedding"][0], list) else item["embedding"]
-                    embeddings_data.append({
-                        "object": "embedding", 
-                        "embedding": embedding_vector,
-                        "index": item.get("index", 0)
-                    })
+        # Coalesced with concurrent requests into shared upstream batches
+        chunking = request.chunking or EMBED_CHUNKING
+        chunk_counts = None
+        if chunking:
+            vectors, chunk_counts = await embed_chunked(
+                texts,
+                server.embed,
+                server.tokenizer,
+                max_tokens=server.config.n_ctx,
+                overlap=EMBED_CHUNK_OVERLAP,
+                pooling=chunking,
+            )
+            total_tokens = sum(await server.tokenizer.count(texts))
         else:
-            # Fallback - invalid response format
-            raise ValueError(f"Invalid embedding response format: {response_data}")
+            vectors, counts = await server.embed_counted(texts)
+            total_tokens = sum(counts)
+        failed = [i for i, vector in enumerate(vectors) if vector is None]
+        if failed:
+            raise ValueError(f"Embedding failed for inputs {failed}")
+        vectors = truncate(vectors, server.config.dimensions, size)
         
-        total_tokens = sum(len(str(text).split()) for text in texts)
+        usage = {
+            "prompt_tokens": total_tokens,
+            "total_tokens": total_tokens
+        }
+        if chunk_counts is not None:
+            usage["chunks"] = sum(chunk_counts)
         
-        return EmbeddingResponse(
-            data=embeddings_data,
-            model=request.model,
-            usage={
-                "prompt_tokens": total_tokens,
-                "total_tokens": total_tokens
-            }
-        )
+        if request.encoding_format == "binary":
+            headers = {"X-Model": request.model, "X-Prompt-Tokens": str(total_tokens)}
+            if chunk_counts is not None:
+                headers["X-Chunks"] = str(usage["chunks"])
+            with timed(SERIALIZATION_TIME, endpoint="/v1/embeddings", format="binary"):
+                return Response(
+                    content=pack_matrix(vectors),
+                    media_type=BINARY_MEDIA_TYPE,
+                    headers=headers
+                )
+        
+        # Convert to OpenAI format, rendered here so serialization time is measured
+        with timed(SERIALIZATION_TIME, endpoint="/v1/embeddings", format=request.encoding_format):
+            embeddings_data = [
+                {
+                    "object": "embedding",
+                    "embedding": format_embedding(vector, request.encoding_format),
+                    "index": i
+                }
+                for i, vector in enumerate(vectors)
+            ]
+            
+            return JSONResponse(content=EmbeddingResponse(
+                data=embeddings_data,
+                model=request.model,
+                usage=usage
+            ).model_dump())
         
+    except OverBudgetError as e:
+        logger.warning(f"Refusing embeddings: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating embeddings: {e}")
+        ERRORS.labels(model=_metric_model(request.model), endpoint="/v1/embeddings").inc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/v1/embeddings/stream")
+async def create_embeddings_stream(request: Request, model: str, encoding_format: str = "float", dimensions: Optional[int] = None):
+    """Bulk embeddings: NDJSON {"id", "text"} lines in, NDJSON results out as each chunk completes"""
+    if not server_manager:
+        raise HTTPException(status_code=500, detail="Server manager not initialized")
+    if encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+    size = _output_size(model, dimensions)
+    
+    try:
+        server = await server_manager.get_server(model)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OverBudgetError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    async def embed(texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        vectors, counts = await server.embed_counted(texts)
+        return truncate(vectors, server.config.dimensions, size), counts
+    
+    return DuplexStreamingResponse(
+        stream_embeddings(
+            iter_ndjson(request.stream()),
+            embed,
+            chunk_size=EMBED_STREAM_CHUNK,
+            encoding_format=encoding_format
+        ),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+async def score_cosine(model_name: str, query: str, documents: List[str]) -> np.ndarray:
+    """Cheap relevance: cosine similarity of embeddings (cached, batched)"""
+    server = await server_manager.get_server(server_manager.embedding_model_for(model_name))
+    vectors = await server.embed([query] + documents)
+    if vectors[0] is None:
+        raise ValueError("Failed to embed query")
+    
+    # One normalized matrix-vector product instead of a per-document loop
+    return cosine_scores(vectors[0], stack_rows(vectors[1:], len(vectors[0])))
+
+async def score_cross_encoder(model_name: str, query: str, documents: List[str]) -> np.ndarray:
+    """Accurate relevance: a reranking model's ranking head on each pair"""
+    if server_manager.model_configs[model_name].type != "reranking":
+        raise ValueError(f"Model {model_name} is not a reranking model")
+    server = await server_manager.get_server(model_name)
+    return await server.rerank(query, documents)
+
 @app.post("/v1/rerank")
 async def rerank_documents(request: RerankRequest):
-    """Rerank documents using native embedding comparison"""
+    """Rerank documents with a cross-encoder, or by embedding similarity in cosine mode"""
     if not server_manager:
         raise HTTPException(status_code=500, detail="Server manager not initialized")
     
+    mode = request.mode or RERANK_MODE
+    if mode not in RERANK_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown rerank mode: {mode}")
+    if request.model not in server_manager.model_configs:
+        raise HTTPException(status_code=404, detail=f"Model {request.model} not found")
+    if mode != "cosine" and server_manager.model_configs[request.model].type != "reranking":
+        # Embedding models have no ranking head: rank them by similarity
+        # unless the client explicitly asked for the cross-encoder
+        if request.mode:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Model {request.model} is not a reranking model; mode '{mode}' needs one (use 'cosine')"
+            )
+        mode = "cosine"
+    
+    counting = None
     try:
-        # Get the appropriate server (prefer reranker, fallback to embedding)
-        server = await server_manager.get_server(request.model)
-        
-        # Get query embedding
-        query_response = await server.proxy_request("/embedding", {"content": request.query})
-        # Extract embedding from response format
-        query_embedding = np.array(query_response[0]["embedding"][0] if isinstance(query_response[0]["embedding"][0], list) else query_response[0]["embedding"])
-        
-        # Get document embeddings and calculate similarities
-        results = []
-        for i, doc in enumerate(request.documents):
-            doc_response = await server.proxy_request("/embedding", {"content": doc})
-            doc_embedding = np.array(doc_response[0]["embedding"][0] if isinstance(doc_response[0]["embedding"][0], list) else doc_response[0]["embedding"])
-            
-            # Calculate cosine similarity
-            similarity = np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
+        # Usage from the tokenizer of the model that saw every document, counted alongside scoring
+        counted_by = request.model if mode == "cross_encoder" else server_manager.embedding_model_for(request.model)
+        counting_pool = await server_manager.get_server(counted_by)
+        counting = asyncio.create_task(counting_pool.tokenizer.count([request.query] + request.documents))
+        cascade_info = None
+        order = None
+        if mode == "cascade":
+            order, scores, cascade_info = await cascade(
+                request.query,
+                request.documents,
+                lambda query, docs: score_cosine(request.model, query, docs),
+                lambda query, docs: score_cross_encoder(request.model, query, docs),
+                top_n=request.cascade_top_n or RERANK_CASCADE_TOP_N,
+                min_n=RERANK_CASCADE_MIN_N,
+                gap=request.cascade_gap if request.cascade_gap is not None else RERANK_CASCADE_GAP,
             )
-            
-            results.append({
-                "index": i,
-                "document": doc,
-                "relevance_score": float(similarity)
-            })
-        
-        # Sort by relevance score
-        results.sort(key=lambda x: x["relevance_score"], reverse=True)
-        
-        # Apply top_k if specified
-        if request.top_k:
-            results = results[:request.top_k]
-        
-        total_tokens = len(request.query.split()) + sum(len(doc.split()) for doc in request.documents)
+        elif mode == "cross_encoder":
+            scores = await score_cross_encoder(request.model, request.query, request.documents)
+        else:
+            scores = await score_cosine(request.model, request.query, request.documents)
+        results = rank_results(scores, request.documents, request.top_k, request.return_documents, order=order)
+        total_tokens = sum(await counting)
         
         return RerankResponse(
             model=request.model,
+            mode=mode,
+            cascade=cascade_info,
             results=results,
             usage={
                 "prompt_tokens": total_tokens,
@@ -498,9 +1229,23 @@ async def rerank_documents(request: RerankRequest):
             }
         )
         
+    except OverBudgetError as e:
+        logger.warning(f"Refusing rerank: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error reranking documents: {e}")
+        ERRORS.labels(model=_metric_model(request.model), endpoint="/v1/rerank").inc()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Scoring failed or the client went away: nobody will read the count
+        if counting is not None and not counting.done():
+            counting.cancel()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (wrapper series plus re-exported unicorn_backend_*)"""
+    await backend_metrics.refresh_if_stale()
+    return Response(content=render_latest(), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
@@ -519,9 +1264,27 @@ async def health_check():
         "backend": "native-llama-server",
         "gpu_backend": gpu_backend,
         "vulkan_device": os.getenv("VULKAN_DEVICE", "auto"),
-        "performance_mode": "maximum"
+        "performance_mode": "maximum",
+        "replicas": {name: pool.stats() for name, pool in server_manager.servers.items()},
+        "batching": {name: pool.batching_stats() for name, pool in server_manager.servers.items()},
+        "prewarm": {"pinned": sorted(server_manager.pinned), "predicted_hours": server_manager.usage.stats()},
+        "cache": embedding_cache.stats()
     }
 
+@app.get("/admin/residency")
+async def residency_status():
+    """Memory budget, per-model footprint and keep value, and recent residency decisions"""
+    if not server_manager:
+        raise HTTPException(status_code=500, detail="Server manager not initialized")
+    return server_manager.residency_stats()
+
+@app.get("/admin/logs")
+async def backend_log_tail(backend: Optional[str] = None, lines: int = 100, level: str = "info"):
+    """Recent llama-server output per replica (model name or host:port), with parsed timings"""
+    if level not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {', '.join(LEVELS)}")
+    return {"backends": backend_logs.tail(backend, lines, level)}
+
 @app.post("/v1/models/{model_name}/stop")
 async def stop_model_server(model_name: str):
     """Stop a specific model server"""
@@ -534,6 +1297,21 @@ async def stop_model_server(model_name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/v1/models/{model_name}/replicas")
+async def set_model_replicas(model_name: str, request: ReplicaRequest):
+    """Scale a model's llama-server replica pool; removed replicas drain before stopping"""
+    if not server_manager:
+        raise HTTPException(status_code=500, detail="Server manager not initialized")
+    if request.replicas < 1:
+        raise HTTPException(status_code=400, detail="replicas must be at least 1")
+    
+    try:
+        return {"model": model_name, **await server_manager.set_replicas(model_name, request.replicas)}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OverBudgetError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 if __name__ == "__main__":
     # Configuration
     host = os.getenv("HOST", "0.0.0.0")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Matryoshka embedding dimensions
+Models trained with Matryoshka representation learning keep most of their
+quality when a vector is cut to its leading components and re-normalized.
+The native size comes from the GGUF metadata (<arch>.embedding_length); the
+sizes a model was trained to be cut to are looked up by its GGUF name, as
+GGUF has no key for them. Requests choose a size with OpenAI's
+`dimensions` parameter and the cut happens here, after the cache, so one
+cached full vector serves every size.
+"""
+
+import re
+import struct
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vectors import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Model name fragment -> (trained sizes, layer norm before cutting)
+# nomic-embed-text-v1.5 is cut after a layer norm, as in its reference code
+MATRYOSHKA_MODELS: Dict[str, Tuple[Tuple[int, ...], bool]] = {
+    "nomic-embed-text-v1.5": ((768, 512, 256, 128, 64), True),
+    "snowflake-arctic-embed-m-v1.5": ((768, 256), False),
+}
+LAYER_NORM_EPS = 1e-5
+
+GGUF_MAGIC = b"GGUF"
+# GGUF metadata value types -> struct format (8 = string, 9 = array)
+GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+GGUF_STRING, GGUF_ARRAY = 8, 9
+
+
+class _Reader:
+    def __init__(self, f):
+        self.f = f
+
+    def unpack(self, fmt: str):
+        size = struct.calcsize(fmt)
+        data = self.f.read(size)
+        if len(data) < size:
+            raise ValueError("truncated GGUF header")
+        return struct.unpack(fmt, data)[0]
+
+    def string(self) -> str:
+        return self.f.read(self.unpack("<Q")).decode("utf-8", errors="replace")
+
+    def value(self, value_type: int) -> Any:
+        if value_type in GGUF_SCALARS:
+            return self.unpack(GGUF_SCALARS[value_type])
+        if value_type == GGUF_STRING:
+            return self.string()
+        if value_type == GGUF_ARRAY:
+            item_type, count = self.unpack("<I"), self.unpack("<Q")
+            if item_type in GGUF_SCALARS:
+                # Not needed here: skip without decoding (tokenizer arrays are large)
+                self.f.seek(struct.calcsize(GGUF_SCALARS[item_type]) * count, 1)
+            else:
+                for _ in range(count):
+                    self.value(item_type)
+            return None
+        raise ValueError(f"unknown GGUF value type {value_type}")
+
+
+def read_gguf_metadata(path: str, done: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Dict[str, Any]:
+    """Scalar and string metadata of a GGUF file (arrays skipped), stopping early once done(metadata)"""
+    metadata: Dict[str, Any] = {}
+    with open(path, "rb") as f:
+        reader = _Reader(f)
+        if f.read(4) != GGUF_MAGIC:
+            raise ValueError("not a GGUF file")
+        if reader.unpack("<I") < 2:
+            raise ValueError("GGUF v1 is not supported")
+        reader.unpack("<Q")  # tensor count
+        for _ in range(reader.unpack("<Q")):
+            key = reader.string()
+            value = reader.value(reader.unpack("<I"))
+            if value is not None:
+                metadata[key] = value
+            if done and done(metadata):
+                break
+    return metadata
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[\s_]+", "-", name.strip().lower())
+
+
+@dataclass(frozen=True)
+class ModelDimensions:
+    native: Optional[int]  # None if the model could not be inspected
+    allowed: Tuple[int, ...] = ()
+    layer_norm: bool = False
+
+    def check(self, dimensions: Optional[int]) -> Optional[int]:
+        """The size to cut to (None = native); ValueError if the model cannot produce it"""
+        if dimensions is None or dimensions == self.native:
+            return None
+        if dimensions not in self.allowed:
+            sizes = ", ".join(map(str, self.allowed)) or "none"
+            raise ValueError(f"dimensions must be one of the model's Matryoshka sizes ({sizes}), got {dimensions}")
+        return dimensions
+
+
+def model_dimensions(model_path: str) -> ModelDimensions:
+    """Native and Matryoshka sizes of a GGUF embedding model"""
+    names = [_slug(Path(model_path).stem)]
+    native = None
+    try:
+        # Stop at the embedding length; the tokenizer arrays after it are large
+        metadata = read_gguf_metadata(
+            model_path,
+            lambda meta: f"{meta.get('general.architecture')}.embedding_length" in meta,
+        )
+        native = metadata.get(f"{metadata.get('general.architecture')}.embedding_length")
+        names = [_slug(str(metadata[key])) for key in ("general.basename", "general.name") if key in metadata] + names
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"Could not read GGUF metadata of {Path(model_path).name}: {e}")
+
+    for fragment, (sizes, layer_norm) in MATRYOSHKA_MODELS.items():
+        if any(fragment in name for name in names):
+            native = native or sizes[0]
+            return ModelDimensions(native, tuple(size for size in sizes if size <= native), layer_norm)
+    return ModelDimensions(native, (native,) if native else ())
+
+
+def truncate(vectors: List[Optional[np.ndarray]], dims: ModelDimensions, size: Optional[int]) -> List[Optional[np.ndarray]]:
+    """Cut vectors to their leading `size` components and L2-renormalize (None stays None)"""
+    if size is None:
+        return vectors
+    present = [i for i, vector in enumerate(vectors) if vector is not None]
+    if not present:
+        return vectors
+    matrix = np.stack([vectors[i] for i in present]).astype(np.float32)
+    if dims.layer_norm:
+        matrix = (matrix - matrix.mean(axis=1, keepdims=True)) / np.sqrt(matrix.var(axis=1, keepdims=True) + LAYER_NORM_EPS)
+    matrix = normalize_rows(matrix[:, :size])
+    result = list(vectors)
+    for row, i in enumerate(present):
+        result[i] = matrix[row]
+    return result
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics for the embedding wrappers
+Per-stage latency histograms (queue wait, upstream call, serialization),
+batch shape and throughput, plus counters for errors, zero-vector
+fallbacks, cache lookups and model lifecycle events, and the timings
+parsed from llama-server's own log. Served as text by each wrapper's
+/metrics endpoint.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict
+from urllib.parse import urlsplit
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Sub-millisecond to tens of seconds: cache-hot requests through long cold batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+TOKENS_PER_SECOND_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+QUEUE_WAIT = Histogram(
+    "unicorn_embed_queue_wait_seconds",
+    "Time a text waits in the batching queue before its batch is sent",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "unicorn_embed_upstream_latency_seconds",
+    "llama-server call latency",
+    ["model", "replica", "path"],
+    buckets=LATENCY_BUCKETS,
+)
+SERIALIZATION_TIME = Histogram(
+    "unicorn_embed_serialization_seconds",
+    "Time spent rendering a response body",
+    ["endpoint", "format"],
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "unicorn_embed_batch_size",
+    "Texts per upstream embedding batch",
+    ["model"],
+    buckets=BATCH_SIZE_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "unicorn_embed_tokens_per_second",
+    "Upstream embedding throughput per batch",
+    ["model"],
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+ERRORS = Counter(
+    "unicorn_embed_errors_total",
+    "Requests or upstream calls that failed",
+    ["model", "endpoint"],
+)
+ZERO_VECTOR_FALLBACKS = Counter(
+    "unicorn_embed_zero_vector_fallbacks_total",
+    "Inputs answered with a zero vector because embedding failed",
+    ["model", "endpoint"],
+)
+CACHE_LOOKUPS = Counter(
+    "unicorn_embed_cache_lookups_total",
+    "Embedding cache lookups by outcome (memory hit, disk hit, miss)",
+    ["model", "result"],
+)
+MODEL_EVENTS = Counter(
+    "unicorn_embed_model_events_total",
+    "llama-server lifecycle events (start, start_failed, stop)",
+    ["model", "event"],
+)
+BACKEND_TIMING = Histogram(
+    "unicorn_embed_backend_timing_seconds",
+    "Timings llama-server reports in its log (load, prompt eval, eval, total)",
+    ["model", "replica", "phase"],
+    buckets=LATENCY_BUCKETS,
+)
+BACKEND_TOKENS_PER_SECOND = Histogram(
+    "unicorn_embed_backend_tokens_per_second",
+    "Tokens per second llama-server reports in its timing log lines",
+    ["model", "replica", "phase"],
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+BACKEND_LOG_LINES = Counter(
+    "unicorn_embed_backend_log_lines_total",
+    "llama-server output lines by stream and level",
+    ["model", "stream", "level"],
+)
+
+# Backend "host:port" -> model name, so upstream metrics can be labelled by model
+_backend_models: Dict[str, str] = {}
+
+
+def label_backend(base_url: str, model: str):
+    """Record which model a backend URL serves"""
+    _backend_models[urlsplit(base_url).netloc] = model
+
+
+def backend_labels(base_url: str) -> Dict[str, str]:
+    netloc = urlsplit(base_url).netloc
+    return {"model": _backend_models.get(netloc, "unknown"), "replica": netloc}
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """Observe the duration of a block into a labelled histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def render_latest() -> bytes:
+    return generate_latest()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Usage-history model prewarming
+Records the local hours of the day each model is used. A model that was
+used in an hour on enough of the recent days is predicted for that hour:
+it is started ahead of time and kept loaded through the hour, so the first
+request of the morning does not wait out a model load.
+"""
+
+import os
+import json
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class UsageHistory:
+    """Per-model set of hours used on each recent day, persisted as JSON"""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        days: int = 14,
+        min_fraction: float = 0.5,
+        lead_minutes: float = 15,
+    ):
+        self.path = Path(path) if path else None
+        self.days = max(1, days)
+        self.min_fraction = min_fraction
+        self.lead = timedelta(minutes=lead_minutes)
+        # model -> ISO date -> hours of that day the model was requested
+        self.hours: Dict[str, Dict[str, Set[int]]] = {}
+        self.dirty = False
+        self._load()
+
+    @classmethod
+    def from_env(cls) -> "UsageHistory":
+        default_path = os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".usage-history.json")
+        return cls(
+            os.getenv("USAGE_HISTORY_FILE", default_path),
+            days=int(os.getenv("PREWARM_HISTORY_DAYS", "14")),
+            min_fraction=float(os.getenv("PREWARM_MIN_FRACTION", "0.5")),
+            lead_minutes=float(os.getenv("PREWARM_LEAD_MINUTES", "15")),
+        )
+
+    def _load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self.hours = {
+                model: {day: set(hours) for day, hours in days.items()}
+                for model, days in data.get("models", {}).items()
+            }
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable usage history {self.path}: {e}")
+
+    def save(self):
+        """Write the history if it changed (atomically, so a crash cannot truncate it)"""
+        if not self.path or not self.dirty:
+            return
+        self._prune(date.today())
+        data = {"models": {model: {day: sorted(hours) for day, hours in days.items()} for model, days in self.hours.items()}}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Could not save usage history to {self.path}: {e}")
+
+    def _prune(self, today: date):
+        oldest = (today - timedelta(days=self.days)).isoformat()
+        for days in self.hours.values():
+            for day in [day for day in days if day < oldest]:
+                del days[day]
+
+    def record(self, model: str, now: Optional[datetime] = None):
+        now = now or datetime.now()
+        hours = self.hours.setdefault(model, {}).setdefault(now.date().isoformat(), set())
+        if now.hour not in hours:
+            hours.add(now.hour)
+            self.dirty = True
+
+    def fraction(self, model: str, hour: int, today: date) -> float:
+        """Share of the recent days before today on which the model was used in `hour`
+
+        Only days since the model was first seen count, so a model used every
+        morning is predicted from its second day rather than after `days` days.
+        """
+        days = self.hours.get(model)
+        if not days:
+            return 0.0
+        window = [(today - timedelta(days=n)).isoformat() for n in range(1, self.days + 1)]
+        first_seen = min(days)
+        observed = [day for day in window if day >= first_seen]
+        if not observed:
+            return 0.0
+        return sum(1 for day in observed if hour in days.get(day, ())) / len(observed)
+
+    def expected(self, model: str, now: Optional[datetime] = None) -> bool:
+        """Predicted for the current hour or for one starting within the lead time"""
+        now = now or datetime.now()
+        for moment in (now, now + self.lead):
+            if self.fraction(model, moment.hour, moment.date()) >= self.min_fraction:
+                return True
+        return False
+
+    def predicted(self, models: Iterable[str], now: Optional[datetime] = None) -> List[str]:
+        now = now or datetime.now()
+        return [model for model in models if self.expected(model, now)]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per model, the hours of today predicted hot and their usage fraction"""
+        today = date.today()
+        return {
+            model: {
+                str(hour): round(self.fraction(model, hour, today), 2)
+                for hour in range(24)
+                if self.fraction(model, hour, today) >= self.min_fraction
+            }
+            for model in self.hours
+        }
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Per-model llama-server launch profiles written by calibrate.py
+A profile holds the fastest measured n_gpu_layers / n_batch / n_threads for
+one GGUF file. It records the file's fingerprint, so a replaced model falls
+back to the built-in defaults until it is calibrated again.
+"""
+
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from embedding_store import model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Launch parameters a profile may set
+PROFILE_PARAMS = ("n_gpu_layers", "n_batch", "n_threads")
+
+
+def profile_dir() -> Optional[Path]:
+    default_dir = os.path.join(os.getenv("MODELS_DIR", "/app/models"), ".profiles")
+    root = os.getenv("LLAMA_PROFILE_DIR", default_dir)
+    return Path(root) if root else None
+
+
+def profile_path(model_path: str) -> Optional[Path]:
+    root = profile_dir()
+    return root / f"{Path(model_path).stem}.json" if root else None
+
+
+def load_profile(model_path: str) -> Dict[str, int]:
+    """Calibrated launch parameters for a GGUF file ({} if none or stale)"""
+    path = profile_path(model_path)
+    if not path or not path.exists():
+        return {}
+    try:
+        profile = json.loads(path.read_text())
+        if profile.get("fingerprint") != model_fingerprint(model_path):
+            logger.warning(f"Ignoring profile {path}: {Path(model_path).name} changed since calibration")
+            return {}
+        params = {key: int(value) for key, value in profile.get("params", {}).items() if key in PROFILE_PARAMS}
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Ignoring unreadable profile {path}: {e}")
+        return {}
+    logger.info(f"Using calibrated profile for {Path(model_path).name}: {params}")
+    return params
+
+
+def save_profile(model_path: str, params: Dict[str, int], metrics: Dict[str, Any], **extra: Any) -> Path:
+    path = profile_path(model_path)
+    if path is None:
+        raise ValueError("LLAMA_PROFILE_DIR is empty; profiles are disabled")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile = {
+        "model": Path(model_path).name,
+        "fingerprint": model_fingerprint(model_path),
+        "params": params,
+        "metrics": metrics,
+        "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **extra,
+    }
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(profile, indent=2) + "\n")
+    os.replace(tmp, path)
+    return path
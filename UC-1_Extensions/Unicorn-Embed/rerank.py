@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Cross-encoder reranking through llama-server's rank pooling
+The reranker backend runs with --reranking and scores each (query, document)
+pair with the model's ranking head via its /rerank endpoint. The cascade
+mode runs a cheap embedding-similarity prefilter first and cross-encodes
+only the leaders.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from upstream import BackendSlots, upstream
+from tokenization import CHARS_PER_TOKEN, estimate_tokens
+from vectors import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# "cross_encoder" uses the reranker's ranking head, "cosine" is the cheap
+# embedding-similarity fallback, "cascade" prefilters with cosine and
+# cross-encodes only the top candidates
+RERANK_MODES = ("cross_encoder", "cosine", "cascade")
+
+# Separator/special tokens llama-server adds around a query/document pair
+PAIR_SPECIAL_TOKENS = 4
+# A pair that fails alone is retried with its document halved this many
+# times: text that tokenizes denser than the estimate (CJK, code) can still
+# overflow the backend's batch after truncate_document
+SHRINK_RETRIES = 3
+
+# (query, documents) -> one score per document
+ScoreFn = Callable[[str, List[str]], Awaitable[np.ndarray]]
+
+
+def truncate_document(query: str, document: str, max_pair_tokens: int) -> str:
+    """Trim a document so the (query, document) pair fits the reranker context"""
+    budget = max_pair_tokens - estimate_tokens(query) - PAIR_SPECIAL_TOKENS
+    max_chars = max(budget, 16) * CHARS_PER_TOKEN
+    return document if len(document) <= max_chars else document[:max_chars]
+
+
+async def _score_batch(base_url: str, query: str, documents: List[str], timeout: float) -> List[float]:
+    data = await upstream.post_json(
+        base_url,
+        "/rerank",
+        {"query": query, "documents": documents, "top_n": len(documents)},
+        timeout=timeout,
+    )
+    items = data.get("results", []) if isinstance(data, dict) else data
+    scores = [None] * len(documents)
+    for item in items:
+        index = item.get("index")
+        if isinstance(index, int) and 0 <= index < len(documents):
+            scores[index] = item.get("relevance_score", item.get("score"))
+    if any(score is None for score in scores):
+        raise ValueError(f"Reranker returned {len(items)} scores for {len(documents)} documents")
+    return scores
+
+
+async def _score_pair(base_url: str, query: str, document: str, timeout: float) -> float:
+    """Score one pair, halving the document while the backend rejects it"""
+    for attempt in range(SHRINK_RETRIES + 1):
+        try:
+            return (await _score_batch(base_url, query, [document], timeout))[0]
+        except Exception as e:
+            if attempt == SHRINK_RETRIES or len(document) < 2:
+                raise
+            logger.warning(f"Rerank pair failed ({e}), retrying with {len(document) // 2} of {len(document)} chars")
+            document = document[:len(document) // 2]
+
+
+async def score_with_fallback(base_url: str, query: str, documents: List[str], timeout: float = 60) -> List[float]:
+    """Score one pair batch, retrying pair by pair if the batch call fails
+
+    Like embed_with_fallback: one over-long document does not sink its
+    neighbours, and only the pairs that fail on their own are shortened.
+    """
+    if len(documents) == 1:
+        return [await _score_pair(base_url, query, documents[0], timeout)]
+    try:
+        return await _score_batch(base_url, query, documents, timeout)
+    except Exception as e:
+        logger.warning(f"Rerank batch of {len(documents)} failed ({e}), retrying pair by pair")
+    return [await _score_pair(base_url, query, document, timeout) for document in documents]
+
+
+async def cross_encode(
+    base_url: str,
+    query: str,
+    documents: List[str],
+    pair_batch: int = 16,
+    max_pair_tokens: int = 1024,
+    concurrency: int = 2,
+    timeout: float = 60,
+    slots: Optional[BackendSlots] = None,
+) -> np.ndarray:
+    """Score every (query, document) pair with the reranker, in input order
+
+    Documents are sent pair_batch at a time (up to `concurrency` batches in
+    flight, or the backend's shared `slots`) after truncation to max_pair_tokens;
+    a failed batch is retried pair by pair. Scores are the model's raw
+    relevance logits; higher is more relevant.
+    """
+    scores = np.zeros(len(documents), dtype=np.float32)
+    if not documents:
+        return scores
+    truncated = [truncate_document(query, doc, max_pair_tokens) for doc in documents]
+    semaphore = slots or asyncio.Semaphore(max(1, concurrency))
+
+    async def run(start: int):
+        batch = truncated[start:start + pair_batch]
+        async with semaphore:
+            scores[start:start + len(batch)] = await score_with_fallback(base_url, query, batch, timeout)
+
+    await asyncio.gather(*(run(start) for start in range(0, len(truncated), pair_batch)))
+    return scores
+
+
+def cascade_cutoff(stage1_scores: np.ndarray, top_n: int, min_n: int = 1, gap: Optional[float] = None) -> int:
+    """How many stage-1 leaders go on to the cross-encoder
+
+    Fixed at top_n, or adaptive when `gap` is set: every candidate within
+    `gap` of the best stage-1 score survives, clamped to [min_n, top_n].
+    """
+    n = len(stage1_scores)
+    top_n = min(max(1, top_n), n)
+    if gap is None or n == 0:
+        return top_n
+    within = int(np.count_nonzero(stage1_scores >= stage1_scores.max() - gap))
+    return max(min(max(1, min_n), top_n), min(within, top_n))
+
+
+async def cascade(
+    query: str,
+    documents: List[str],
+    prefilter: ScoreFn,
+    cross_encoder: ScoreFn,
+    top_n: int,
+    min_n: int = 1,
+    gap: Optional[float] = None,
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Two-stage rerank: cheap prefilter over everything, cross-encoder on the survivors
+
+    Returns (order, scores, info). `order` lists document indices best first:
+    survivors by cross-encoder score, then the rest by prefilter score.
+    `scores` holds each document's score from the last stage that saw it.
+    """
+    started = time.perf_counter()
+    stage1 = np.asarray(await prefilter(query, documents), dtype=np.float32)
+    stage1_done = time.perf_counter()
+
+    ranked = top_k_indices(stage1)
+    survivors = ranked[:cascade_cutoff(stage1, top_n, min_n, gap)]
+    stage2 = np.asarray(await cross_encoder(query, [documents[i] for i in survivors]), dtype=np.float32)
+    finished = time.perf_counter()
+
+    scores = stage1.copy()
+    scores[survivors] = stage2
+    order = np.concatenate([survivors[top_k_indices(stage2)], ranked[len(survivors):]])
+    info = {
+        "candidates": len(documents),
+        "survivors": len(survivors),
+        "timings_ms": {
+            "prefilter": round((stage1_done - started) * 1000, 2),
+            "cross_encoder": round((finished - stage1_done) * 1000, 2),
+            "total": round((finished - started) * 1000, 2),
+        },
+    }
+    return order, scores, info
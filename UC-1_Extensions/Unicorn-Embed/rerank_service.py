@@ -1,15 +1,38 @@
 #!/usr/bin/env python3
 """
-Minimal reranking service that uses native llama-server embeddings
+Minimal reranking service in front of a native llama-server reranker
+Cross-encoder scoring via /rerank by default, embedding cosine as fallback
 """
 
-import requests
+import os
+import asyncio
 import numpy as np
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uvicorn
 
+from upstream import upstream
+from batching import parse_embeddings
+from vectors import cosine_scores, rank_results, stack_rows
+from rerank import RERANK_MODES, cascade, cross_encode
+from tokenization import TokenCounter
+
+RERANKER_URL = os.getenv("RERANKER_URL", "http://localhost:8002")
+# The embedding service for cosine/cascade; a --reranking server cannot embed
+EMBEDDING_URL = os.getenv("EMBEDDING_URL", "http://localhost:8001")
+RERANK_MODE = os.getenv("RERANK_MODE", "cross_encoder")
+RERANK_PAIR_BATCH = int(os.getenv("RERANK_PAIR_BATCH", "16"))
+# The per-slot context (and ubatch) the reranker is launched with; longer
+# pairs are rejected by llama-server rather than truncated
+RERANK_MAX_PAIR_TOKENS = int(os.getenv("RERANK_MAX_PAIR_TOKENS", "1024"))
+RERANK_CASCADE_TOP_N = int(os.getenv("RERANK_CASCADE_TOP_N", "32"))
+RERANK_CASCADE_MIN_N = int(os.getenv("RERANK_CASCADE_MIN_N", "8"))
+RERANK_CASCADE_GAP = float(os.getenv("RERANK_CASCADE_GAP")) if os.getenv("RERANK_CASCADE_GAP") else None
+
+# Memoized token counts for usage accounting
+tokenizers = {url: TokenCounter.from_env(url) for url in {RERANKER_URL, EMBEDDING_URL} if url}
+
 app = FastAPI(title="Unicorn Reranking Service", version="1.0.0")
 
 class RerankRequest(BaseModel):
@@ -17,66 +40,102 @@ class RerankRequest(BaseModel):
     query: str
     documents: List[str]
     top_k: Optional[int] = None
+    return_documents: bool = True
+    mode: Optional[Literal["cross_encoder", "cosine", "cascade"]] = None  # default: RERANK_MODE
+    cascade_top_n: Optional[int] = None  # default: RERANK_CASCADE_TOP_N
+    cascade_gap: Optional[float] = None  # default: RERANK_CASCADE_GAP
 
-def get_embedding_from_native(text: str, server_url: str) -> List[float]:
-    """Get embedding from native llama-server"""
-    try:
-        response = requests.post(
-            f"{server_url}/v1/embeddings",
-            json={"input": text, "model": "model"},
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["data"][0]["embedding"]
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
-        return [0.0] * 768  # Return zero vector as fallback
+async def get_embeddings_from_native(texts: List[str], server_url: str, batch_size: int = 64) -> List[Optional[np.ndarray]]:
+    """Get embeddings from native llama-server, batch_size texts per call"""
+    vectors: List[Optional[np.ndarray]] = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        try:
+            data = await upstream.post_json(
+                server_url,
+                "/v1/embeddings",
+                {"input": batch, "model": "model"},
+                timeout=30
+            )
+            vectors.extend(np.asarray(v, dtype=np.float32) if v else None for v in parse_embeddings(data, len(batch)))
+        except Exception as e:
+            print(f"Error getting embeddings: {e}")
+            vectors.extend([None] * len(batch))  # Scored as zero vectors
+    return vectors
+
+async def score_cosine(query: str, documents: List[str]) -> np.ndarray:
+    """Embed query and documents in batched calls, one normalized matrix-vector product"""
+    vectors = await get_embeddings_from_native([query] + documents, EMBEDDING_URL)
+    if vectors[0] is None:
+        raise ValueError("Failed to embed query")
+    return cosine_scores(vectors[0], stack_rows(vectors[1:], len(vectors[0])))
+
+async def score_cross_encoder(query: str, documents: List[str]) -> np.ndarray:
+    """Ranking head of the native reranker server, batched pairs"""
+    return await cross_encode(
+        RERANKER_URL,
+        query,
+        documents,
+        pair_batch=RERANK_PAIR_BATCH,
+        max_pair_tokens=RERANK_MAX_PAIR_TOKENS
+    )
 
 @app.post("/v1/rerank")
 async def rerank_documents(request: RerankRequest):
-    """Rerank documents using cosine similarity"""
+    """Rerank documents with the cross-encoder, by cosine similarity, or as a cosine-then-cross-encoder cascade"""
+    mode = request.mode or RERANK_MODE
+    if mode not in RERANK_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown rerank mode: {mode}")
+    if mode != "cross_encoder" and not EMBEDDING_URL:
+        raise HTTPException(status_code=400, detail=f"Mode {mode} needs an embedding server; EMBEDDING_URL is not set")
+    
+    counting = None
     try:
-        # Get embeddings from native reranker server
-        reranker_url = "http://localhost:8002"
-        
-        # Get query embedding
-        query_embedding = np.array(get_embedding_from_native(request.query, reranker_url))
-        
-        # Get document embeddings and calculate similarities
-        results = []
-        for i, doc in enumerate(request.documents):
-            doc_embedding = np.array(get_embedding_from_native(doc, reranker_url))
-            
-            # Calculate cosine similarity
-            similarity = np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
+        # Usage from the tokenizer of the model that saw every document, counted alongside scoring
+        tokenizer = tokenizers[RERANKER_URL if mode == "cross_encoder" else EMBEDDING_URL]
+        counting = asyncio.create_task(tokenizer.count([request.query] + request.documents))
+        extra = {}
+        order = None
+        if mode == "cascade":
+            order, scores, extra["cascade"] = await cascade(
+                request.query,
+                request.documents,
+                score_cosine,
+                score_cross_encoder,
+                top_n=request.cascade_top_n or RERANK_CASCADE_TOP_N,
+                min_n=RERANK_CASCADE_MIN_N,
+                gap=request.cascade_gap if request.cascade_gap is not None else RERANK_CASCADE_GAP
             )
-            
-            results.append({
-                "index": i,
-                "document": doc,
-                "relevance_score": float(similarity)
-            })
-        
-        # Sort by relevance score
-        results.sort(key=lambda x: x["relevance_score"], reverse=True)
+        elif mode == "cross_encoder":
+            scores = await score_cross_encoder(request.query, request.documents)
+        else:
+            scores = await score_cosine(request.query, request.documents)
         
-        # Apply top_k if specified
-        if request.top_k:
-            results = results[:request.top_k]
+        # Partial top-k selection
+        results = rank_results(scores, request.documents, request.top_k, request.return_documents, order=order)
+        prompt_tokens = sum(await counting)
         
         return {
             "model": request.model,
+            "mode": mode,
+            **extra,
             "results": results,
             "usage": {
-                "prompt_tokens": len(request.query.split()) + sum(len(doc.split()) for doc in request.documents),
-                "total_tokens": len(request.query.split()) + sum(len(doc.split()) for doc in request.documents)
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens
             }
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Scoring failed or the client went away: nobody will read the count
+        if counting is not None and not counting.done():
+            counting.cancel()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await upstream.aclose()
 
 @app.get("/health")
 async def health():
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Memory-budget model residency
+Decides which llama-server pools stay loaded. Each model's footprint is the
+larger of an estimate from its GGUF size and the observed RSS of its
+processes; when loading a model would exceed the memory budget, the
+cheapest models to lose are evicted first. A model's keep value is its
+recent request rate times its reload time, so a frequently used or slow to
+load model outlasts a rarely used one regardless of a quiet half hour.
+Every decision is kept in a log for the admin endpoint.
+"""
+
+import os
+import math
+import time
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def total_memory_mb() -> Optional[float]:
+    """MemTotal from /proc/meminfo (None where unavailable)"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process from /proc (None where unavailable)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class OverBudgetError(RuntimeError):
+    """A model does not fit the memory budget, even after every allowed eviction"""
+
+
+@dataclass
+class ModelUsage:
+    rate: float = 0.0  # exponentially decayed request count
+    updated: float = 0.0
+    last_used: float = 0.0
+    reload_s: Optional[float] = None  # last observed start time
+    observed_mb: Optional[float] = None  # last observed RSS, all replicas
+
+
+class ResidencyManager:
+    """Footprint accounting, request-rate tracking and eviction choice"""
+
+    def __init__(
+        self,
+        budget_mb: Optional[float],
+        overhead_mb: float = 256,
+        half_life_s: float = 1800,
+        load_s_per_gb: float = 2.0,
+        log_size: int = 200,
+    ):
+        self.budget_mb = budget_mb
+        self.overhead_mb = overhead_mb
+        self.tau = half_life_s / math.log(2)
+        self.load_s_per_gb = load_s_per_gb
+        self.usage: Dict[str, ModelUsage] = {}
+        self.decisions: deque = deque(maxlen=log_size)
+
+    @classmethod
+    def from_env(cls) -> "ResidencyManager":
+        budget = os.getenv("MEMORY_BUDGET_MB", "auto")
+        if budget == "auto":
+            # Leave a quarter of RAM to the wrapper, page cache and everything else
+            total = total_memory_mb()
+            budget_mb = total * 0.75 if total else None
+        else:
+            budget_mb = float(budget) or None  # 0 disables the budget
+        return cls(
+            budget_mb,
+            overhead_mb=float(os.getenv("RESIDENCY_OVERHEAD_MB", "256")),
+            half_life_s=float(os.getenv("RESIDENCY_HALF_LIFE", "1800")),
+            load_s_per_gb=float(os.getenv("RESIDENCY_LOAD_S_PER_GB", "2")),
+        )
+
+    def _usage(self, model: str) -> ModelUsage:
+        return self.usage.setdefault(model, ModelUsage())
+
+    def touch(self, model: str, now: Optional[float] = None):
+        """Count one request"""
+        now = now or time.time()
+        usage = self._usage(model)
+        usage.rate = self.rate(model, now) + 1
+        usage.updated = usage.last_used = now
+
+    def rate(self, model: str, now: Optional[float] = None) -> float:
+        """Decayed request count (about the requests of the last half-life / ln 2)"""
+        usage = self.usage.get(model)
+        if not usage or not usage.updated:
+            return 0.0
+        return usage.rate * math.exp(-((now or time.time()) - usage.updated) / self.tau)
+
+    def observe_load(self, model: str, seconds: float):
+        self._usage(model).reload_s = seconds
+
+    def observe_rss(self, model: str, mb: Optional[float]):
+        self._usage(model).observed_mb = mb
+
+    def estimate_mb(self, model_path: str, replicas: int = 1) -> float:
+        """Weights (the GGUF file, mmapped) plus context and compute buffers, per replica"""
+        try:
+            weights = os.path.getsize(model_path) / MB
+        except OSError:
+            weights = 0.0
+        return (weights + self.overhead_mb) * max(1, replicas)
+
+    def footprint_mb(self, model: str, model_path: str, replicas: int = 1) -> float:
+        observed = self._usage(model).observed_mb
+        return max(self.estimate_mb(model_path, replicas), observed or 0.0)
+
+    def reload_s(self, model: str, model_path: str) -> float:
+        observed = self._usage(model).reload_s
+        if observed is not None:
+            return observed
+        return max(1.0, self.estimate_mb(model_path) / 1024 * self.load_s_per_gb)
+
+    def value(self, model: str, model_path: str, now: Optional[float] = None) -> float:
+        """Expected reload seconds saved by keeping the model: request rate x reload time"""
+        return self.rate(model, now) * self.reload_s(model, model_path)
+
+    def choose_victims(
+        self,
+        resident: Dict[str, Tuple[str, float]],
+        needed_mb: float,
+        protected: Iterable[str] = (),
+        hot: Iterable[str] = (),
+    ) -> Tuple[List[str], bool]:
+        """Models to evict so needed_mb fits the budget, and whether it then fits
+
+        `resident` maps model -> (GGUF path, footprint MB). Protected models
+        (pinned, busy, starting) are never chosen; predicted-hot ones only
+        after every other candidate. Cheapest keep value per MB goes first.
+        Nothing is chosen when evicting everything allowed would not be enough.
+        """
+        if self.budget_mb is None:
+            return [], True
+        used = sum(footprint for _, footprint in resident.values())
+        excess = used + needed_mb - self.budget_mb
+        if excess <= 0:
+            return [], True
+        protected, hot = set(protected), set(hot)
+        now = time.time()
+        candidates = sorted(
+            (model for model in resident if model not in protected),
+            key=lambda model: (model in hot, self.value(model, resident[model][0], now) / max(resident[model][1], 1.0)),
+        )
+        victims, freed = [], 0.0
+        for model in candidates:
+            if freed >= excess:
+                break
+            victims.append(model)
+            freed += resident[model][1]
+        if freed < excess:
+            return [], False
+        return victims, True
+
+    def log(self, action: str, model: str, reason: str, **details: Any):
+        entry = {"time": time.time(), "action": action, "model": model, "reason": reason, **details}
+        self.decisions.append(entry)
+        logger.info(f"Residency: {action} {model} ({reason})")
+
+    def stats(self, resident: Dict[str, Tuple[str, float]], pinned: Set[str]) -> Dict[str, Any]:
+        now = time.time()
+        used = sum(footprint for _, footprint in resident.values())
+        models = {}
+        for model, (path, footprint) in resident.items():
+            usage = self._usage(model)
+            models[model] = {
+                "footprint_mb": round(footprint, 1),
+                "estimated_mb": round(self.estimate_mb(path), 1),
+                "observed_rss_mb": round(usage.observed_mb, 1) if usage.observed_mb else None,
+                "request_rate": round(self.rate(model, now), 2),
+                "idle_s": round(now - usage.last_used, 1) if usage.last_used else None,
+                "reload_s": round(self.reload_s(model, path), 2),
+                "keep_value": round(self.value(model, path, now), 2),
+                "pinned": model in pinned,
+            }
+        return {
+            "budget_mb": round(self.budget_mb, 1) if self.budget_mb else None,
+            "used_mb": round(used, 1),
+            "models": models,
+            "decisions": list(self.decisions),
+        }
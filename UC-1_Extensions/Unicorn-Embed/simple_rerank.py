@@ -3,13 +3,16 @@
 Simple reranking service using the native embedding server
 """
 
-import requests
 import numpy as np
 from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
 
+from upstream import upstream
+from batching import parse_embeddings
+from vectors import cosine_scores, rank_results, stack_rows
+
 app = FastAPI(title="Simple Reranking Service")
 
 class RerankRequest(BaseModel):
@@ -17,54 +20,47 @@ class RerankRequest(BaseModel):
     query: str
     documents: List[str]
     top_n: Optional[int] = None
+    return_documents: bool = True
 
-def get_embedding(text: str) -> List[float]:
-    """Get embedding from the native embedding server"""
-    try:
-        response = requests.post(
-            "http://localhost:8001/v1/embeddings",
-            json={"input": text, "model": "nomic"},
-            timeout=30
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data["data"][0]["embedding"]
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return [0.0] * 768
+async def get_embeddings(texts: List[str], batch_size: int = 64) -> List[Optional[np.ndarray]]:
+    """Get embeddings from the native embedding server, batch_size texts per call"""
+    vectors: List[Optional[np.ndarray]] = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        try:
+            data = await upstream.post_json(
+                "http://localhost:8001",
+                "/v1/embeddings",
+                {"input": batch, "model": "nomic"},
+                timeout=30
+            )
+            vectors.extend(np.asarray(v, dtype=np.float32) if v else None for v in parse_embeddings(data, len(batch)))
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            vectors.extend([None] * len(batch))
+    return vectors
 
 @app.post("/v1/rerank")
 async def rerank(request: RerankRequest):
     """Rerank documents using cosine similarity"""
-    # Get query embedding
-    query_emb = np.array(get_embedding(request.query))
-    
-    # Get document embeddings and calculate similarities
-    results = []
-    for i, doc in enumerate(request.documents):
-        doc_emb = np.array(get_embedding(doc))
-        
-        # Cosine similarity
-        similarity = np.dot(query_emb, doc_emb) / (np.linalg.norm(query_emb) * np.linalg.norm(doc_emb))
-        
-        results.append({
-            "index": i,
-            "document": doc,
-            "relevance_score": float(similarity)
-        })
+    # Embed query and documents in batched calls
+    vectors = await get_embeddings([request.query] + request.documents)
+    dim = next((len(v) for v in vectors if v is not None), 768)
+    query = vectors[0] if vectors[0] is not None else np.zeros(dim, dtype=np.float32)
     
-    # Sort by relevance
-    results.sort(key=lambda x: x["relevance_score"], reverse=True)
-    
-    # Apply top_n if specified
-    if request.top_n:
-        results = results[:request.top_n]
+    # Cosine similarity as one matrix-vector product, partial top-k selection
+    scores = cosine_scores(query, stack_rows(vectors[1:], dim))
+    results = rank_results(scores, request.documents, request.top_n, request.return_documents)
     
     return {
         "model": request.model,
         "results": results
     }
 
+@app.on_event("shutdown")
+async def shutdown():
+    await upstream.aclose()
+
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Streaming NDJSON bulk embedding
+Input lines are {"id": ..., "text": ...}; output lines are written as each
+chunk completes. At most one chunk is being embedded while the next one is
+read, so memory stays flat regardless of corpus size, and a slow reader
+throttles input consumption through normal HTTP flow control.
+
+The exchange is full duplex: clients must read results while still
+uploading (e.g. httpx.AsyncClient / aiohttp with a separate reader task),
+otherwise both sides eventually block on full socket buffers.
+"""
+
+import json
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.responses import StreamingResponse
+
+from vectors import format_embedding
+from metrics import SERIALIZATION_TIME, timed
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# (line number, id, text, error)
+Record = Tuple[int, Any, Optional[str], Optional[str]]
+# texts -> (vectors, None where embedding failed; prompt tokens per text)
+EmbedFn = Callable[[List[str]], Awaitable[Tuple[Sequence[Optional[np.ndarray]], List[int]]]]
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse that can stream while the request body is still being read
+
+    Starlette's StreamingResponse listens for client disconnects by calling
+    receive() alongside the body iterator, which would swallow request body
+    chunks the iterator has not consumed yet. Here a disconnect surfaces as
+    ClientDisconnect from request.stream() (or a failed send) instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def _parse_line(line_no: int, line: bytes) -> Record:
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        return line_no, None, None, f"invalid JSON: {e}"
+    if not isinstance(obj, dict):
+        return line_no, None, None, "expected a JSON object"
+    text = obj.get("text", obj.get("input"))
+    if not isinstance(text, str):
+        return line_no, obj.get("id"), None, "missing 'text' string"
+    return line_no, obj.get("id", line_no), text, None
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Record]:
+    """Parse an NDJSON byte stream incrementally, skipping blank lines"""
+    buffer = b""
+    line_no = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield _parse_line(line_no, line)
+    if buffer.strip():
+        yield _parse_line(line_no + 1, buffer)
+
+
+async def _chunks(records: AsyncIterator[Record], size: int) -> AsyncIterator[List[Record]]:
+    chunk: List[Record] = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _encode(obj: dict) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+async def stream_embeddings(
+    records: AsyncIterator[Record],
+    embed: EmbedFn,
+    chunk_size: int = 256,
+    encoding_format: str = "float",
+) -> AsyncIterator[bytes]:
+    """Embed an NDJSON record stream, yielding NDJSON result lines in input order
+
+    Each input produces one line: {"id", "object": "embedding", "embedding"}
+    or {"id", "line", "error"}. A final {"object": "summary", ...} line
+    reports totals; its prompt_tokens add up the counts `embed` returns
+    alongside the vectors.
+    """
+    total = failed = tokens = 0
+    pending: Optional[Tuple[List[Record], asyncio.Task]] = None
+    task: Optional[asyncio.Task] = None
+
+    def start(chunk: List[Record]) -> asyncio.Task:
+        texts = [text for _, _, text, error in chunk if error is None]
+        return asyncio.create_task(embed(texts))
+
+    def render(chunk: List[Record], result) -> bytes:
+        with timed(SERIALIZATION_TIME, endpoint="/v1/embeddings/stream", format=encoding_format):
+            return _render(chunk, result)
+
+    def _render(chunk: List[Record], result) -> bytes:
+        nonlocal total, failed, tokens
+        vectors, counts = result
+        out = bytearray()
+        vector_iter = iter(zip(vectors, counts))
+        for line_no, record_id, text, error in chunk:
+            total += 1
+            vector, count = next(vector_iter) if error is None else (None, 0)
+            if error is None and vector is None:
+                error = "embedding failed"
+            if error is not None:
+                failed += 1
+                out += _encode({"id": record_id, "line": line_no, "error": error})
+                continue
+            tokens += count
+            out += _encode({
+                "id": record_id,
+                "object": "embedding",
+                "embedding": format_embedding(vector, encoding_format),
+            })
+        return bytes(out)
+
+    try:
+        async for chunk in _chunks(records, chunk_size):
+            task = start(chunk)
+            if pending is not None:
+                previous, previous_task = pending
+                yield render(previous, await previous_task)
+            pending = (chunk, task)
+        if pending is not None:
+            previous, previous_task = pending
+            pending = None
+            yield render(previous, await previous_task)
+        yield _encode({"object": "summary", "count": total, "failed": failed, "prompt_tokens": tokens})
+    finally:
+        # Client went away or the input broke mid-stream: drop in-flight work
+        for in_flight in (pending[1] if pending else None, task):
+            if in_flight is not None and not in_flight.done():
+                in_flight.cancel()
+        logger.info(f"Streamed {total} embeddings ({failed} failed)")
@@ -0,0 +1,11 @@
+"""
+Shared test setup
+The service is a set of flat modules, so the tests import them from the
+parent directory the way the Docker image runs them from /app.
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
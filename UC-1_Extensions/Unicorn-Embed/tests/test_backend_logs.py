@@ -0,0 +1,71 @@
+import sys
+import asyncio
+import subprocess
+
+import pytest
+
+from backend_logs import MAX_LINE_BYTES, BackendLogs, classify, parse_timing
+
+
+def test_parse_prompt_eval_timing():
+    line = "prompt eval time =      12.34 ms /    45 tokens (    0.27 ms per token,  3645.57 tokens per second)"
+    assert parse_timing(line) == {"phase": "prompt_eval", "seconds": 0.01234, "tokens": 45, "tokens_per_second": 3645.57}
+
+
+def test_parse_load_timing_without_tokens():
+    assert parse_timing("llama_perf_context_print:        load time =  1234.56 ms") == {"phase": "load", "seconds": pytest.approx(1.23456)}
+    assert parse_timing("slot launch_slot_: id 0 | task 3 | processing task") is None
+
+
+def test_classify_levels():
+    assert classify("E ggml_vulkan: device lost") == "error"
+    assert classify("failed to allocate: out of memory") == "error"
+    assert classify("W model has no chat template") == "warning"
+    assert classify("srv  log_server_r: request: POST /embedding 200") == "info"
+
+
+SCRIPT = """
+import sys
+print("main: server is listening")
+print("W warning: low memory", file=sys.stderr)
+print("x" * {long})
+print("prompt eval time =  5.00 ms /  10 tokens (0.50 ms per token, 2000.00 tokens per second)", file=sys.stderr)
+sys.stdout.flush()
+sys.exit(3)
+"""
+
+
+def run_pump(script, max_lines=100, min_level="info"):
+    async def run():
+        logs = BackendLogs(max_lines=max_lines)
+        process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        pump = logs.attach("http://localhost:8123", process)
+        await asyncio.gather(*pump.tasks)
+        process.wait()
+        tail = logs.tail(min_level=min_level)
+        await logs.close()
+        return tail
+
+    return asyncio.run(run())["localhost:8123"]
+
+
+def test_pump_drains_both_pipes_and_keeps_timings():
+    tail = run_pump(SCRIPT.format(long=10))
+    assert not tail["running"] and tail["exit_code"] == 3
+    lines = {entry["line"]: entry for entry in tail["lines"]}
+    assert lines["main: server is listening"]["stream"] == "stdout"
+    assert lines["W warning: low memory"]["level"] == "warning"
+    assert tail["last_timings"]["prompt_eval"]["tokens"] == 10
+
+
+def test_pump_survives_over_long_lines():
+    tail = run_pump(SCRIPT.format(long=MAX_LINE_BYTES * 2))
+    assert "[line too long, truncated]" in [entry["line"] for entry in tail["lines"]]
+    assert "prompt_eval" in tail["last_timings"]
+
+
+def test_tail_filters_by_level_and_ring_is_bounded():
+    tail = run_pump("\n".join(f"print('line {i}')" for i in range(20)) + "\nprint('E fatal')", max_lines=5)
+    assert [entry["line"] for entry in tail["lines"]] == ["line 16", "line 17", "line 18", "line 19", "E fatal"]
+    errors = run_pump("print('plain')\nprint('E fatal')", min_level="error")
+    assert [entry["line"] for entry in errors["lines"]] == ["E fatal"]
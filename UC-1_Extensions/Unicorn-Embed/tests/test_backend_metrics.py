@@ -0,0 +1,61 @@
+import asyncio
+
+import backend_metrics
+from backend_metrics import BackendMetricsCollector
+
+EXPOSITION = """\
+# HELP llamacpp:prompt_tokens_total Number of prompt tokens processed.
+# TYPE llamacpp:prompt_tokens_total counter
+llamacpp:prompt_tokens_total 42
+# HELP llamacpp:requests_processing Number of requests processing.
+# TYPE llamacpp:requests_processing gauge
+llamacpp:requests_processing 3
+"""
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+def scrape(monkeypatch, backends, down=()):
+    async def get(base_url, path, timeout=None):
+        if base_url in down:
+            raise ConnectionError("refused")
+        return FakeResponse(EXPOSITION)
+
+    monkeypatch.setattr(backend_metrics.upstream, "get", get)
+    collector = BackendMetricsCollector(lambda: backends)
+    asyncio.run(collector.refresh())
+    return {
+        (sample.name, sample.labels.get("replica")): sample.value
+        for family in collector.collect()
+        for sample in family.samples
+    }
+
+
+def test_backend_series_are_relabelled(monkeypatch):
+    samples = scrape(monkeypatch, [("http://localhost:8001", "embedding_a"), ("http://localhost:8002", "embedding_a")])
+    assert samples[("unicorn_backend_prompt_tokens_total", "localhost:8001")] == 42
+    assert samples[("unicorn_backend_requests_processing", "localhost:8002")] == 3
+    assert samples[("unicorn_backend_up", "localhost:8001")] == 1
+
+
+def test_failed_scrape_reports_down(monkeypatch):
+    samples = scrape(monkeypatch, [("http://localhost:8001", "a"), ("http://localhost:8002", "b")], down={"http://localhost:8002"})
+    assert samples[("unicorn_backend_up", "localhost:8002")] == 0
+    assert ("unicorn_backend_prompt_tokens_total", "localhost:8002") not in samples
+    assert samples[("unicorn_backend_prompt_tokens_total", "localhost:8001")] == 42
+
+
+def test_stopped_backends_are_dropped(monkeypatch):
+    backends = [("http://localhost:8001", "a")]
+    scrape(monkeypatch, backends)
+    collector = BackendMetricsCollector(lambda: backends)
+    asyncio.run(collector.refresh())
+    backends.clear()
+    asyncio.run(collector.refresh())
+    assert collector.up == {} and collector.samples == {}
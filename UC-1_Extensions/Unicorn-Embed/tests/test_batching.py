@@ -0,0 +1,210 @@
+import asyncio
+
+import pytest
+
+import batching
+from batching import EmbeddingBatcher, embed_with_fallback, parse_embeddings, plan_batches
+
+BASE_URL = "http://127.0.0.1:9991"
+
+
+class FakeBackend:
+    """Replaces batching.embed_batch: one-element vectors, usage of one token per word per call"""
+
+    def __init__(self, monkeypatch, fail=lambda texts: False, delay=0.0):
+        self.batches = []
+        self.fail = fail
+        self.delay = delay
+        monkeypatch.setattr(batching, "embed_batch", self)
+
+    async def __call__(self, base_url, texts, timeout=60):
+        self.batches.append(list(texts))
+        await asyncio.sleep(self.delay)
+        if self.fail(texts):
+            raise RuntimeError("backend error")
+        return [[float(len(text))] for text in texts], sum(len(text.split()) for text in texts)
+
+
+class WordCounter:
+    """Stands in for TokenCounter: one token per word plus BOS/EOS; `uncounted` texts fail"""
+
+    def __init__(self, uncounted=()):
+        self.uncounted = set(uncounted)
+
+    async def count(self, texts, fallback=True):
+        return [None if text in self.uncounted else len(text.split()) + 2 for text in texts]
+
+
+def test_plan_batches_bounds_items_and_tokens():
+    assert plan_batches([5, 5, 5, 5, 5], max_items=2, max_tokens=100) == [[0, 1], [2, 3], [4]]
+    assert plan_batches([60, 50, 10, 30], max_items=10, max_tokens=100) == [[0], [1, 2, 3]]
+
+
+def test_plan_batches_oversized_item_gets_its_own_batch():
+    assert plan_batches([10, 500, 10], max_items=10, max_tokens=100) == [[0], [1], [2]]
+
+
+def test_parse_embeddings_native_and_openai_formats():
+    native = [{"index": 1, "embedding": [[0.5, 0.5]]}, {"index": 0, "embedding": [[1.0, 0.0]]}]
+    assert parse_embeddings(native, 2) == [[1.0, 0.0], [0.5, 0.5]]
+    openai = {"object": "list", "data": [{"index": 0, "embedding": [0.1]}]}
+    assert parse_embeddings(openai, 2) == [[0.1], []]
+    assert parse_embeddings({"error": "boom"}, 1) == [[]]
+
+
+def test_failed_batch_is_retried_item_by_item(monkeypatch):
+    backend = FakeBackend(monkeypatch, fail=lambda texts: "bad" in texts)
+    vectors, counts = asyncio.run(embed_with_fallback(BASE_URL, ["one", "bad", "three"]))
+    assert vectors == [[3.0], [], [5.0]]
+    # Each retried text went upstream alone, so its usage is its own
+    assert counts == [1, 0, 1]
+    assert backend.batches == [["one", "bad", "three"], ["one"], ["bad"], ["three"]]
+
+
+def test_batcher_coalesces_concurrent_callers(monkeypatch):
+    backend = FakeBackend(monkeypatch)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_wait_ms=20, tokenizer=WordCounter())
+        results = await asyncio.gather(batcher.embed(["a", "bbb"]), batcher.embed(["cc"]), batcher.embed(["dddd", "a"]))
+        stats = batcher.stats()
+        await batcher.close()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    # Each caller gets its own input order back
+    assert results == [[[1.0], [3.0]], [[2.0]], [[4.0], [1.0]]]
+    assert len(backend.batches) == 1 and sorted(backend.batches[0]) == ["a", "a", "bbb", "cc", "dddd"]
+    assert stats["batches_sent"] == 1 and stats["texts_sent"] == 5
+
+
+def test_batcher_keeps_concurrency_limit(monkeypatch):
+    FakeBackend(monkeypatch, delay=0.05)
+    in_flight = []
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_batch_items=1, max_wait_ms=1, concurrency=2, tokenizer=WordCounter())
+        watching = True
+
+        async def watch():
+            while watching:
+                in_flight.append(batcher.stats()["in_flight_batches"])
+                await asyncio.sleep(0.005)
+
+        watcher = asyncio.ensure_future(watch())
+        await batcher.embed(["a", "b", "c", "d", "e"])
+        watching = False
+        await watcher
+        await batcher.close()
+
+    asyncio.run(run())
+    assert max(in_flight) == 2
+
+
+def test_batcher_unexpected_error_fails_the_batch(monkeypatch):
+    async def broken(*args, **kwargs):
+        raise ValueError("unexpected")
+
+    monkeypatch.setattr(batching, "embed_with_fallback", broken)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_wait_ms=1, tokenizer=WordCounter())
+        try:
+            with pytest.raises(ValueError):
+                await batcher.embed(["a"])
+            # The dispatcher keeps serving later requests
+            with pytest.raises(ValueError):
+                await batcher.embed(["b"])
+            assert not batcher.dispatcher.done()
+        finally:
+            await batcher.close()
+
+    asyncio.run(run())
+
+
+def test_close_fails_texts_still_waiting(monkeypatch):
+    FakeBackend(monkeypatch, delay=0.2)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_batch_items=1, max_wait_ms=1, concurrency=1, tokenizer=WordCounter())
+        waiting = asyncio.ensure_future(batcher.embed(["a", "b", "c"]))
+        await asyncio.sleep(0.05)
+        await batcher.close()
+        with pytest.raises(RuntimeError, match="stopped"):
+            await waiting
+
+    asyncio.run(run())
+
+
+def test_close_during_collect_fails_the_window(monkeypatch):
+    backend = FakeBackend(monkeypatch)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_wait_ms=10_000, tokenizer=WordCounter())
+        waiting = asyncio.ensure_future(batcher.embed(["a", "b"]))
+        await asyncio.sleep(0.05)
+        assert batcher.stats()["queued"] == 2
+        await batcher.close()
+        with pytest.raises(RuntimeError, match="stopped"):
+            await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(run())
+    assert backend.batches == []
+
+
+def test_batcher_packs_concurrent_callers_by_exact_counts(monkeypatch):
+    backend = FakeBackend(monkeypatch)
+    short = ["s"] * 4
+    # 100 tokens each, though the character estimate says 50
+    long = [" ".join(["w"] * 98)] * 4
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_batch_items=8, max_batch_tokens=220, max_wait_ms=20, tokenizer=WordCounter())
+        results = await asyncio.gather(batcher.embed(long[:2] + short[:2]), batcher.embed(short[2:] + long[2:]))
+        await batcher.close()
+        return results
+
+    vectors_a, vectors_b = asyncio.run(run())
+    # Each caller gets its own input order back
+    assert vectors_a == [[195.0], [195.0], [1.0], [1.0]]
+    assert vectors_b == [[1.0], [1.0], [195.0], [195.0]]
+    # Both callers share one window, sorted by length: the short texts and two
+    # long ones fill the first 220-token budget (4 x 3 + 2 x 100), the rest
+    # follow; packed by estimate (4 x 2 + 4 x 50) all eight would share one
+    assert backend.batches == [short + long[:2], long[:2]]
+
+
+def test_uncounted_texts_are_sent_alone(monkeypatch):
+    backend = FakeBackend(monkeypatch)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_wait_ms=20, tokenizer=WordCounter(uncounted={"dense"}))
+        result = await batcher.embed_counted(["one", "dense", "two"])
+        await batcher.close()
+        return result
+
+    vectors, counts = asyncio.run(run())
+    assert vectors == [[3.0], [5.0], [3.0]]
+    assert backend.batches == [["one", "two"], ["dense"]]
+    # "dense" went upstream alone, so the backend's usage is its own count
+    assert counts == [3, 1, 3]
+
+
+def test_batcher_bills_each_caller_its_own_tokens(monkeypatch):
+    FakeBackend(monkeypatch, fail=lambda texts: "bad" in texts)
+
+    async def run():
+        batcher = EmbeddingBatcher(BASE_URL, max_wait_ms=20, tokenizer=WordCounter())
+        results = await asyncio.gather(
+            batcher.embed_counted(["a a a a a a a a"]),
+            batcher.embed_counted(["supercalifragilisticexpialidocious", "bad"]),
+        )
+        stats = batcher.stats()
+        await batcher.close()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert stats["batches_sent"] == 1
+    # Billed by exact counts, not shares of the batch total; failures cost nothing
+    assert results[0][1] == [10]
+    assert results[1][1] == [3, 0]
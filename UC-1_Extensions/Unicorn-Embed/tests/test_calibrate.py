@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import calibrate
+from calibrate import candidates, rank_key, search
+from llama_server_wrapper_fixed import ModelConfig
+
+CONFIG = ModelConfig(path="/models/m.gguf", name="embedding_m", type="embedding", port=8001,
+                     n_gpu_layers=20, n_ctx=2048, n_batch=2048, n_threads=4)
+
+
+def metrics(rate, p95):
+    return {"embeddings_per_s": rate, "p50_ms": p95 / 2, "p95_ms": p95, "load_s": 1.0}
+
+
+def test_candidates_skip_batches_below_context_and_keep_current():
+    grid = candidates(CONFIG, [0, 99], [1024, 4096], [8])
+    assert grid[0] == {"n_gpu_layers": 20, "n_batch": 2048, "n_threads": 4}
+    assert {params["n_batch"] for params in grid[1:]} == {4096}
+    assert len(grid) == 3
+
+
+def test_rank_key_orders_throughput_then_p95_and_failures_last():
+    ranked = sorted(
+        [{"failed": "did not start"}, metrics(100, 50), metrics(200, 90), metrics(200, 40)],
+        key=lambda m: rank_key(m, None),
+    )
+    assert ranked == [metrics(200, 40), metrics(200, 90), metrics(100, 50), {"failed": "did not start"}]
+
+
+def test_rank_key_prefers_candidates_within_the_p95_limit():
+    assert rank_key(metrics(100, 50), 60) < rank_key(metrics(300, 80), 60) < rank_key({"failed": "x"}, 60)
+
+
+def test_halving_search_only_finalists_run_the_full_workload(monkeypatch):
+    runs = []
+
+    async def measure(config, params, requests, concurrency):
+        runs.append((params["n_threads"], len(requests)))
+        return metrics(params["n_threads"] * 10, 50)
+
+    monkeypatch.setattr(calibrate, "measure", measure)
+    grid = [{"n_gpu_layers": 0, "n_batch": 2048, "n_threads": threads} for threads in (1, 2, 3, 4)]
+    args = SimpleNamespace(concurrency=1, requests=40, batch=2, seed=0, search="halving", eta=2, max_p95_ms=None)
+    results = asyncio.run(search(CONFIG, grid, args))
+    assert results[0][0]["n_threads"] == 4
+    assert runs == [(1, 10), (2, 10), (3, 10), (4, 10), (4, 20), (3, 20), (4, 40)]
+
+
+class FakeBackend:
+    """Stands in for LlamaServerProcess; embeds every text except `broken`"""
+
+    broken = None
+
+    def __init__(self, config):
+        self.config = config
+        self.batcher = self
+        self.stopped = False
+
+    async def start(self):
+        return True
+
+    async def stop(self):
+        self.stopped = True
+
+    async def embed(self, texts):
+        return [[] if text == self.broken else [1.0] for text in texts]
+
+
+def test_candidate_with_failed_embeddings_is_rejected(monkeypatch):
+    monkeypatch.setattr(calibrate, "LlamaServerProcess", FakeBackend)
+    monkeypatch.setattr(calibrate, "free_port", lambda: 9000)
+    requests = [{"texts": ["a", "b"]}, {"texts": ["c", "d"]}, {"texts": ["e"]}]
+    params = {"n_gpu_layers": 0, "n_batch": 2048, "n_threads": 4}
+
+    healthy = asyncio.run(calibrate.measure(CONFIG, params, requests, concurrency=1))
+    assert healthy["embeddings_per_s"] > 0
+
+    # Warm-up (first `concurrency` requests) passes; one timed text fails
+    monkeypatch.setattr(FakeBackend, "broken", "d")
+    failed = asyncio.run(calibrate.measure(CONFIG, params, requests, concurrency=1))
+    assert failed == {"failed": "1 of 3 requests failed"}
+    assert rank_key(failed, None) > rank_key(healthy, None)
+
+    monkeypatch.setattr(FakeBackend, "broken", "a")
+    assert "warmup failed" in asyncio.run(calibrate.measure(CONFIG, params, requests, concurrency=1))["failed"]
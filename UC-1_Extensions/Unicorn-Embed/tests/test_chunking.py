@@ -0,0 +1,60 @@
+import asyncio
+
+import numpy as np
+
+from chunking import embed_chunked, pool_vectors, token_windows
+
+
+def test_token_windows_overlap_and_cover():
+    windows = token_windows(list(range(10)), size=4, overlap=1)
+    assert windows == [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]]
+
+
+def test_token_windows_short_input_is_one_window():
+    assert token_windows([1, 2], size=8, overlap=2) == [[1, 2]]
+
+
+def test_token_windows_overlap_not_smaller_than_size_still_advances():
+    windows = token_windows(list(range(5)), size=2, overlap=5)
+    assert windows[0] == [0, 1] and windows[-1][-1] == 4
+
+
+def test_pool_vectors_mean_is_normalized():
+    pooled = pool_vectors([np.array([1.0, 0.0]), np.array([0.0, 1.0])], [4, 1])
+    np.testing.assert_allclose(pooled, [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
+
+
+def test_pool_vectors_weighted_favours_longer_window():
+    pooled = pool_vectors([np.array([1.0, 0.0]), np.array([0.0, 1.0])], [3, 1], pooling="weighted")
+    np.testing.assert_allclose(pooled, np.array([3.0, 1.0]) / np.sqrt(10), rtol=1e-6)
+
+
+class WordCounter:
+    """Stands in for TokenCounter: one token per word, plus BOS/EOS in counts"""
+
+    async def count(self, texts):
+        return [len(text.split()) + 2 for text in texts]
+
+    async def tokenize(self, text, add_special=True):
+        return text.split()
+
+    async def detokenize(self, tokens):
+        return " ".join(tokens)
+
+
+def test_embed_chunked_pools_long_inputs_only():
+    sent = []
+
+    async def embed(texts):
+        sent.extend(texts)
+        return [None if text == "broken" else np.array([1.0, float(len(text.split()))]) for text in texts]
+
+    long_text = " ".join(f"w{i}" for i in range(10))
+    vectors, chunks = asyncio.run(embed_chunked(["short one", long_text, "broken"], embed, WordCounter(), max_tokens=6, overlap=1))
+    # Windows of 6 - 2 special tokens, sharing one token
+    assert sent == ["short one", "w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9", "broken"]
+    assert chunks == [1, 3, 1]
+    np.testing.assert_array_equal(vectors[0], [1.0, 2.0])
+    assert abs(np.linalg.norm(vectors[1]) - 1) < 1e-6
+    assert vectors[2] is None
+
@@ -0,0 +1,70 @@
+import asyncio
+
+import numpy as np
+
+from embedding_cache import ENTRY_OVERHEAD_BYTES, EmbeddingCache
+
+
+def vector(seed, dim=8):
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class Fetch:
+    """Stand-in backend: records what it was asked for, one token per character"""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = set(fail)
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        vectors = [[] if text in self.fail else vector(len(text)).tolist() for text in texts]
+        return vectors, [0 if text in self.fail else len(text) for text in texts]
+
+
+def test_lru_evicts_under_byte_budget():
+    cache = EmbeddingCache(max_bytes=2 * (8 * 4 + ENTRY_OVERHEAD_BYTES))
+    cache.put("m", "a", vector(1))
+    cache.put("m", "b", vector(2))
+    assert cache.get("m", "a") is not None  # a is now most recent
+    cache.put("m", "c", vector(3))
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") is not None and cache.get("m", "c") is not None
+    assert cache.evictions == 1
+
+
+def test_keys_are_normalized_and_per_model():
+    cache = EmbeddingCache()
+    cache.put("m", "  café ", vector(1))
+    assert cache.get("m", "café") is not None
+    assert cache.get("other", "café") is None
+
+
+def test_resolve_fetches_each_missing_text_once():
+    cache = EmbeddingCache()
+    fetch = Fetch()
+    vectors, counts = asyncio.run(cache.resolve("m", ["aa", "bbb", "aa"], fetch))
+    assert fetch.calls == [["aa", "bbb"]]
+    assert counts == [2, 3, 2]
+    np.testing.assert_array_equal(vectors[0], vectors[2])
+
+    vectors, counts = asyncio.run(cache.resolve("m", ["bbb", "cccc"], fetch))
+    assert fetch.calls[-1] == ["cccc"]
+    assert counts == [3, 4]
+
+
+def test_resolve_failed_texts_are_not_cached():
+    cache = EmbeddingCache()
+    fetch = Fetch(fail={"bad"})
+    vectors, counts = asyncio.run(cache.resolve("m", ["ok", "bad"], fetch))
+    assert vectors[1] is None and counts == [2, 0]
+    asyncio.run(cache.resolve("m", ["bad"], fetch))
+    assert fetch.calls[-1] == ["bad"]
+
+
+def test_disabled_cache_passes_through():
+    cache = EmbeddingCache(max_bytes=0)
+    fetch = Fetch()
+    asyncio.run(cache.resolve("m", ["a", "a"], fetch))
+    asyncio.run(cache.resolve("m", ["a"], fetch))
+    assert fetch.calls == [["a", "a"], ["a"]]
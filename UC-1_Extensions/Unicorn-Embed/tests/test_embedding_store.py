@@ -0,0 +1,130 @@
+import asyncio
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, text_digest
+from embedding_store import INDEX_RECORD, INITIAL_CAPACITY, ModelStore, PersistentEmbeddingStore
+
+
+def vector(seed, dim=8):
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def model_file(tmp_path, content=b"GGUF model weights"):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(content)
+    return str(path)
+
+
+async def fetch(texts):
+    """Stand-in backend, one token per character"""
+    return [vector(len(text)).tolist() for text in texts], [len(text) for text in texts]
+
+
+def test_vectors_and_counts_survive_a_restart(tmp_path):
+    path = model_file(tmp_path)
+
+    async def first_run():
+        cache = EmbeddingCache(store=PersistentEmbeddingStore(str(tmp_path / "store"), flush_interval=0))
+        cache.attach_model("m", path)
+        result = await cache.resolve("m", ["hello", "world!"], fetch)
+        await cache.close()
+        return result
+
+    vectors, counts = asyncio.run(first_run())
+
+    cache = EmbeddingCache(store=PersistentEmbeddingStore(str(tmp_path / "store")))
+    cache.attach_model("m", path)
+    calls = []
+
+    async def counting_fetch(texts):
+        calls.append(texts)
+        return await fetch(texts)
+
+    restored, restored_counts = asyncio.run(cache.resolve("m", ["hello", "world!"], counting_fetch))
+    assert calls == []
+    assert restored_counts == counts == [5, 6]
+    np.testing.assert_array_equal(restored[1], vectors[1])
+    assert cache.store.hits == 2
+
+
+def test_store_queues_writes_on_the_event_loop(tmp_path):
+    store = PersistentEmbeddingStore(str(tmp_path / "store"), flush_interval=60)
+    store.open_model("m", model_file(tmp_path))
+
+    async def run():
+        store.put_many("m", [(text_digest("a"), vector(1), 3)])
+        assert store.stats()["queued"] == 1 and store.get("m", text_digest("a")) is None
+        await store.close()
+
+    asyncio.run(run())
+    assert store.writes == 1 and store.stats()["queued"] == 0
+
+
+def test_changed_model_discards_store(tmp_path):
+    store = PersistentEmbeddingStore(str(tmp_path / "store"))
+    store.open_model("m", model_file(tmp_path))
+    store.put_many("m", [(text_digest("a"), vector(1), 3)])
+    asyncio.run(store.close())
+
+    reopened = PersistentEmbeddingStore(str(tmp_path / "store"))
+    reopened.open_model("m", model_file(tmp_path, b"different weights"))
+    assert reopened.get("m", text_digest("a")) is None
+
+
+def test_torn_index_record_is_dropped(tmp_path):
+    store = ModelStore(tmp_path / "m", "fingerprint", max_bytes=1 << 20)
+    store.open()
+    store.put_many([(text_digest(str(i)), vector(i), i) for i in range(3)])
+    store.close()
+    # A crash mid-append leaves half a record at the end of the index
+    index_path = tmp_path / "m" / "index-0.bin"
+    with open(index_path, "ab") as f:
+        f.write(INDEX_RECORD.pack(text_digest("torn"), 3, 1)[:10])
+
+    reopened = ModelStore(tmp_path / "m", "fingerprint", max_bytes=1 << 20)
+    reopened.open()
+    assert reopened.rows == 3
+    assert index_path.stat().st_size == 3 * INDEX_RECORD.size
+    stored, tokens = reopened.get(text_digest("2"))
+    np.testing.assert_array_equal(stored, vector(2))
+    assert tokens == 2 and reopened.get(text_digest("torn")) is None
+    # Appends continue on a record boundary
+    reopened.put_many([(text_digest("3"), vector(3), 3)])
+    assert reopened.get(text_digest("3"))[1] == 3
+
+
+def test_index_pointing_past_the_arena_resets(tmp_path):
+    store = ModelStore(tmp_path / "m", "fingerprint", max_bytes=1 << 20)
+    store.open()
+    store.put_many([(text_digest("a"), vector(1), 1)])
+    store.close()
+    with open(tmp_path / "m" / "index-0.bin", "ab") as f:
+        f.write(INDEX_RECORD.pack(text_digest("b"), 0, 1) * INITIAL_CAPACITY)
+
+    reopened = ModelStore(tmp_path / "m", "fingerprint", max_bytes=1 << 20)
+    reopened.open()
+    assert reopened.rows == 0 and reopened.get(text_digest("a")) is None
+
+
+def test_compaction_keeps_newest_live_vectors(tmp_path):
+    dim = 8
+    max_rows = INITIAL_CAPACITY + 200
+    store = ModelStore(tmp_path / "m", "fingerprint", max_bytes=max_rows * dim * 4)
+    store.open()
+    total = max_rows + 100
+    for start in range(0, total, 100):
+        store.put_many([(text_digest(str(i)), vector(i), i) for i in range(start, start + 100)])
+    assert store.compactions == 1
+    assert store.generation == 1 and store.rows <= max_rows
+    assert not (tmp_path / "m" / "vectors-0.f32").exists()
+    # The oldest entries were dropped, the newest kept with their counts
+    assert store.get(text_digest("0")) is None
+    stored, tokens = store.get(text_digest(str(total - 1)))
+    np.testing.assert_array_equal(stored, vector(total - 1))
+    assert tokens == total - 1
+    store.close()
+
+    reopened = ModelStore(tmp_path / "m", "fingerprint", max_bytes=max_rows * dim * 4)
+    reopened.open()
+    assert reopened.generation == 1 and len(reopened.index) == len(store.index)
@@ -0,0 +1,102 @@
+import struct
+
+import numpy as np
+import pytest
+
+from matryoshka import ModelDimensions, model_dimensions, read_gguf_metadata, truncate
+
+
+def _string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack("<Q", len(data)) + data
+
+
+def write_gguf(path, metadata):
+    """Minimal GGUF v3 header: no tensors, the given (key, type, payload) entries"""
+    body = b"GGUF" + struct.pack("<IQQ", 3, 0, len(metadata))
+    for key, value_type, payload in metadata:
+        body += _string(key) + struct.pack("<I", value_type) + payload
+    path.write_bytes(body)
+
+
+def nomic_gguf(path, embedding_length=768):
+    write_gguf(path, [
+        ("general.architecture", 8, _string("nomic-bert")),
+        ("general.name", 8, _string("nomic-embed-text-v1.5")),
+        # uint32 array, skipped without decoding
+        ("tokenizer.ggml.token_type", 9, struct.pack("<IQ", 4, 3) + struct.pack("<3I", 1, 2, 3)),
+        ("nomic-bert.embedding_length", 4, struct.pack("<I", embedding_length)),
+    ])
+
+
+def test_read_gguf_metadata(tmp_path):
+    path = tmp_path / "model.gguf"
+    nomic_gguf(path)
+    metadata = read_gguf_metadata(str(path))
+    assert metadata == {
+        "general.architecture": "nomic-bert",
+        "general.name": "nomic-embed-text-v1.5",
+        "nomic-bert.embedding_length": 768,
+    }
+
+
+def test_read_gguf_metadata_stops_when_done(tmp_path):
+    path = tmp_path / "model.gguf"
+    nomic_gguf(path)
+    assert read_gguf_metadata(str(path), lambda meta: "general.architecture" in meta) == {
+        "general.architecture": "nomic-bert"
+    }
+
+
+def test_read_gguf_metadata_rejects_other_files(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"PK\x03\x04")
+    with pytest.raises(ValueError):
+        read_gguf_metadata(str(path))
+    path.write_bytes(b"GGUF" + struct.pack("<I", 3))
+    with pytest.raises(ValueError):
+        read_gguf_metadata(str(path))
+
+
+def test_model_dimensions_from_metadata(tmp_path):
+    path = tmp_path / "renamed.gguf"
+    nomic_gguf(path)
+    dims = model_dimensions(str(path))
+    assert dims == ModelDimensions(768, (768, 512, 256, 128, 64), True)
+
+
+def test_model_dimensions_unknown_model(tmp_path):
+    path = tmp_path / "plain.gguf"
+    write_gguf(path, [("general.architecture", 8, _string("bert")), ("bert.embedding_length", 4, struct.pack("<I", 384))])
+    dims = model_dimensions(str(path))
+    assert dims.native == 384 and dims.allowed == (384,)
+    assert dims.check(384) is None
+    with pytest.raises(ValueError):
+        dims.check(128)
+
+
+def test_check_matryoshka_sizes():
+    dims = ModelDimensions(768, (768, 256), False)
+    assert dims.check(None) is None
+    assert dims.check(256) == 256
+    with pytest.raises(ValueError):
+        dims.check(300)
+
+
+def test_truncate_renormalizes_and_keeps_missing():
+    vector = np.array([3.0, 4.0, 12.0], dtype=np.float32)
+    result = truncate([vector, None], ModelDimensions(3, (3, 2)), 2)
+    np.testing.assert_allclose(result[0], [0.6, 0.8], rtol=1e-6)
+    assert result[1] is None
+
+
+def test_truncate_native_size_is_untouched():
+    vectors = [np.ones(3, dtype=np.float32)]
+    assert truncate(vectors, ModelDimensions(3), None) is vectors
+
+
+def test_truncate_layer_norm_before_cut():
+    vector = np.array([1.0, 2.0, 3.0, 4.0], dtype=np.float32)
+    result = truncate([vector], ModelDimensions(4, (4, 2), True), 2)[0]
+    centered = (vector - vector.mean()) / np.sqrt(vector.var() + 1e-5)
+    np.testing.assert_allclose(result, centered[:2] / np.linalg.norm(centered[:2]), rtol=1e-5)
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from prewarm import UsageHistory
+
+MORNING = datetime(2026, 3, 10, 9, 5)
+
+
+def history(path=None, **kwargs):
+    return UsageHistory(str(path) if path else None, days=7, min_fraction=0.5, **kwargs)
+
+
+def test_predicts_an_hour_used_on_most_recent_days():
+    usage = history()
+    for days_ago in (1, 2, 3):
+        usage.record("embed", MORNING - timedelta(days=days_ago))
+    assert usage.expected("embed", MORNING)
+    assert not usage.expected("embed", MORNING.replace(hour=15))
+    assert usage.predicted(["embed", "other"], MORNING) == ["embed"]
+
+
+def test_only_days_since_first_seen_count():
+    usage = history()
+    usage.record("embed", MORNING - timedelta(days=1))
+    assert usage.fraction("embed", 9, MORNING.date()) == 1.0
+
+
+def test_today_does_not_predict_itself():
+    usage = history()
+    usage.record("embed", MORNING)
+    assert not usage.expected("embed", MORNING)
+
+
+def test_lead_time_looks_into_the_next_hour():
+    usage = history(lead_minutes=15)
+    usage.record("embed", MORNING.replace(hour=10) - timedelta(days=1))
+    assert usage.expected("embed", MORNING.replace(minute=50))
+    assert not usage.expected("embed", MORNING.replace(minute=30))
+
+
+def test_save_and_reload(tmp_path):
+    path = tmp_path / "usage.json"
+    usage = history(path)
+    usage.record("embed", datetime.now() - timedelta(days=1))
+    usage.save()
+    assert not usage.dirty
+    assert history(path).hours == usage.hours
+
+
+def test_unreadable_history_is_ignored(tmp_path):
+    path = tmp_path / "usage.json"
+    path.write_text("{not json")
+    assert history(path).hours == {}
@@ -0,0 +1,225 @@
+"""
+ReplicaPool routing, scaling and restart backoff, with stand-in replicas
+instead of llama-server processes
+"""
+
+import time
+import asyncio
+import itertools
+
+import pytest
+
+import llama_server_wrapper_fixed as wrapper
+from llama_server_wrapper_fixed import LlamaServerProcess, ModelConfig, ReplicaPool
+from residency import OverBudgetError
+
+
+class FakeReplica:
+    start_delay = 0.0
+
+    def __init__(self, port):
+        self.port = port
+        self.running = False
+        self.in_flight = 0
+        self.failures = 0
+        self.starts = 0
+
+    async def start(self):
+        self.starts += 1
+        await asyncio.sleep(self.start_delay)
+        self.running = True
+        return True
+
+    async def stop(self):
+        self.running = False
+
+    def is_running(self):
+        return self.running
+
+    def can_restart(self):
+        return True
+
+    def load(self):
+        return self.in_flight
+
+
+def make_pool(monkeypatch, replicas=1, make_room=None, ensure=None):
+    config = ModelConfig(path="/models/m.gguf", name="embedding_m", type="embedding", port=8001)
+    ports = itertools.count(9001)
+    released = []
+    pool = ReplicaPool(config, lambda: next(ports), released.append, replicas=replicas, make_room=make_room, ensure=ensure)
+    monkeypatch.setattr(pool, "_new_replica", lambda: FakeReplica(
+        config.port if config.port not in {r.port for r in pool.replicas + pool.draining} else next(ports)
+    ))
+    return pool, released
+
+
+def test_pick_routes_to_least_loaded(monkeypatch):
+    async def run():
+        pool, _ = make_pool(monkeypatch, replicas=3)
+        assert await pool.start()
+        pool.replicas[0].in_flight = 2
+        pool.replicas[1].in_flight = 0
+        pool.replicas[2].in_flight = 1
+        return pool, await pool._pick()
+
+    pool, picked = asyncio.run(run())
+    assert picked is pool.replicas[1]
+    assert [replica.port for replica in pool.replicas] == [8001, 9001, 9002]
+
+
+def test_scale_down_drains_before_stopping(monkeypatch):
+    monkeypatch.setattr(wrapper, "REPLICA_DRAIN_TIMEOUT", 5)
+
+    async def run():
+        pool, released = make_pool(monkeypatch, replicas=3)
+        await pool.start()
+        busy = pool.replicas[2]
+        busy.in_flight = 1
+        await pool.scale(1)
+        await asyncio.sleep(0.05)
+        assert len(pool.replicas) == 1 and pool.draining == [busy] and busy.running
+        busy.in_flight = 0
+        await asyncio.sleep(0.2)
+        return pool, released, busy
+
+    pool, released, busy = asyncio.run(run())
+    assert pool.draining == [] and not busy.running
+    assert sorted(released) == [9001, 9002]
+
+
+def test_scale_up_starts_new_replicas(monkeypatch):
+    async def run():
+        pool, _ = make_pool(monkeypatch)
+        await pool.start()
+        await pool.scale(3)
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.target == 3 and all(replica.running for replica in pool.replicas)
+    assert len(pool.replicas) == 3
+
+
+def test_crashed_replica_restarts_in_background(monkeypatch):
+    rooms = []
+
+    async def make_room(replicas):
+        rooms.append(replicas)
+
+    async def run():
+        pool, _ = make_pool(monkeypatch, replicas=2, make_room=make_room)
+        await pool.start()
+        crashed = pool.replicas[0]
+        crashed.running = False
+        # The request goes to the survivor; the relaunch happens after it
+        assert await pool._pick() is pool.replicas[1]
+        await pool._restarting
+        return crashed
+
+    crashed = asyncio.run(run())
+    assert rooms == [1] and crashed.running and crashed.starts == 2
+
+
+def test_cold_pick_starts_through_the_manager(monkeypatch):
+    ensured = []
+    fits = True
+
+    async def ensure():
+        # Stands in for the manager's budgeted start
+        ensured.append(pool.config.name)
+        if not fits:
+            raise OverBudgetError("no room")
+        await pool.start()
+        return pool
+
+    async def run():
+        nonlocal fits
+        picked = await pool._pick()
+        assert picked is pool.replicas[0] and picked.running
+        picked.running = False
+        fits = False
+        with pytest.raises(OverBudgetError):
+            await pool._pick()
+        return picked
+
+    pool, _ = make_pool(monkeypatch, ensure=ensure)
+    replica = asyncio.run(run())
+    # Refused: the crashed replica was not relaunched behind the budget's back
+    assert ensured == ["embedding_m"] * 2 and not replica.running and replica.starts == 1
+
+
+def test_failed_start_backs_off(monkeypatch):
+    monkeypatch.setattr(wrapper, "REPLICA_RESTART_BACKOFF", 5)
+    launches = []
+
+    async def run():
+        config = ModelConfig(path="/models/m.gguf", name="embedding_m", type="embedding", port=8001)
+        replica = LlamaServerProcess(config)
+
+        async def launch():
+            launches.append(time.monotonic())
+            return False
+
+        monkeypatch.setattr(replica, "_launch", launch)
+        assert not await replica.start()
+        first_retry = replica.retry_at
+        # Within the backoff: no new launch
+        assert not await replica.start()
+        assert len(launches) == 1 and replica.failures == 1
+        replica.retry_at = 0.0
+        assert not await replica.start()
+        return replica, first_retry
+
+    replica, first_retry = asyncio.run(run())
+    assert len(launches) == 2 and replica.failures == 2
+    # Doubles per consecutive failure
+    assert first_retry - launches[0] <= 5.1 and replica.retry_at - launches[1] >= 9.9
+
+
+def test_concurrent_starts_share_one_launch(monkeypatch):
+    launches = []
+
+    async def run():
+        config = ModelConfig(path="/models/m.gguf", name="embedding_m", type="embedding", port=8001)
+        replica = LlamaServerProcess(config)
+
+        async def launch():
+            launches.append(replica.port)
+            await asyncio.sleep(0.05)
+            return True
+
+        monkeypatch.setattr(replica, "_launch", launch)
+        # A started replica counts as running once its process is healthy
+        monkeypatch.setattr(replica, "is_running", lambda: False)
+        return await asyncio.gather(*(replica.start() for _ in range(5)))
+
+    assert asyncio.run(run()) == [True] * 5
+    assert launches == [8001]
+
+
+def test_concurrent_pool_starts_share_one_attempt(monkeypatch):
+    monkeypatch.setattr(FakeReplica, "start_delay", 0.02)
+
+    async def run():
+        pool, _ = make_pool(monkeypatch, replicas=2)
+        started = await asyncio.gather(*(pool.start() for _ in range(4)))
+        return pool, started
+
+    pool, started = asyncio.run(run())
+    assert started == [True] * 4
+    assert [replica.starts for replica in pool.replicas] == [1, 1]
+
+
+def test_cancelled_caller_does_not_abort_the_start(monkeypatch):
+    monkeypatch.setattr(FakeReplica, "start_delay", 0.05)
+
+    async def run():
+        pool, _ = make_pool(monkeypatch)
+        waiter = asyncio.create_task(pool.start())
+        other = asyncio.create_task(pool.start())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return pool, await other
+
+    pool, started = asyncio.run(run())
+    assert started and pool.is_running() and pool.replicas[0].starts == 1
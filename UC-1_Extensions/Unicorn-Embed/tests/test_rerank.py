@@ -0,0 +1,91 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import rerank
+from rerank import cascade, cascade_cutoff, cross_encode, truncate_document
+
+
+class FakeReranker:
+    """Scores documents by length; rejects any batch holding a document over max_chars"""
+
+    def __init__(self, monkeypatch, max_chars=1000):
+        self.max_chars = max_chars
+        self.batches = []
+        monkeypatch.setattr(rerank, "_score_batch", self.score)
+
+    async def score(self, base_url, query, documents, timeout):
+        self.batches.append(list(documents))
+        if any(len(doc) > self.max_chars for doc in documents):
+            raise ValueError("input is too large to process")
+        return [float(len(doc)) for doc in documents]
+
+
+def test_truncate_document_fits_pair_budget():
+    assert truncate_document("q", "short", 64) == "short"
+    trimmed = truncate_document("query", "x" * 10_000, 64)
+    assert len(trimmed) == (64 - 3 - rerank.PAIR_SPECIAL_TOKENS) * rerank.CHARS_PER_TOKEN
+
+
+def test_cross_encode_keeps_input_order(monkeypatch):
+    backend = FakeReranker(monkeypatch)
+    scores = asyncio.run(cross_encode("http://backend", "q", ["aaa", "a", "aa"], pair_batch=2))
+    assert scores.tolist() == [3.0, 1.0, 2.0]
+    assert backend.batches == [["aaa", "a"], ["aa"]]
+
+
+def test_failed_batch_retries_pairs_and_shrinks_only_the_bad_one(monkeypatch):
+    backend = FakeReranker(monkeypatch, max_chars=100)
+    scores = asyncio.run(cross_encode("http://backend", "q", ["ok", "y" * 300], max_pair_tokens=4096))
+    assert scores.tolist() == [2.0, 75.0]
+    assert backend.batches == [["ok", "y" * 300], ["ok"], ["y" * 300], ["y" * 150], ["y" * 75]]
+
+
+def test_pair_still_failing_after_shrinking_raises(monkeypatch):
+    FakeReranker(monkeypatch, max_chars=0)
+    with pytest.raises(ValueError):
+        asyncio.run(cross_encode("http://backend", "q", ["long document"]))
+
+
+def test_no_documents():
+    assert asyncio.run(cross_encode("http://backend", "q", [])).shape == (0,)
+
+
+def test_cascade_cutoff_fixed():
+    scores = np.array([0.9, 0.1, 0.5], dtype=np.float32)
+    assert cascade_cutoff(scores, top_n=2) == 2
+    assert cascade_cutoff(scores, top_n=10) == 3
+
+
+def test_cascade_cutoff_gap_keeps_close_leaders():
+    scores = np.array([0.90, 0.88, 0.50, 0.10], dtype=np.float32)
+    assert cascade_cutoff(scores, top_n=4, gap=0.05) == 2
+
+
+def test_cascade_cutoff_gap_clamped_to_min_and_top_n():
+    scores = np.array([0.9, 0.2, 0.1], dtype=np.float32)
+    assert cascade_cutoff(scores, top_n=3, min_n=2, gap=0.01) == 2
+    assert cascade_cutoff(np.ones(5, dtype=np.float32), top_n=3, gap=1.0) == 3
+
+
+def test_cascade_cutoff_no_candidates():
+    assert cascade_cutoff(np.array([], dtype=np.float32), top_n=5, gap=0.1) == 0
+
+
+def test_cascade_cross_encodes_only_survivors():
+    seen = []
+
+    async def prefilter(query, documents):
+        return np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+
+    async def cross_encoder(query, documents):
+        seen.append(documents)
+        return np.array([1.0 if doc == "c" else 0.0 for doc in documents], dtype=np.float32)
+
+    order, scores, info = asyncio.run(cascade("q", ["a", "b", "c", "d"], prefilter, cross_encoder, top_n=3))
+    assert seen == [["b", "d", "c"]]
+    # Survivors by cross-encoder score first, then the rest by prefilter score
+    assert order.tolist() == [2, 1, 3, 0]
+    assert scores.tolist() == pytest.approx([0.1, 0.0, 1.0, 0.0])
+    assert info["candidates"] == 4 and info["survivors"] == 3
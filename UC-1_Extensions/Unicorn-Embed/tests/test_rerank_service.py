@@ -0,0 +1,38 @@
+"""
+Standalone rerank service, called in-process with its backends stubbed out
+"""
+
+import asyncio
+
+import httpx
+
+import rerank_service
+
+
+def test_failed_scoring_cancels_the_usage_count(monkeypatch):
+    counts = []
+
+    async def count(texts):
+        counts.append(asyncio.current_task())
+        await asyncio.sleep(60)
+
+    async def score(query, documents):
+        await asyncio.sleep(0)
+        raise RuntimeError("reranker down")
+
+    monkeypatch.setattr(rerank_service.tokenizers[rerank_service.RERANKER_URL], "count", count)
+    monkeypatch.setattr(rerank_service, "score_cross_encoder", score)
+
+    async def run():
+        transport = httpx.ASGITransport(app=rerank_service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://rerank") as client:
+            response = await client.post("/v1/rerank", json={
+                "model": "bge", "query": "q", "documents": ["a", "b"], "mode": "cross_encoder",
+            })
+        await asyncio.sleep(0)
+        # Checked before asyncio.run cancels whatever is left over
+        return response, [task.cancelled() for task in counts]
+
+    response, cancelled = asyncio.run(run())
+    assert response.status_code == 500 and "reranker down" in response.json()["detail"]
+    assert cancelled == [True]
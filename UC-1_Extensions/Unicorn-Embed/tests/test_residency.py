@@ -0,0 +1,46 @@
+from residency import ResidencyManager
+
+RESIDENT = {"busy": ("/missing/busy.gguf", 400.0), "idle": ("/missing/idle.gguf", 400.0)}
+
+
+def manager(budget_mb=1000):
+    residency = ResidencyManager(budget_mb)
+    for _ in range(10):
+        residency.touch("busy")
+    return residency
+
+
+def test_fits_without_eviction():
+    assert manager().choose_victims(RESIDENT, needed_mb=100) == ([], True)
+
+
+def test_evicts_least_valuable_first():
+    assert manager().choose_victims(RESIDENT, needed_mb=400) == (["idle"], True)
+
+
+def test_predicted_hot_models_go_last():
+    victims, fits = manager().choose_victims(RESIDENT, needed_mb=400, hot={"idle"})
+    assert (victims, fits) == (["busy"], True)
+
+
+def test_evicts_as_many_as_needed():
+    victims, fits = manager().choose_victims(RESIDENT, needed_mb=900)
+    assert victims == ["idle", "busy"] and fits
+
+
+def test_protected_models_are_never_chosen():
+    assert manager().choose_victims(RESIDENT, needed_mb=400, protected={"idle"}) == (["busy"], True)
+    assert manager().choose_victims(RESIDENT, needed_mb=900, protected={"idle"}) == ([], False)
+
+
+def test_no_budget_never_evicts():
+    assert manager(budget_mb=None).choose_victims(RESIDENT, needed_mb=10**6) == ([], True)
+
+
+def test_footprint_prefers_observed_rss(tmp_path):
+    model = tmp_path / "m.gguf"
+    model.write_bytes(b"\0" * 1024 * 1024)
+    residency = ResidencyManager(1000, overhead_mb=10)
+    assert residency.footprint_mb("m", str(model)) == 11
+    residency.observe_rss("m", 50)
+    assert residency.footprint_mb("m", str(model)) == 50
@@ -0,0 +1,47 @@
+"""
+NDJSON parsing and in-order result framing of the streaming endpoint
+"""
+
+import json
+import asyncio
+
+from streaming import iter_ndjson, stream_embeddings
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def collect(stream):
+    async def run():
+        return [item async for item in stream]
+    return asyncio.run(run())
+
+
+def test_iter_ndjson_splits_across_chunks():
+    chunks = [b'{"id": 1, "te', b'xt": "a"}\n\n[1]\n{"id": 2}\n', b'{"input": "tail"}']
+    records = collect(iter_ndjson(_aiter(chunks)))
+    assert records == [
+        (1, 1, "a", None),
+        (3, None, None, "expected a JSON object"),
+        (4, 2, None, "missing 'text' string"),
+        (5, 5, "tail", None),
+    ]
+
+
+def test_stream_keeps_order_and_reports_failures():
+    calls = []
+
+    async def embed(texts):
+        calls.append(texts)
+        vectors = [None if text == "bad" else [float(len(text))] for text in texts]
+        return vectors, [len(text) for text in texts]
+
+    records = [(1, "a", "one", None), (2, "b", "bad", None), (3, "c", None, "invalid JSON"), (4, "d", "four", None)]
+    body = b"".join(collect(stream_embeddings(_aiter(records), embed, chunk_size=2)))
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert calls == [["one", "bad"], ["four"]]
+    assert [line.get("id") for line in lines[:-1]] == ["a", "b", "c", "d"]
+    assert lines[1]["error"] == "embedding failed" and lines[3]["embedding"] == [4.0]
+    assert lines[-1] == {"object": "summary", "count": 4, "failed": 2, "prompt_tokens": 3 + 4}
@@ -0,0 +1,71 @@
+import asyncio
+
+import tokenization
+from tokenization import estimate_tokens
+from tokenization import TokenCounter
+
+
+class FakeTokenizer:
+    """Replaces upstream.post_json: one token per word plus BOS/EOS"""
+
+    def __init__(self, monkeypatch, fail=False, delay=0.0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+        monkeypatch.setattr(tokenization.upstream, "post_json", self)
+
+    async def __call__(self, base_url, path, body, timeout=None):
+        self.calls.append(body["content"])
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("backend down")
+        return {"tokens": list(range(len(body["content"].split()) + 2))}
+
+
+def test_counts_are_memoized(monkeypatch):
+    backend = FakeTokenizer(monkeypatch)
+    counter = TokenCounter("http://backend")
+
+    async def run():
+        first = await counter.count(["a b c", "d"])
+        second = await counter.count(["d", "a b c", "d"])
+        return first, second
+
+    assert asyncio.run(run()) == ([5, 3], [3, 5, 3])
+    assert backend.calls == ["a b c", "d"]
+    assert counter.stats() == {"entries": 2, "hits": 3, "misses": 2, "fallbacks": 0}
+
+
+def test_concurrent_callers_share_one_lookup(monkeypatch):
+    backend = FakeTokenizer(monkeypatch, delay=0.02)
+    counter = TokenCounter("http://backend")
+
+    async def run():
+        return await asyncio.gather(counter.count(["same text"]), counter.count(["same text", "same text"]))
+
+    assert asyncio.run(run()) == [[4], [4, 4]]
+    assert backend.calls == ["same text"]
+
+
+def test_failure_falls_back_to_estimate_without_caching(monkeypatch):
+    backend = FakeTokenizer(monkeypatch, fail=True)
+    counter = TokenCounter("http://backend")
+    text = "x" * 40
+    assert asyncio.run(counter.count([text])) == [estimate_tokens(text)]
+    assert asyncio.run(counter.count([text], fallback=False)) == [None]
+    assert counter.stats()["fallbacks"] == 2 and counter.stats()["entries"] == 0
+    backend.fail = False
+    assert asyncio.run(counter.count([text])) == [3]
+
+
+def test_cache_is_bounded_lru(monkeypatch):
+    FakeTokenizer(monkeypatch)
+    counter = TokenCounter("http://backend", max_entries=2)
+
+    async def run():
+        await counter.count(["a", "b"])
+        await counter.count(["a"])
+        await counter.count(["c"])
+
+    asyncio.run(run())
+    assert set(counter.counts) == {TokenCounter._key("a"), TokenCounter._key("c")}
@@ -0,0 +1,153 @@
+import asyncio
+
+from upstream import BackendSlots, UpstreamPool, _parse_backend_limits
+
+
+async def start_backend(delay: float = 0.05):
+    """Minimal keep-alive HTTP backend that records its peak number of open connections"""
+    stats = {"open": 0, "peak": 0, "requests": 0}
+
+    async def handle(reader, writer):
+        stats["open"] += 1
+        stats["peak"] = max(stats["peak"], stats["open"])
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                length = next(
+                    (int(line.split(b":")[1]) for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")),
+                    0,
+                )
+                await reader.readexactly(length)
+                stats["requests"] += 1
+                await asyncio.sleep(delay)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{}')
+                await writer.drain()
+        finally:
+            stats["open"] -= 1
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}", stats
+
+
+def test_parse_backend_limits():
+    assert _parse_backend_limits(" 9991=64, localhost:9992=8,,bad, x=y ") == {"9991": 64, "localhost:9992": 8}
+
+
+def test_limit_lookup_prefers_host_and_port():
+    pool = UpstreamPool(max_connections=32, backend_limits={"9991": 4, "localhost:9991": 2})
+    assert pool._limit_for("http://localhost:9991") == 2
+    assert pool._limit_for("http://127.0.0.1:9991") == 4
+    assert pool._limit_for("http://localhost:9992") == 32
+    pool.set_backend_limit("http://localhost:9992/", 6)
+    assert pool._limit_for("http://localhost:9992") == 6
+
+
+def test_one_client_per_backend():
+    async def run():
+        pool = UpstreamPool()
+        client = pool.client("http://localhost:9991/")
+        assert pool.client("http://localhost:9991") is client
+        assert pool.client("http://localhost:9992") is not client
+        await pool.aclose()
+        assert pool.clients == {}
+        reopened = pool.client("http://localhost:9991")
+        assert reopened is not client and not reopened.is_closed
+        await pool.aclose()
+
+    asyncio.run(run())
+
+
+def test_backend_limit_caps_open_connections():
+    async def run():
+        server, base_url, stats = await start_backend()
+        pool = UpstreamPool(max_connections=32, backend_limits={base_url.split("//")[1]: 2})
+        try:
+            results = await asyncio.gather(*(pool.post_json(base_url, "/embedding", {"i": i}) for i in range(8)))
+        finally:
+            await pool.aclose()
+            server.close()
+            await server.wait_closed()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert results == [{}] * 8
+    assert stats["requests"] == 8 and stats["peak"] == 2
+
+
+def run_on_slots(slots: BackendSlots, tasks: int, hold: float = 0.02):
+    async def work():
+        async with slots:
+            await asyncio.sleep(hold)
+
+    async def run():
+        await asyncio.gather(*(work() for _ in range(tasks)))
+
+    asyncio.run(run())
+
+
+def test_backend_slots_cap_concurrency():
+    slots = BackendSlots(3)
+    run_on_slots(slots, 10)
+    stats = slots.stats()
+    assert stats["peak_busy"] == 3 and stats["requests"] == 10
+    assert stats["busy"] == 0 and stats["waiting"] == 0
+    assert 0 < stats["utilization"] <= 1
+
+
+def test_backend_slots_count_waiters():
+    async def run():
+        slots = BackendSlots(1)
+        await slots.acquire()
+        waiter = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        waiting = slots.stats()["waiting"]
+        slots.release()
+        await waiter
+        return slots, waiting
+
+    slots, waiting = asyncio.run(run())
+    assert waiting == 1 and slots.busy == 1 and slots.peak_busy == 1
+
+
+def test_backend_slots_resize_while_busy():
+    async def run():
+        slots = BackendSlots(3)
+        for _ in range(3):
+            await slots.acquire()
+        # Shrinking with every slot held retires permits as they come back
+        await slots.resize(1)
+        slots.release()
+        slots.release()
+        third = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0.01)
+        blocked = not third.done()
+        slots.release()
+        await third
+        # Growing again hands out new permits at once
+        await slots.resize(3)
+        await asyncio.wait_for(slots.acquire(), 0.1)
+        await asyncio.wait_for(slots.acquire(), 0.1)
+        return slots, blocked
+
+    slots, blocked = asyncio.run(run())
+    assert blocked and slots.busy == 3 and slots.slots == 3
+
+
+def test_backend_slots_shrink_when_idle():
+    async def run():
+        slots = BackendSlots(4)
+        await slots.resize(2)
+        await slots.acquire()
+        await slots.acquire()
+        third = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0.01)
+        done = third.done()
+        third.cancel()
+        return done
+
+    assert asyncio.run(run()) is False
+
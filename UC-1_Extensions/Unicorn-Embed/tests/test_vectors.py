@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from vectors import (
+    BINARY_HEADER,
+    encode_base64,
+    format_embedding,
+    pack_matrix,
+    rank_results,
+    top_k_indices,
+    unpack_matrix,
+)
+
+
+def test_pack_matrix_round_trip():
+    vectors = [np.arange(4, dtype=np.float32), np.ones(4, dtype=np.float64)]
+    payload = pack_matrix(vectors)
+    assert len(payload) == BINARY_HEADER.size + 2 * 4 * 4
+    matrix = unpack_matrix(payload)
+    assert matrix.dtype == np.dtype("<f4")
+    np.testing.assert_array_equal(matrix, np.stack(vectors).astype(np.float32))
+
+
+def test_pack_matrix_empty():
+    assert unpack_matrix(pack_matrix([])).shape == (0, 0)
+
+
+def test_unpack_matrix_rejects_foreign_payload():
+    payload = bytearray(pack_matrix([np.zeros(2)]))
+    payload[:4] = b"NOPE"
+    with pytest.raises(ValueError):
+        unpack_matrix(bytes(payload))
+
+
+def test_base64_is_little_endian_float32():
+    assert encode_base64([1.0]) == "AACAPw=="
+    assert format_embedding(np.array([1.0]), "base64") == "AACAPw=="
+    assert format_embedding(np.array([0.5], dtype=np.float64)) == [0.5]
+
+
+def test_top_k_indices_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert top_k_indices(scores, 2).tolist() == [1, 3]
+    assert top_k_indices(scores).tolist() == [1, 3, 2, 0]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 2, 0]
+
+
+def test_rank_results_documents_and_top_k():
+    scores = np.array([0.2, 0.8, 0.5], dtype=np.float32)
+    results = rank_results(scores, ["a", "b", "c"], top_k=2)
+    assert results == [
+        {"index": 1, "document": "b", "relevance_score": pytest.approx(0.8)},
+        {"index": 2, "document": "c", "relevance_score": pytest.approx(0.5)},
+    ]
+    assert rank_results(scores, ["a", "b", "c"], return_documents=False, order=np.array([0, 2, 1]))[0] == {
+        "index": 0, "relevance_score": pytest.approx(0.2),
+    }
@@ -0,0 +1,182 @@
+"""
+Endpoints of the fixed-port wrapper, with benchmarks/fake_llama_server.py
+standing in for llama-server (no GPU or model files needed)
+"""
+
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from vectors import BINARY_MEDIA_TYPE, unpack_matrix
+from wrapper_server import serve_wrapper
+
+
+def _all_ready(client):
+    response = client.get("/ready")
+    models = response.json()["models"].values()
+    return response.status_code == 200 and all(model["state"] == "ready" for model in models)
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    models_dir = tmp_path_factory.mktemp("models")
+    (models_dir / "embeddings").mkdir()
+    (models_dir / "rerankers").mkdir()
+    (models_dir / "embeddings" / "nomic-embed-text-v1.5.Q8_0.gguf").write_bytes(b"not a real model")
+    (models_dir / "rerankers" / "bge-reranker-v2-m3-Q8_0.gguf").write_bytes(b"not a real model")
+    # Scrape the backends on every /metrics request, and hold batches open
+    # long enough for concurrent requests to share one
+    env = {"BACKEND_METRICS_MAX_AGE": "0", "EMBED_BATCH_WAIT_MS": "200"}
+    with serve_wrapper("llama_server_wrapper", models_dir, _all_ready, env) as client:
+        yield client
+
+
+def embed(client, **body):
+    response = client.post("/v1/embeddings", json={"model": "nomic", **body})
+    assert response.status_code == 200
+    return response
+
+
+def test_embeddings_in_input_order_with_usage(client):
+    data = embed(client, input=["the quick fox", "hello", "the quick fox"]).json()
+    vectors = [item["embedding"] for item in data["data"]]
+    assert [item["index"] for item in data["data"]] == [0, 1, 2]
+    assert len(vectors[0]) == 768 and vectors[0] == vectors[2] != vectors[1]
+    # The fake tokenizes one token per word plus BOS/EOS
+    assert data["usage"]["prompt_tokens"] == 5 + 3 + 5
+
+
+def test_simple_embeddings_endpoint(client):
+    vectors = client.post("/embeddings", json={"input": ["one", "two"]}).json()
+    assert len(vectors) == 2 and len(vectors[0]) == 768 and vectors[0] != vectors[1]
+
+
+def test_base64_and_binary_match_float(client):
+    floats = np.array(embed(client, input=["same text"]).json()["data"][0]["embedding"], dtype=np.float32)
+    encoded = embed(client, input=["same text"], encoding_format="base64").json()["data"][0]["embedding"]
+    np.testing.assert_array_equal(np.frombuffer(base64.b64decode(encoded), dtype="<f4"), floats)
+
+    response = embed(client, input=["same text"], encoding_format="binary")
+    assert response.headers["content-type"] == BINARY_MEDIA_TYPE
+    assert response.headers["x-prompt-tokens"] == "4"
+    np.testing.assert_array_equal(unpack_matrix(response.content)[0], floats)
+
+
+def test_embedding_stream(client):
+    lines = '{"id": "a", "text": "first"}\nnot json\n{"id": "b", "text": "second one"}\n'
+    response = client.post("/v1/embeddings/stream", content=lines)
+    assert response.status_code == 200
+    *results, summary = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    assert [result.get("id") for result in results] == ["a", None, "b"]
+    assert len(results[0]["embedding"]) == 768 and results[1]["line"] == 2
+    assert summary == {"object": "summary", "count": 3, "failed": 1, "prompt_tokens": 3 + 4}
+
+
+def test_rerank_cosine_and_top_k(client):
+    response = client.post("/v1/rerank", json={
+        "model": "bge",
+        "query": "red apple",
+        "documents": ["blue sky", "red apple", "green apple"],
+        "mode": "cosine",
+        "top_k": 2,
+        "return_documents": False,
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body["mode"] == "cosine" and len(body["results"]) == 2
+    # Identical text has the identical fake vector
+    assert body["results"][0] == {"index": 1, "relevance_score": pytest.approx(1.0, abs=1e-5)}
+
+
+def test_rerank_cross_encoder(client):
+    response = client.post("/v1/rerank", json={
+        "model": "bge",
+        "query": "red apple",
+        "documents": ["blue sky", "a red apple", "green apple"],
+        "mode": "cross_encoder",
+    })
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["index"] == 1 and results[0]["document"] == "a red apple"
+
+
+def test_rerank_cascade_reports_stages(client):
+    response = client.post("/v1/rerank", json={
+        "model": "bge",
+        "query": "red apple",
+        "documents": ["blue sky", "red apple", "green apple", "apple pie"],
+        "mode": "cascade",
+        "cascade_top_n": 2,
+    })
+    body = response.json()
+    assert body["cascade"]["candidates"] == 4 and body["cascade"]["survivors"] == 2
+    assert sorted(result["index"] for result in body["results"]) == [0, 1, 2, 3]
+
+
+def test_cached_texts_are_still_billed(client):
+    first = embed(client, input=["billed twice please"]).json()
+    second = embed(client, input=["billed twice please"]).json()
+    assert first["usage"] == second["usage"] == {"prompt_tokens": 5, "total_tokens": 5}
+
+
+def test_requests_sharing_a_batch_are_billed_their_own_tokens(client):
+    sent = client.get("/health").json()["batching"]["embedding"]["batches_sent"]
+    # Ten tokens with the fake's tokenizer, though a quarter of the length in
+    # characters is less than for the single long word, which is three
+    texts = ["a a a a a a a a", "supercalifragilisticexpialidocious"]
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(pool.map(lambda text: embed(client, input=[text]).json(), texts))
+    assert client.get("/health").json()["batching"]["embedding"]["batches_sent"] == sent + 1
+    assert [response["usage"]["prompt_tokens"] for response in responses] == [10, 3]
+
+
+def test_rerank_usage_counts_query_and_documents(client):
+    response = client.post("/v1/rerank", json={
+        "model": "bge",
+        "query": "red apple",
+        "documents": ["blue sky", "a red apple"],
+        "mode": "cross_encoder",
+    })
+    assert response.json()["usage"] == {"prompt_tokens": 4 + 4 + 5, "total_tokens": 13}
+
+
+def test_metrics_histograms(client):
+    embed(client, input=["measured text"])
+    body = client.get("/metrics").text
+    assert 'unicorn_embed_batch_size_count{model="nomic-embed-text-v1.5"}' in body
+    assert "unicorn_embed_upstream_latency_seconds_bucket" in body
+    assert "unicorn_embed_serialization_seconds_bucket" in body
+
+
+def test_backend_metrics_are_re_exported(client):
+    embed(client, input=["counted upstream"])
+    body = client.get("/metrics").text
+    assert 'unicorn_backend_up{model="nomic-embed-text-v1.5",replica="localhost:9991"} 1.0' in body
+    assert 'unicorn_backend_prompt_tokens_total{model="nomic-embed-text-v1.5",replica="localhost:9991"}' in body
+
+
+def test_health_and_ready(client):
+    assert client.get("/health").json()["models"] == {"embedding": "healthy", "reranker": "healthy"}
+    assert client.get("/live").json() == {"status": "alive"}
+    models = client.get("/ready").json()["models"]
+    assert set(models) == {"nomic-embed-text-v1.5", "bge-reranker-v2-m3"}
+    assert all(model["load_time_s"] >= 0 and model["error"] is None for model in models.values())
+
+
+
+def test_admin_logs(client):
+    backends = client.get("/admin/logs", params={"backend": "nomic-embed-text-v1.5"}).json()["backends"]
+    assert list(backends) == ["localhost:9991"]
+    assert backends["localhost:9991"]["running"] and backends["localhost:9991"]["lines"]
+    assert client.get("/admin/logs", params={"level": "debug"}).status_code == 400
+
+
+def test_matryoshka_dimensions(client):
+    vector = np.array(embed(client, input=["cut me"], dimensions=256).json()["data"][0]["embedding"])
+    assert vector.shape == (256,)
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5)
+    response = client.post("/v1/embeddings", json={"model": "nomic", "input": "x", "dimensions": 300})
+    assert response.status_code == 400
@@ -0,0 +1,27 @@
+"""
+Memory budget of the multi-model wrapper; its own module because the
+in-budget model takes the same backend port as in test_wrapper_fixed.py
+"""
+
+from wrapper_server import serve_wrapper
+
+
+def test_model_over_budget_is_refused(tmp_path):
+    (tmp_path / "embeddings").mkdir()
+    (tmp_path / "embeddings" / "small.gguf").write_bytes(b"not a real model")
+    # Sparse, so the budget estimate (GGUF size) is 2 GB without using the disk
+    with open(tmp_path / "embeddings" / "wide.gguf", "wb") as f:
+        f.truncate(2000 * 1024 * 1024)
+    env = {"PREWARM_INTERVAL": "0", "MEMORY_BUDGET_MB": "1000", "RESIDENCY_OVERHEAD_MB": "0"}
+    with serve_wrapper("llama_server_wrapper_fixed", tmp_path, lambda c: c.get("/health").status_code == 200, env) as client:
+        assert client.post("/v1/embeddings", json={"model": "embedding_small", "input": "fits"}).status_code == 200
+
+        response = client.post("/v1/embeddings", json={"model": "embedding_wide", "input": "too big"})
+        assert response.status_code == 503
+        assert "memory budget" in response.json()["detail"]
+        # Refused outright: nothing started for it and nothing evicted for it
+        residency = client.get("/admin/residency").json()
+        assert list(residency["models"]) == ["embedding_small"]
+        assert residency["decisions"][-1]["action"] == "over_budget"
+        assert residency["decisions"][-1]["model"] == "embedding_wide"
+        assert client.get("/health").json()["models"]["running"] == ["embedding_small"]
@@ -0,0 +1,67 @@
+"""
+Endpoints of the multi-model wrapper, with benchmarks/fake_llama_server.py
+standing in for llama-server; models start on first use
+"""
+
+import pytest
+
+from wrapper_server import serve_wrapper
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    models_dir = tmp_path_factory.mktemp("models")
+    (models_dir / "embeddings").mkdir()
+    (models_dir / "rerankers").mkdir()
+    for name in ("small", "large"):
+        (models_dir / "embeddings" / f"{name}.gguf").write_bytes(b"not a real model")
+    (models_dir / "rerankers" / "ranker.gguf").write_bytes(b"not a real model")
+    env = {"PREWARM_INTERVAL": "0", "MEMORY_BUDGET_MB": "0"}
+    with serve_wrapper("llama_server_wrapper_fixed", models_dir, lambda c: c.get("/health").status_code == 200, env) as client:
+        yield client
+
+
+def test_rerank_with_cross_encoder(client):
+    response = client.post("/v1/rerank", json={
+        "model": "reranker_ranker",
+        "query": "red apple",
+        "documents": ["blue sky", "a red apple"],
+    })
+    assert response.status_code == 200
+    assert response.json()["results"][0]["index"] == 1
+
+
+def test_rerank_with_embedding_model_falls_back_to_cosine(client):
+    body = {"model": "embedding_small", "query": "red apple", "documents": ["blue sky", "red apple"]}
+    response = client.post("/v1/rerank", json=body)
+    assert response.status_code == 200
+    assert response.json()["results"][0]["index"] == 1
+    response = client.post("/v1/rerank", json={**body, "mode": "cross_encoder"})
+    assert response.status_code == 400
+
+
+def test_models_are_listed(client):
+    names = {model["id"] for model in client.get("/v1/models").json()["data"]}
+    assert {"embedding_small", "embedding_large", "reranker_ranker"} <= names
+
+
+def test_embeddings_start_the_model_on_demand(client):
+    response = client.post("/v1/embeddings", json={"model": "embedding_small", "input": ["a b", "c"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["data"]) == 2 and len(body["data"][0]["embedding"]) == 768
+    assert body["usage"]["prompt_tokens"] == 4 + 3
+    assert client.get("/health").json()["replicas"]["embedding_small"]["replicas"]
+
+
+def test_unknown_model(client):
+    response = client.post("/v1/embeddings", json={"model": "embedding_missing", "input": "x"})
+    assert response.status_code == 500
+    assert "not found" in response.json()["detail"]
+
+
+def test_stopped_model_restarts_on_next_request(client):
+    assert client.post("/v1/embeddings", json={"model": "embedding_large", "input": "x"}).status_code == 200
+    assert client.post("/v1/models/embedding_large/stop").status_code == 200
+    response = client.post("/v1/embeddings", json={"model": "embedding_large", "input": "again"})
+    assert response.status_code == 200 and len(response.json()["data"]) == 1
@@ -0,0 +1,29 @@
+"""
+Startup of the fixed-port wrapper; its own module because the wrapper's
+backends take fixed ports, which the shared fixture in test_wrapper.py holds
+"""
+
+import time
+
+from wrapper_server import serve_wrapper
+
+
+def test_ready_waits_for_loading_backends(tmp_path):
+    (tmp_path / "embeddings").mkdir()
+    (tmp_path / "embeddings" / "nomic-embed-text-v1.5.Q8_0.gguf").write_bytes(b"not a real model")
+    # Backends answer 503 "Loading model" for their first two seconds; the
+    # wrapper itself is live at once
+    env = {"FAKE_LLAMA_STARTUP_S": "2"}
+    with serve_wrapper("llama_server_wrapper", tmp_path, lambda c: c.get("/live").status_code == 200, env) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["models"]["nomic-embed-text-v1.5"]["state"] == "loading"
+        deadline = time.monotonic() + 30
+        while client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.2)
+        models = client.get("/ready").json()["models"]
+        assert models["nomic-embed-text-v1.5"]["state"] == "ready"
+        assert models["nomic-embed-text-v1.5"]["load_time_s"] >= 2
+        # No reranker model file: reported, but the wrapper still serves embeddings
+        assert models["bge-reranker-v2-m3"]["state"] != "ready"
@@ -0,0 +1,76 @@
+"""
+Runs a wrapper as a real server for endpoint tests, with
+benchmarks/fake_llama_server.py standing in for llama-server
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+FAKE_LLAMA_SERVER = ROOT / "benchmarks" / "fake_llama_server.py"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve_wrapper(module: str, models_dir: Path, ready, env=None, timeout: float = 60):
+    """Run a wrapper under uvicorn against the fake llama-server; yields an httpx client"""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "MODELS_DIR": str(models_dir),
+        "LLAMA_SERVER_BIN": str(FAKE_LLAMA_SERVER),
+        "EMBED_STORE_DIR": "",
+        "LLAMA_PROFILE_DIR": "",
+        "USAGE_HISTORY_FILE": "",
+        "FAKE_LLAMA_LOG_TIMINGS": "0",
+        **(env or {}),
+    }
+    # Own process group, so the backends it launched go down with it
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            deadline = time.monotonic() + timeout
+            while True:
+                if process.poll() is not None:
+                    pytest.fail(f"{module} exited with {process.returncode}")
+                try:
+                    if ready(client):
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    pytest.fail(f"{module} not ready after {timeout}s")
+                time.sleep(0.2)
+            yield client
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Exact token counts from llama-server's /tokenize endpoint
+For batch packing and usage accounting, for paths that need exact token
+boundaries before embedding (chunking) and for texts that are not
+embedded (rerank usage). Counts are cached per text; the character
+estimate is the fallback when the backend cannot be asked.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from upstream import upstream
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio for English BPE/WordPiece vocabularies
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used when no tokenizer count is available
+
+    Dense text (CJK, code, digits) can take several times this many tokens.
+    """
+    return len(text) // CHARS_PER_TOKEN + 2  # + BOS/EOS
+
+
+class TokenCounter:
+    """Cached per-backend token counts (special tokens included)"""
+
+    def __init__(self, base_url: str, max_entries: int = 100_000, concurrency: int = 8, timeout: float = 10):
+        self.base_url = base_url
+        self.max_entries = max_entries
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._pending: Dict[bytes, asyncio.Future] = {}
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls, base_url: str) -> "TokenCounter":
+        return cls(
+            base_url,
+            max_entries=int(os.getenv("TOKENIZE_CACHE_ENTRIES", "100000")),
+            concurrency=int(os.getenv("TOKENIZE_CONCURRENCY", "8")),
+        )
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    async def tokenize(self, text: str, add_special: bool = True) -> List[int]:
+        """Token ids for one text, including BOS/EOS where the model adds them"""
+        async with self._semaphore:
+            data = await upstream.post_json(
+                self.base_url,
+                "/tokenize",
+                {"content": text, "add_special": add_special},
+                timeout=self.timeout,
+            )
+        return data.get("tokens", []) if isinstance(data, dict) else []
+
+    async def detokenize(self, tokens: List[int]) -> str:
+        """Text for a run of token ids"""
+        async with self._semaphore:
+            data = await upstream.post_json(self.base_url, "/detokenize", {"tokens": tokens}, timeout=self.timeout)
+        return data.get("content", "") if isinstance(data, dict) else ""
+
+    async def count(self, texts: List[str], fallback: bool = True) -> List[Optional[int]]:
+        """Token count per text, in input order
+
+        Concurrent callers asking for the same uncached text share one
+        /tokenize call. A text /tokenize could not count gets the character
+        estimate, or None with fallback=False.
+        """
+        keys = [self._key(text) for text in texts]
+        counts: List[Optional[int]] = [0] * len(texts)
+        waits: Dict[bytes, asyncio.Future] = {}
+        for i, key in enumerate(keys):
+            cached = self.counts.get(key)
+            if cached is not None:
+                self.counts.move_to_end(key)
+                counts[i] = cached
+                self.hits += 1
+            elif key not in waits:
+                future = self._pending.get(key)
+                if future is None:
+                    self.misses += 1
+                    future = asyncio.ensure_future(self._fetch(key, texts[i]))
+                    self._pending[key] = future
+                waits[key] = future
+        if waits:
+            # Shielded so a cancelled caller does not cancel a shared lookup
+            fetched = dict(zip(waits, await asyncio.gather(*(asyncio.shield(f) for f in waits.values()))))
+            for i, key in enumerate(keys):
+                if key in fetched:
+                    counts[i] = fetched[key]
+                    if counts[i] is None and fallback:
+                        counts[i] = estimate_tokens(texts[i])
+        return counts
+
+    async def _fetch(self, key: bytes, text: str) -> Optional[int]:
+        try:
+            tokens = len(await self.tokenize(text))
+        except Exception as e:
+            # Nothing is memoized, so a later call asks again
+            self.fallbacks += 1
+            logger.debug(f"Tokenize failed: {e}")
+            return None
+        else:
+            self.counts[key] = tokens
+            while len(self.counts) > self.max_entries:
+                self.counts.popitem(last=False)
+            return tokens
+        finally:
+            self._pending.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.counts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+        }
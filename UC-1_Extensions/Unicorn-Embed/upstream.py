@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Shared async HTTP client for llama-server upstream calls
+Keeps a pooled keep-alive connection set per backend so concurrent
+requests overlap instead of serializing on the event loop, and slot
+limits that keep in-flight requests at a backend's --parallel count
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import ERRORS, UPSTREAM_LATENCY, backend_labels
+
+logger = logging.getLogger(__name__)
+
+# httpx logs every request at INFO, which floods the wrapper logs under load
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def _parse_backend_limits(spec: str) -> Dict[str, int]:
+    """Parse UPSTREAM_BACKEND_LIMITS, e.g. "9991=64,localhost:9992=8"
+
+    Keys are matched against the backend's "host:port" first, then its port.
+    """
+    limits: Dict[str, int] = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry or "=" not in entry:
+            continue
+        key, value = entry.rsplit("=", 1)
+        try:
+            limits[key.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid upstream limit: {entry}")
+    return limits
+
+
+class UpstreamPool:
+    """One pooled httpx.AsyncClient per llama-server backend"""
+
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+        timeout: float = 60.0,
+        backend_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self.backend_limits: Dict[str, int] = dict(backend_limits or {})
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    @classmethod
+    def from_env(cls) -> "UpstreamPool":
+        return cls(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32")),
+            max_keepalive=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "16")),
+            timeout=float(os.getenv("UPSTREAM_TIMEOUT", "60")),
+            backend_limits=_parse_backend_limits(os.getenv("UPSTREAM_BACKEND_LIMITS", "")),
+        )
+
+    def set_backend_limit(self, base_url: str, max_connections: int):
+        """Override the connection limit for one backend (before first use)"""
+        self.backend_limits[urlsplit(base_url).netloc] = max_connections
+
+    def _limit_for(self, base_url: str) -> int:
+        netloc = urlsplit(base_url).netloc
+        port = netloc.rsplit(":", 1)[-1]
+        return self.backend_limits.get(netloc, self.backend_limits.get(port, self.max_connections))
+
+    def client(self, base_url: str) -> httpx.AsyncClient:
+        """Get (or lazily create) the pooled client for a backend"""
+        base_url = base_url.rstrip("/")
+        client = self.clients.get(base_url)
+        if client is None or client.is_closed:
+            max_connections = self._limit_for(base_url)
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=min(self.max_keepalive, max_connections),
+                ),
+            )
+            self.clients[base_url] = client
+            logger.info(f"Opened upstream pool for {base_url} (max {max_connections} connections)")
+        return client
+
+    async def get(self, base_url: str, path: str, timeout: Optional[float] = None) -> httpx.Response:
+        """GET a backend path, returning the raw response"""
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        return await self.client(base_url).get(path, **kwargs)
+
+    async def post_json(self, base_url: str, path: str, payload: Any, timeout: Optional[float] = None) -> Any:
+        """POST JSON to a backend path and return the decoded JSON body"""
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        labels = backend_labels(base_url)
+        start = time.perf_counter()
+        try:
+            response = await self.client(base_url).post(path, json=payload, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except Exception:
+            ERRORS.labels(model=labels["model"], endpoint=path).inc()
+            raise
+        finally:
+            UPSTREAM_LATENCY.labels(path=path, **labels).observe(time.perf_counter() - start)
+
+    async def aclose(self):
+        """Close every pooled client"""
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+
+class BackendSlots:
+    """Concurrency limit matching a llama-server's --parallel slot count
+
+    With as many requests in flight as the backend has slots, continuous
+    batching keeps every slot busy; more would only queue inside llama-server.
+    Usable as an async context manager or via acquire()/release().
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._semaphore = asyncio.Semaphore(slots)
+        # Permits to retire on release after shrinking while busy
+        self._owed = 0
+        self.busy = 0
+        self.waiting = 0
+        self.peak_busy = 0
+        self.acquired = 0
+        self._busy_seconds = 0.0
+        self._started = self._mark = time.monotonic()
+
+    def _account(self):
+        now = time.monotonic()
+        self._busy_seconds += self.busy * (now - self._mark)
+        self._mark = now
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self._account()
+        self.busy += 1
+        self.acquired += 1
+        self.peak_busy = max(self.peak_busy, self.busy)
+
+    def release(self):
+        self._account()
+        self.busy -= 1
+        if self._owed:
+            self._owed -= 1
+        else:
+            self._semaphore.release()
+
+    async def resize(self, slots: int):
+        """Match a backend relaunched with a different --parallel, even while slots are held"""
+        slots = max(1, slots)
+        change, self.slots = slots - self.slots, slots
+        # Growing hands out new permits (first cancelling any still owed from a shrink)
+        while change > 0 and self._owed:
+            self._owed, change = self._owed - 1, change - 1
+        for _ in range(change):
+            self._semaphore.release()
+        # Shrinking takes idle permits now and the rest as busy slots are released
+        while change < 0 and not self._semaphore.locked():
+            await self._semaphore.acquire()
+            change += 1
+        self._owed += max(0, -change)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        self._account()
+        elapsed = self._mark - self._started
+        return {
+            "slots": self.slots,
+            "busy": self.busy,
+            "waiting": self.waiting,
+            "peak_busy": self.peak_busy,
+            "requests": self.acquired,
+            # Average fraction of slots occupied since start
+            "utilization": round(self._busy_seconds / (self.slots * elapsed), 4) if elapsed > 0 else 0.0,
+        }
+
+
+# Process-wide pool shared by every upstream path
+upstream = UpstreamPool.from_env()
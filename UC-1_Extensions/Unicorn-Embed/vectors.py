@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Vector helpers shared by the embedding and rerank endpoints
+Packing float32 vectors for base64 / binary responses and vectorized
+cosine scoring with partial top-k selection
+"""
+
+import base64
+import struct
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+# Raw binary response: 16-byte header followed by a row-major
+# little-endian float32 matrix of shape (rows, dim)
+#   magic b"UEMB" | version u16 | dtype u16 (0 = float32) | rows u32 | dim u32
+BINARY_MEDIA_TYPE = "application/octet-stream"
+BINARY_MAGIC = b"UEMB"
+BINARY_VERSION = 1
+BINARY_DTYPE_FLOAT32 = 0
+BINARY_HEADER = struct.Struct("<4sHHII")
+
+ENCODING_FORMATS = ("float", "base64", "binary")
+
+
+def to_float32(vector) -> np.ndarray:
+    """View or convert a vector as little-endian float32"""
+    return np.asarray(vector, dtype="<f4")
+
+
+def encode_base64(vector) -> str:
+    """OpenAI-compatible base64 embedding: packed little-endian float32"""
+    return base64.b64encode(to_float32(vector).tobytes()).decode("ascii")
+
+
+def format_embedding(vector, encoding_format: str = "float") -> Union[List[float], str]:
+    """Render one vector for a JSON response"""
+    if encoding_format == "base64":
+        return encode_base64(vector)
+    return to_float32(vector).tolist()
+
+
+def pack_matrix(vectors: Sequence) -> bytes:
+    """Header plus contiguous float32 matrix for the binary response mode"""
+    if len(vectors):
+        matrix = np.ascontiguousarray(np.stack([to_float32(v) for v in vectors]))
+    else:
+        matrix = np.zeros((0, 0), dtype="<f4")
+    rows, dim = matrix.shape
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_DTYPE_FLOAT32, rows, dim) + matrix.tobytes()
+
+
+def unpack_matrix(payload: bytes) -> np.ndarray:
+    """Inverse of pack_matrix, for internal clients"""
+    magic, version, dtype, rows, dim = BINARY_HEADER.unpack_from(payload)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION or dtype != BINARY_DTYPE_FLOAT32:
+        raise ValueError("Not a Unicorn embedding matrix")
+    return np.frombuffer(payload, dtype="<f4", count=rows * dim, offset=BINARY_HEADER.size).reshape(rows, dim)
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """L2-normalize each row; all-zero rows stay zero instead of becoming NaN"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def stack_rows(vectors: Sequence[Optional[np.ndarray]], dim: int) -> np.ndarray:
+    """Stack vectors into one (n, dim) float32 matrix; missing vectors become zero rows"""
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            matrix[i] = vector
+    return matrix
+
+
+def cosine_scores(query, documents) -> np.ndarray:
+    """Cosine similarity of one query vector against a (n, dim) document matrix"""
+    return normalize_rows(documents) @ normalize_rows(query)
+
+
+def top_k_indices(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """Indices of the k highest scores, best first (all of them if k is falsy)
+
+    argpartition selects the top k in O(n); only those k are then sorted.
+    """
+    n = len(scores)
+    if not k or k >= n:
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def rank_results(
+    scores: np.ndarray,
+    documents: Sequence[str],
+    top_k: Optional[int] = None,
+    return_documents: bool = True,
+    order: Optional[np.ndarray] = None,
+) -> List[dict]:
+    """Build /v1/rerank result entries, best first
+
+    `order` overrides ranking by score (the cascade mode ranks survivors of
+    the second stage above everything the first stage dropped).
+    """
+    if order is None:
+        order = top_k_indices(scores, top_k)
+    elif top_k:
+        order = order[:top_k]
+    results = []
+    for i in order:
+        i = int(i)
+        result = {"index": i}
+        if return_documents:
+            result["document"] = documents[i]
+        result["relevance_score"] = float(scores[i])
+        results.append(result)
+    return results